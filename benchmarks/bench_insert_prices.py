@@ -0,0 +1,86 @@
+# DB.insert_into_prices のベンチマーク
+# 旧実装（iterrowsで1行ずつINSERT）と一括INSERTの行/秒を比較する
+# 実行例：python benchmarks/bench_insert_prices.py --ticker 7203.T --rows 5000
+# 注意：1900年代の日付で合成データを書き込み、計測後に削除する
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy
+import pandas
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from database import DB
+
+# 実データと衝突しない日付範囲
+SYNTHETIC_BEGIN = "1900-01-01"
+SYNTHETIC_END = "1999-12-31"
+
+# 営業日ベースの合成OHLCVを作る
+def make_prices(rows: int) -> pandas.DataFrame:
+    index = pandas.bdate_range(SYNTHETIC_BEGIN, periods=rows)
+    rng = numpy.random.default_rng(0)
+    close = 1000 + numpy.cumsum(rng.normal(0, 10, rows))
+    return pandas.DataFrame({
+        "Open": close + rng.normal(0, 2, rows),
+        "High": close + 5,
+        "Low": close - 5,
+        "Close": close,
+        "Volume": rng.integers(1_000, 1_000_000, rows),
+    }, index=index)
+
+# 旧実装と同じ1行1往復のINSERT
+def insert_legacy(ticker: str, prices: pandas.DataFrame) -> int:
+    count = 0
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("START TRANSACTION")
+        for index, row in prices.iterrows():
+            cur.execute("""
+                    INSERT INTO prices (security_id, date, time, open, high, low, close, volume)
+                    SELECT s.id, %s, %s, %s, %s, %s, %s, %s
+                    FROM securities s
+                    WHERE s.code = %s
+                """, (index.date(), DB.DAILY_TIME, row["Open"], row["High"], row["Low"], row["Close"], row["Volume"], ticker))
+            count += cur.rowcount
+        conn.commit()
+    return count
+
+def cleanup(security_id: int) -> None:
+    with DB.connection() as conn:
+        conn.cursor().execute("""
+            DELETE FROM prices
+            WHERE security_id = %s AND date BETWEEN %s AND %s
+        """, (security_id, SYNTHETIC_BEGIN, SYNTHETIC_END))
+
+def measure(name: str, func, rows: int) -> None:
+    begin = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - begin
+    print(f"{name:>8}: {count} rows / {elapsed:.3f} s = {rows / elapsed:,.0f} rows/s")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ticker", default="7203.T")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=DB.INSERT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    db = DB()
+    security_id = db.get_security_id(args.ticker)
+    if security_id is None:
+        raise SystemExit(f"{args.ticker} は securities に登録されていません")
+
+    prices = make_prices(args.rows)
+
+    cleanup(security_id)
+    try:
+        measure("legacy", lambda: insert_legacy(args.ticker, prices), args.rows)
+        cleanup(security_id)
+        measure("bulk", lambda: db.insert_into_prices(args.ticker, prices, "daily", args.chunk_size), args.rows)
+    finally:
+        cleanup(security_id)
+
+if __name__ == "__main__":
+    main()
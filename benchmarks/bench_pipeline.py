@@ -0,0 +1,293 @@
+# get_priceの処理全体のベンチマーク　コミット間で比べられるように結果をJSONに書き出す
+# ローカルのMySQL/MariaDB（--start-serverで一時ディレクトリに起動するか、--hostなどで指定した既存のサーバー）に
+# init.sqlとresource/csvでマスタを作り、株価はLocalPriceProvider（ネットワークなし）の合成データを使う
+# シナリオ：
+#   backfill：全銘柄（--universeで件数を絞れる）の--years年分の日足をinsert_into_pricesで書き込む
+#   select_long：--years年分のselect_from_prices（日足・週足）
+#   get_price_cold：DBにない銘柄のBackend.get_price（取得元からの取得と書き込みを含む）
+#   get_price_db：DBにはあるが結果キャッシュにない場合のBackend.get_price
+#   get_price_warm：結果キャッシュにある場合のBackend.get_price
+#   technical_analysis：do_technical_analysis
+#   tools_get_price：Tools.get_price（JSONにできる形への変換を含む）
+# シナリオごとにtracing.tracerの段階ごとの集計も結果に含める
+# 実行例：python benchmarks/bench_pipeline.py --start-server --output bench-$(git rev-parse --short HEAD).json
+#         python benchmarks/bench_pipeline.py --host 127.0.0.1 --port 3306 --user root --database stocks_bench --reset --baseline bench-abc1234.json
+# 注意：既存のサーバーを使う場合はベンチマーク専用のデータベースを指定すること（--resetを付けると作り直す）
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import MySQLdb
+import numpy
+import pandas
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from database import DB, CountingCursor
+from price_provider import LocalPriceProvider
+from tracing import tracer
+import kabu
+import tools
+
+# 合成データの最後の日（実行した日によって結果が変わらないように固定する）
+END_DATE = dt.date(2024, 12, 30)
+
+# 一時ディレクトリにMySQL/MariaDBを起動する（終了時に止めてディレクトリを消す）
+class LocalServer:
+    def __init__(self, port: int = 0):
+        self.port = port or self._free_port()
+        self.directory = Path(tempfile.mkdtemp(prefix="kabu-bench-"))
+        self.process: subprocess.Popen | None = None
+
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
+
+    def start(self, timeout: float = 60.0) -> dict:
+        server = shutil.which("mariadbd") or shutil.which("mysqld")
+        if server is None:
+            raise SystemExit("mariadbd / mysqld が見つかりません（--hostなどで既存のサーバーを指定してください）")
+
+        datadir = self.directory / "data"
+        install = shutil.which("mariadb-install-db") or shutil.which("mysql_install_db")
+        if install is not None and "mariadb" in Path(server).name:
+            subprocess.run([install, f"--datadir={datadir}", "--auth-root-authentication-method=normal", "--skip-test-db"],
+                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            subprocess.run([server, "--initialize-insecure", f"--datadir={datadir}"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        args = [
+            server,
+            f"--datadir={datadir}",
+            f"--port={self.port}",
+            "--bind-address=127.0.0.1",
+            f"--socket={self.directory / 'mysqld.sock'}",
+            f"--pid-file={self.directory / 'mysqld.pid'}",
+            f"--log-error={self.directory / 'mysqld.err'}",
+            "--local-infile=1",
+        ]
+        # rootで実行する場合はmysqldがユーザーの指定を求める
+        if hasattr(os, "getuid") and os.getuid() == 0:
+            args.append("--user=root")
+        self.process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        connect_args = dict(host="127.0.0.1", port=self.port, user="root", passwd="")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                MySQLdb.connect(**connect_args, connect_timeout=2).close()
+                return connect_args
+            except MySQLdb.OperationalError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    log = (self.directory / "mysqld.err")
+                    raise SystemExit(f"サーバーを起動できませんでした\n{log.read_text(errors='replace') if log.exists() else ''}")
+                time.sleep(0.5)
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+# init.sqlの文を順に返す（LOAD DATAのパスはresource/csvに置き換える）
+def init_statements(csv_directory: Path) -> list[str]:
+    text = (ROOT / "init.sql").read_text(encoding="utf-8-sig").replace("\r\n", "\n")
+    text = text.replace("'/csv/", f"'{csv_directory.as_posix()}/")
+    lines = [line for line in text.split("\n") if not line.lstrip().startswith("--")]
+    return [statement.strip() for statement in "\n".join(lines).split(";\n") if statement.strip()]
+
+# データベースを作ってinit.sqlを流す　既にテーブルがある場合は--resetを付けない限り何もしない
+def seed(connect_args: dict, database: str, reset: bool) -> None:
+    conn = MySQLdb.connect(**connect_args, charset="utf8mb4", local_infile=1, autocommit=True)
+    try:
+        cur = conn.cursor()
+        if reset:
+            cur.execute(f"DROP DATABASE IF EXISTS `{database}`")
+        cur.execute(f"CREATE DATABASE IF NOT EXISTS `{database}` CHARACTER SET utf8mb4")
+        cur.execute(f"USE `{database}`")
+        cur.execute("SHOW TABLES LIKE 'securities'")
+        if cur.fetchone() is not None:
+            return
+
+        for statement in init_statements(ROOT / "resource" / "csv"):
+            cur.execute(statement)
+    finally:
+        conn.close()
+
+# 所要時間（秒）のリストを集計する
+def stats(seconds: list[float], rows: int = 0, queries: int = 0) -> dict:
+    values = numpy.array(seconds) * 1000
+    result = dict(
+        count = len(values),
+        total_ms = round(float(values.sum()), 3),
+        mean_ms = round(float(values.mean()), 3),
+        p50_ms = round(float(numpy.percentile(values, 50)), 3),
+        p95_ms = round(float(numpy.percentile(values, 95)), 3),
+        min_ms = round(float(values.min()), 3),
+        max_ms = round(float(values.max()), 3),
+        queries = queries,
+    )
+    if rows:
+        result["rows"] = rows
+        result["rows_per_s"] = round(float(rows / (values.sum() / 1000)), 1)
+    return result
+
+# funcを呼び出しごとに計測する　funcは処理した行数を返す
+# 段階ごとの集計（tracer）とクエリ数はシナリオごとに取り直す
+def run_scenario(results: dict, name: str, calls: list) -> None:
+    tracer.reset()
+    queries = CountingCursor.total_queries
+    seconds = []
+    rows = 0
+    for call in calls:
+        started = time.perf_counter()
+        rows += call() or 0
+        seconds.append(time.perf_counter() - started)
+
+    results["scenarios"][name] = stats(seconds, rows, CountingCursor.total_queries - queries)
+    results["stages"][name] = tracer.summary()
+    print(f"{name:>20}: {json.dumps(results['scenarios'][name], ensure_ascii=False)}")
+
+def delete_prices(security_ids: list[int]) -> None:
+    if not security_ids:
+        return
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        placeholders = ", ".join(["%s"] * len(security_ids))
+        cur.execute(f"DELETE FROM prices WHERE security_id IN ({placeholders})", tuple(security_ids))
+        cur.execute(f"DELETE FROM price_empty_spans WHERE security_id IN ({placeholders})", tuple(security_ids))
+
+def git_commit() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip())
+        return dict(commit=commit, dirty=dirty)
+    except (OSError, subprocess.CalledProcessError):
+        return dict(commit=None, dirty=None)
+
+# 前回の結果とp50を比べて表示する
+def compare(results: dict, baseline_path: str) -> None:
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    print(f"\nbaseline: {baseline['meta'].get('commit')} -> current: {results['meta'].get('commit')}")
+    for name, current in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None or before["p50_ms"] == 0:
+            continue
+        print(f"{name:>20}: p50 {before['p50_ms']:10.3f} ms -> {current['p50_ms']:10.3f} ms ({current['p50_ms'] / before['p50_ms']:.2f}x)")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start-server", action="store_true", help="一時ディレクトリにMySQL/MariaDBを起動する")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--database", default="stocks_bench")
+    parser.add_argument("--reset", action="store_true", help="データベースを作り直す")
+    parser.add_argument("--years", type=int, default=5, help="合成する日足の年数")
+    parser.add_argument("--universe", type=int, default=0, help="書き込む銘柄数（0の場合はプライム市場の全銘柄）")
+    parser.add_argument("--cold", type=int, default=10, help="get_price_coldで使う、DBに入れない銘柄数")
+    parser.add_argument("--samples", type=int, default=20, help="select_long、get_priceで使う銘柄数")
+    parser.add_argument("--repeat", type=int, default=5, help="warmのシナリオの繰り返し回数")
+    parser.add_argument("--latency", type=float, default=0.0, help="取得元の1回ごとの遅延（秒）")
+    parser.add_argument("--skip-backfill", action="store_true", help="書き込み済みのデータを使う")
+    parser.add_argument("--output", default="bench-pipeline.json")
+    parser.add_argument("--baseline", default=None, help="比べる前回の結果のJSON")
+    args = parser.parse_args()
+
+    server = LocalServer() if args.start_server else None
+    try:
+        if server is not None:
+            connect_args = server.start()
+        else:
+            connect_args = dict(host=args.host, port=args.port, user=args.user, passwd=args.password)
+        seed(connect_args, args.database, args.reset)
+        DB.CONNECT_ARGS = dict(connect_args, db=args.database, connect_timeout=10)
+        DB.refresh_master()
+
+        backend = kabu.Backend()
+        provider = LocalPriceProvider(calendar=backend.calendar, latency=args.latency)
+        kabu.Backend.provider = provider
+        backend.price_cache.clear()
+
+        end = END_DATE
+        begin = backend.calendar.next_session(end.replace(year=end.year - args.years))
+        universe = [row[0] for row in DB.fetchall("SELECT code FROM securities ORDER BY id")]
+        if args.universe > 0:
+            universe = universe[:args.universe + args.cold]
+        cold = universe[len(universe) - args.cold:] if args.cold > 0 else []
+        loaded = universe[:len(universe) - len(cold)]
+        samples = loaded[::max(1, len(loaded) // args.samples)][:args.samples]
+        delete_prices([backend.db.get_security_id(ticker) for ticker in cold])
+
+        results = dict(
+            meta = dict(
+                **git_commit(),
+                timestamp = dt.datetime.now().isoformat(timespec="seconds"),
+                python = platform.python_version(),
+                numpy = numpy.__version__,
+                pandas = pandas.__version__,
+                server = DB.fetchone("SELECT VERSION()")[0],
+                begin = begin.isoformat(),
+                end = end.isoformat(),
+                universe = len(loaded),
+                args = vars(args),
+            ),
+            scenarios = {},
+            stages = {},
+        )
+
+        if not args.skip_backfill:
+            # 取得元からの取得は計測に含めない
+            histories = {}
+            for i in range(0, len(loaded), 100):
+                histories.update(provider.history_many(loaded[i:i + 100], begin, end))
+            run_scenario(results, "backfill", [lambda ticker=ticker: backend.db.insert_into_prices(ticker, histories[ticker], "daily") for ticker in loaded])
+            del histories
+
+        start_dt = dt.datetime.combine(begin, dt.time())
+        end_dt = dt.datetime.combine(end, dt.time())
+        run_scenario(results, "select_long", [lambda ticker=ticker: len(backend.db.select_from_prices(ticker, start_dt, end_dt, "daily")) for ticker in samples])
+        run_scenario(results, "select_long_weekly", [lambda ticker=ticker: len(backend.db.select_from_prices(ticker, start_dt, end_dt, "weekly")) for ticker in samples])
+
+        def get_price(ticker: str) -> int:
+            return len(backend.get_price(dict(ticker=ticker, begin_range=start_dt, end_range=end_dt, chart_granularity="daily")))
+
+        backend.price_cache.clear()
+        run_scenario(results, "get_price_cold", [lambda ticker=ticker: get_price(ticker) for ticker in cold])
+        backend.price_cache.clear()
+        run_scenario(results, "get_price_db", [lambda ticker=ticker: get_price(ticker) for ticker in samples])
+        run_scenario(results, "get_price_warm", [lambda ticker=ticker: get_price(ticker) for _ in range(args.repeat) for ticker in samples])
+
+        frames = [backend.get_price(dict(ticker=ticker, begin_range=start_dt, end_range=end_dt, chart_granularity="daily")) for ticker in samples]
+        run_scenario(results, "technical_analysis", [lambda df=df: len(backend.do_technical_analysis(df.copy())) for df in frames])
+
+        t = tools.Tools()
+        run_scenario(results, "tools_get_price", [lambda ticker=ticker: len(t.get_price(dict(ticker=ticker, begin_range=start_dt, end_range=end_dt, chart_granularity="daily"))) for _ in range(args.repeat) for ticker in samples])
+
+        Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n{args.output} に書き出しました")
+        if args.baseline:
+            compare(results, args.baseline)
+    finally:
+        if DB.pool is not None:
+            DB.pool.close()
+        if server is not None:
+            server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# pricesテーブルのレイアウトのベンチマーク
+# 旧レイアウト（AUTO_INCREMENTの主キー＋uq_prices、日足のtimeはNULL）、
+# 主キー (security_id, date, time) のクラスタインデックス（migrations/003）、
+# それを年ごとにRANGEパーティションで分けたもの（migrations/004）を、同じ合成データで比較する
+# 計測するのは一括INSERTの行/秒と、1銘柄の期間を読み出すSELECTの待ち時間（p50/p95/p99）
+# データは全プライム銘柄（securitiesに登録済みのもの）× years年分をLocalPriceProviderで合成する
+# 実行例：python benchmarks/bench_prices_layout.py --years 20
+#         python benchmarks/bench_prices_layout.py --tickers 100 --years 5 --layouts legacy clustered
+# 注意：bench_prices_{layout} というテーブルを作り、計測後に削除する（--keepで残す）
+import argparse
+import datetime as dt
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from database import DB
+from price_provider import LocalPriceProvider
+
+COLUMNS = """
+    open DECIMAL(15,4),
+    high DECIMAL(15,4),
+    low DECIMAL(15,4),
+    close DECIMAL(15,4),
+    volume BIGINT,
+"""
+
+PARTITIONS = ",\n".join(
+    ["PARTITION p_old VALUES LESS THAN (2000)"]
+    + [f"PARTITION p{year} VALUES LESS THAN ({year + 1})" for year in range(2000, 2031)]
+    + ["PARTITION pmax VALUES LESS THAN MAXVALUE"]
+)
+
+# レイアウトごとのCREATE TABLE、日足のtimeの値、日足を絞り込む条件
+# 合成データなのでsecuritiesへの外部キーは付けない
+LAYOUTS = {
+    "legacy": (f"""
+        CREATE TABLE bench_prices_legacy (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            security_id INT NOT NULL,
+            date DATE NOT NULL,
+            time TIME NULL,
+            {COLUMNS}
+            UNIQUE KEY uq_prices (security_id, date, time)
+        )
+    """, None, "time IS NULL"),
+    "clustered": (f"""
+        CREATE TABLE bench_prices_clustered (
+            security_id INT NOT NULL,
+            date DATE NOT NULL,
+            time TIME NOT NULL DEFAULT '00:00:00',
+            {COLUMNS}
+            PRIMARY KEY (security_id, date, time)
+        )
+    """, DB.DAILY_TIME, "time = '00:00:00'"),
+    "partitioned": (f"""
+        CREATE TABLE bench_prices_partitioned (
+            security_id INT NOT NULL,
+            date DATE NOT NULL,
+            time TIME NOT NULL DEFAULT '00:00:00',
+            {COLUMNS}
+            PRIMARY KEY (security_id, date, time)
+        )
+        PARTITION BY RANGE (YEAR(date)) ({PARTITIONS})
+    """, DB.DAILY_TIME, "time = '00:00:00'"),
+}
+
+def execute(sql: str, params: tuple = ()) -> None:
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, params)
+        finally:
+            cur.close()
+
+def drop_table(layout: str) -> None:
+    execute(f"DROP TABLE IF EXISTS bench_prices_{layout}")
+
+def percentiles(values: list[float]) -> str:
+    p50, p95, p99 = numpy.percentile(numpy.array(values) * 1000, [50, 95, 99])
+    return f"p50 {p50:8.2f} ms  p95 {p95:8.2f} ms  p99 {p99:8.2f} ms"
+
+# 全銘柄の行をchunk_size件ずつINSERTしてcommitする（DB.insert_into_pricesと同じ書き方）
+def bench_insert(layout: str, tickers: list[str], provider: LocalPriceProvider, begin: dt.date, end: dt.date, chunk_size: int) -> None:
+    _, daily_time, _ = LAYOUTS[layout]
+    sql = f"""
+        INSERT INTO bench_prices_{layout} (security_id, date, time, open, high, low, close, volume)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            open = VALUES(open),
+            high = VALUES(high),
+            low = VALUES(low),
+            close = VALUES(close),
+            volume = VALUES(volume)
+    """
+
+    rows = 0
+    elapsed = 0.0
+    latencies = []
+    with DB.connection() as conn:
+        cur = conn.cursor()
+        try:
+            for security_id, ticker in enumerate(tickers, start=1):
+                prices = provider.history(ticker, begin, end)
+                dates = prices.index.date
+                batch = list(zip([security_id] * len(prices), dates, [daily_time] * len(prices),
+                                 *(prices[col].tolist() for col in ["Open", "High", "Low", "Close", "Volume"])))
+
+                for i in range(0, len(batch), chunk_size):
+                    started = time.perf_counter()
+                    cur.execute("START TRANSACTION")
+                    cur.executemany(sql, batch[i:i + chunk_size])
+                    conn.commit()
+                    latency = time.perf_counter() - started
+                    latencies.append(latency)
+                    elapsed += latency
+                rows += len(batch)
+        finally:
+            cur.close()
+
+    print(f"{layout:>12} insert: {rows:,} rows / {elapsed:.1f} s = {rows / elapsed:,.0f} rows/s  chunk {percentiles(latencies)}")
+
+# ランダムな銘柄と期間（1年・5年）を1銘柄ずつ読み出す（DB.select_from_pricesと同じ形のSELECT）
+def bench_select(layout: str, tickers: list[str], begin: dt.date, end: dt.date, queries: int, seed: int) -> None:
+    _, _, daily_condition = LAYOUTS[layout]
+    sql = f"""
+        SELECT {DB.PRICE_SELECT_COLUMNS}
+        FROM bench_prices_{layout}
+        WHERE security_id = %s AND date BETWEEN %s AND %s AND {daily_condition}
+        ORDER BY date ASC
+    """
+
+    rng = random.Random(seed)
+    span = (end - begin).days
+    for years in (1, 5):
+        latencies = []
+        rows = 0
+        for _ in range(queries):
+            security_id = rng.randint(1, len(tickers))
+            length = min(span, 365 * years)
+            first = begin + dt.timedelta(days=rng.randint(0, span - length))
+            started = time.perf_counter()
+            values = DB.fetch_array(sql, (security_id, first, first + dt.timedelta(days=length)), 6)
+            latencies.append(time.perf_counter() - started)
+            rows += len(values)
+
+        print(f"{layout:>12} select {years}y: {queries} queries, {rows / queries:,.0f} rows/query  {percentiles(latencies)}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=0, help="銘柄数（0の場合はsecuritiesに登録済みの全銘柄）")
+    parser.add_argument("--years", type=int, default=20)
+    parser.add_argument("--layouts", nargs="+", choices=list(LAYOUTS), default=list(LAYOUTS))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=DB.INSERT_CHUNK_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+
+    tickers = sorted(DB.get_master().tickers())
+    if args.tickers > 0:
+        tickers = tickers[:args.tickers] if len(tickers) >= args.tickers else [f"{i:04d}.T" for i in range(1000, 1000 + args.tickers)]
+
+    end = dt.date.today() - dt.timedelta(days=1)
+    begin = end.replace(year=end.year - args.years)
+    provider = LocalPriceProvider(origin_year=begin.year)
+    print(f"{len(tickers)} tickers x {args.years} years ({begin} - {end})")
+
+    for layout in args.layouts:
+        drop_table(layout)
+        execute(LAYOUTS[layout][0])
+        try:
+            bench_insert(layout, tickers, provider, begin, end, args.chunk_size)
+            execute(f"ANALYZE TABLE bench_prices_{layout}")
+            bench_select(layout, tickers, begin, end, args.queries, args.seed)
+        finally:
+            if not args.keep:
+                drop_table(layout)
+
+if __name__ == "__main__":
+    main()
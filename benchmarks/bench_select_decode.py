@@ -0,0 +1,73 @@
+# DB.select_from_prices の行デコードのベンチマーク
+# 旧実装（行ごとにpandas.to_datetime、Decimalを列ごとにto_numeric）と
+# fetch_array + price_frame（float64配列から列単位で型付け）を 1k / 10k / 100k 行で比較する
+# DBは使わず、それぞれのSELECTがドライバから返す形のタプルを合成して計測する
+# 実行例：python benchmarks/bench_select_decode.py
+import argparse
+import datetime as dt
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+import numpy
+import pandas
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from database import DB
+
+# 旧SELECT（date, time, DECIMAL×4, BIGINT）の結果の形
+def make_legacy_rows(n: int) -> list[tuple]:
+    begin = dt.date(1990, 1, 1)
+    rng = numpy.random.default_rng(0)
+    close = (1000 + numpy.cumsum(rng.normal(0, 10, n))).round(4)
+    return [
+        (begin + dt.timedelta(days=i), "00:00:00", Decimal(f"{c:.4f}"), Decimal(f"{c + 5:.4f}"), Decimal(f"{c - 5:.4f}"), Decimal(f"{c:.4f}"), 1000 + i)
+        for i, c in enumerate(close.tolist())
+    ]
+
+# PRICE_SELECT_COLUMNS（日数, DOUBLE×4, BIGINT）の結果の形
+def make_rows(n: int) -> list[tuple]:
+    begin = (dt.date(1990, 1, 1) - dt.date(1970, 1, 1)).days
+    rng = numpy.random.default_rng(0)
+    close = (1000 + numpy.cumsum(rng.normal(0, 10, n))).round(4)
+    return [(begin + i, c, c + 5, c - 5, c, 1000 + i) for i, c in enumerate(close.tolist())]
+
+# 旧実装のデコード
+def decode_legacy(rows: list[tuple]) -> pandas.DataFrame:
+    dates = [pandas.to_datetime(str(d) + " " + str(t)) for d, t, *_ in rows]
+    ohlcv = [row[2:] for row in rows]
+
+    ohlcv_column = ["Open", "High", "Low", "Close", "Volume"]
+    result_df = pandas.DataFrame(ohlcv, columns=ohlcv_column, index=pandas.DatetimeIndex(dates))
+    for col in ohlcv_column:
+        result_df[col] = pandas.to_numeric(result_df[col], errors="coerce")
+    return result_df
+
+# 新実装のデコード（fetch_arrayのチャンク変換とprice_frame）
+def decode_vectorized(rows: list[tuple], chunk_size: int = 50000) -> pandas.DataFrame:
+    chunks = [numpy.array(rows[i:i + chunk_size], dtype=numpy.float64) for i in range(0, len(rows), chunk_size)]
+    return DB.price_frame(numpy.concatenate(chunks))
+
+def measure(func, rows, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func(rows)
+        best = min(best, time.perf_counter() - begin)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'legacy':>10} {'vectorized':>12} {'speedup':>8}")
+    for n in args.sizes:
+        legacy = measure(decode_legacy, make_legacy_rows(n), args.repeat)
+        vectorized = measure(decode_vectorized, make_rows(n), args.repeat)
+        print(f"{n:>8} {legacy:>9.4f}s {vectorized:>11.4f}s {legacy / vectorized:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# tools.data_frame_to_dict のベンチマーク
+# 旧実装（astype(object) → セルごとのmap → to_dict）と、列単位で変換してから行に組み立てる新実装を比較する
+# 両者の出力が一致すること（NaNどうしは等しいとみなす）も確認する
+# 実行例：python benchmarks/bench_serialize.py
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy
+import pandas
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from tools import data_frame_to_dict
+
+# get_priceの結果の形（Date列＋OHLCV、テクニカル指標の列はNaNを含む）
+def make_frame(n: int) -> pandas.DataFrame:
+    rng = numpy.random.default_rng(0)
+    close = 1000 + numpy.cumsum(rng.normal(0, 10, n))
+    sma = pandas.Series(close).rolling(25).mean().to_numpy()
+    return pandas.DataFrame({
+        "Date": pandas.date_range("1990-01-01", periods=n, freq="D"),
+        "Open": close.round(1),
+        "High": (close + 5).round(1),
+        "Low": (close - 5).round(1),
+        "Close": close.round(1),
+        "Volume": rng.integers(10_000, 5_000_000, n),
+        "SMA_25": sma.round(2),
+    })
+
+# 旧実装
+def serialize_legacy(df: pandas.DataFrame) -> list[dict]:
+    df = df.astype(object)
+    df = df.map(lambda x: x.isoformat() if hasattr(x, "isoformat") else x.item() if hasattr(x, "item") else x)
+    return df.to_dict(orient="records")
+
+def same_value(a, b) -> bool:
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return type(a) is type(b) and a == b
+
+def same_records(a: list[dict], b: list[dict]) -> bool:
+    return len(a) == len(b) and all(x.keys() == y.keys() and all(same_value(x[k], y[k]) for k in x) for x, y in zip(a, b))
+
+def measure(func, df, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func(df)
+        best = min(best, time.perf_counter() - begin)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'legacy':>10} {'vectorized':>12} {'speedup':>8} {'equal':>6}")
+    for n in args.sizes:
+        df = make_frame(n)
+        equal = same_records(serialize_legacy(df), data_frame_to_dict(df))
+        legacy = measure(serialize_legacy, df, args.repeat)
+        vectorized = measure(data_frame_to_dict, df, args.repeat)
+        print(f"{n:>8} {legacy:>9.4f}s {vectorized:>11.4f}s {legacy / vectorized:>7.1f}x {str(equal):>6}")
+
+if __name__ == "__main__":
+    main()
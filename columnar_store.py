@@ -0,0 +1,208 @@
+import datetime as dt
+import os
+import threading
+import uuid
+from pathlib import Path
+import numpy
+import pandas
+from trading_calendar import TradingCalendar
+
+# pyarrowは任意（ColumnarStoreを使う場合のみ必要）
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+# 確定済みの日足をローカルに置く列指向のストア（DBの前段の読み出し層）
+# 1銘柄1ファイル（{security_id}.arrow、Arrow IPCのファイル形式・非圧縮）で、ファイルはメモリマップしてコピーせずに参照し、必要な期間だけを切り出す
+# ファイルのメタデータにfirst～last（両端を含む）を持ち、その期間はDBにあるデータがすべて入っていることを表す
+# 正はあくまでDBで、DBから読み出した期間をputで書き込み、DB.insert_into_pricesで書き込まれた足をon_prices_insertedで取り込む
+# ファイルは20年分でも数百KBなので、書き込みは一時ファイルに全体を書いてから差し替える（読み出し中のマップは壊れない）
+# 読み出しではDBに問い合わせない（起動直後の長期間の読み出しもDBを使わない）代わりに、ウォーターマークで古いファイルを見分ける
+#   {security_id}.watermarkに銘柄ごとのウォーターマーク（on_prices_insertedで書き直すたびに変わる値）を置き、ファイルのメタデータにも書いた時点の値を持つ
+#   on_prices_insertedは格納済みの期間に関わる足が書き込まれると、先にウォーターマークを新しくしてからファイルを書き直す
+#   両者が食い違うファイル（書き直す前に止まった場合など）は読み出し時にないものとして扱う
+# pricesに書き込むプロセスは、同じディレクトリのColumnarStoreのon_prices_insertedをDB.add_insert_listenerに登録しておくこと
+# （kabu.Backend.set_column_store、eod_scheduler・intraday_captureの--column-store）　登録していないプロセスの書き込みやDBの行の削除は検知できない
+class ColumnarStore:
+    def __init__(self, directory: str | Path, calendar: TradingCalendar):
+        if pyarrow is None:
+            raise ImportError("ColumnarStoreを使うにはpyarrowをインストールしてください")
+
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.calendar = calendar
+
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.stale = 0
+
+    def path_of(self, security_id: int) -> Path:
+        return self.directory / f"{security_id}.arrow"
+
+    def watermark_path_of(self, security_id: int) -> Path:
+        return self.directory / f"{security_id}.watermark"
+
+    # 銘柄のウォーターマーク（まだない場合はNone）
+    def _watermark(self, security_id: int) -> str | None:
+        try:
+            return self.watermark_path_of(security_id).read_text()
+        except FileNotFoundError:
+            return None
+
+    # ウォーターマークを新しい値にする（それまでに書いたファイルはすべて古いものになる）
+    def _bump_watermark(self, security_id: int) -> str:
+        watermark = uuid.uuid4().hex
+        path = self.watermark_path_of(security_id)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(watermark)
+        os.replace(tmp, path)
+        return watermark
+
+    # ファイルをメモリマップで開き、(first, last, 日時の配列, 列名->配列)を返す ファイルがない場合はNone
+    # ウォーターマークが食い違うファイルは古いのでないものとして扱う（次のputで上書きされる）
+    # 配列はマップした領域をそのまま参照する（コピーしない）
+    def _open(self, security_id: int) -> tuple[dt.date, dt.date, numpy.ndarray, dict[str, numpy.ndarray]] | None:
+        path = self.path_of(security_id)
+        if not path.exists():
+            return None
+
+        table = pyarrow.ipc.open_file(pyarrow.memory_map(str(path), "r")).read_all()
+        metadata = table.schema.metadata or {}
+        watermark = metadata.get(b"watermark", b"").decode()
+        if watermark != self._watermark(security_id):
+            return None
+
+        first = dt.date.fromisoformat(metadata[b"first"].decode())
+        last = dt.date.fromisoformat(metadata[b"last"].decode())
+
+        # 1ファイル1レコードバッチで書いているので列は1チャンク
+        index = table.column("Date").chunk(0).to_numpy(zero_copy_only=True) if table.num_rows > 0 else numpy.array([], dtype="datetime64[ns]")
+        columns = {col: table.column(col).chunk(0).to_numpy(zero_copy_only=True) if table.num_rows > 0 else numpy.array([], dtype=numpy.float64) for col in OHLCV_COLUMNS}
+        return first, last, index, columns
+
+    # begin～end（両端を含む）が格納済みの期間に収まっていればDataFrameとして返す 収まっていなければNone
+    def read(self, security_id: int, begin: dt.date, end: dt.date) -> pandas.DataFrame | None:
+        opened = self._open(security_id)
+        if opened is None and self.path_of(security_id).exists():
+            self.stale += 1
+        if opened is None or begin < opened[0] or opened[1] < end:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        _, _, index, columns = opened
+        i = numpy.searchsorted(index, numpy.datetime64(begin, "ns"), side="left")
+        j = numpy.searchsorted(index, numpy.datetime64(end + dt.timedelta(days=1), "ns"), side="left")
+        return self.to_frame(index[i:j], {col: values[i:j] for col, values in columns.items()})
+
+    # 出来高はNaNを含まなければ整数にする（DB.price_frameと同じ形）
+    @staticmethod
+    def to_frame(index: numpy.ndarray, columns: dict[str, numpy.ndarray]) -> pandas.DataFrame:
+        df = pandas.DataFrame(columns, index=pandas.DatetimeIndex(index))
+        if not numpy.isnan(columns["Volume"]).any():
+            df["Volume"] = columns["Volume"].astype(numpy.int64)
+        return df
+
+    # first～lastのデータをすべて含むdfを書き込む
+    # 格納済みの期間と重なるか隣り合う場合は両方を包む期間にまとめ、重なる日はdfの値を使う
+    # 離れている場合は新しい期間で置き換える
+    def put(self, security_id: int, first: dt.date, last: dt.date, df: pandas.DataFrame) -> None:
+        with self._lock:
+            opened = self._open(security_id)
+            if opened is not None and self._touches(opened[0], opened[1], first, last):
+                old_first, old_last, index, columns = opened
+                df = self._merge(index, columns, df)
+                first, last = min(first, old_first), max(last, old_last)
+
+            watermark = self._watermark(security_id)
+            if watermark is None:
+                watermark = self._bump_watermark(security_id)
+            self._write(security_id, first, last, df, watermark)
+
+    # DB.add_insert_listenerに登録する
+    # 格納済みの期間内の足は値を差し替え、期間の直後から続けて取引日が埋まる足は期間を延ばして追記する
+    # それ以外（間に取引日が抜けている足）は期間の外なので取り込まない（次にputされた時に入る）
+    def on_prices_inserted(self, security_id: int, chart_granularity: str, prices: pandas.DataFrame) -> None:
+        if chart_granularity != "daily" or prices is None or prices.empty:
+            return
+
+        with self._lock:
+            opened = self._open(security_id)
+            if opened is None:
+                return
+
+            first, last, index, columns = opened
+            dates = numpy.unique(pandas.DatetimeIndex(prices.index).to_numpy(dtype="datetime64[D]"))
+            runs = self.calendar.split_runs(dates[dates > numpy.datetime64(last, "D")])
+            if runs and runs[0][0] == self.calendar.next_session(last, inclusive=False):
+                last = runs[0][1]
+
+            within = (numpy.datetime64(first, "D") <= dates) & (dates <= numpy.datetime64(last, "D"))
+            if not within.any():
+                return
+
+            # 書き直す前に止まっても古いファイルが読まれないように、先にウォーターマークを新しくする
+            watermark = self._bump_watermark(security_id)
+            keep = pandas.DatetimeIndex(prices.index).normalize()
+            keep = (keep >= pandas.Timestamp(first)) & (keep <= pandas.Timestamp(last))
+            self._write(security_id, first, last, self._merge(index, columns, prices.loc[keep]), watermark)
+
+    # 該当銘柄のファイルを削除する
+    def invalidate(self, security_id: int) -> None:
+        with self._lock:
+            self.path_of(security_id).unlink(missing_ok=True)
+
+    def _touches(self, first: dt.date, last: dt.date, begin: dt.date, end: dt.date) -> bool:
+        # 間に取引日がなければ隣り合っているとみなす
+        if self.calendar.count_sessions(last + dt.timedelta(days=1), begin - dt.timedelta(days=1)) > 0:
+            return False
+        if self.calendar.count_sessions(end + dt.timedelta(days=1), first - dt.timedelta(days=1)) > 0:
+            return False
+        return True
+
+    # 格納済みの列とdfを日付でまとめる（同じ日付はdfの値を使う）
+    def _merge(self, index: numpy.ndarray, columns: dict[str, numpy.ndarray], df: pandas.DataFrame) -> pandas.DataFrame:
+        new_index = pandas.DatetimeIndex(df.index).normalize().to_numpy(dtype="datetime64[ns]")
+        old = ~numpy.isin(index, new_index)
+        merged_index = numpy.concatenate((index[old], new_index))
+        order = numpy.argsort(merged_index, kind="stable")
+        merged = {
+            col: numpy.concatenate((columns[col][old], df[col].to_numpy(dtype=numpy.float64)))[order]
+            for col in OHLCV_COLUMNS
+        }
+        return pandas.DataFrame(merged, index=pandas.DatetimeIndex(merged_index[order]))
+
+    # 一時ファイルに1レコードバッチで書いてから差し替える
+    def _write(self, security_id: int, first: dt.date, last: dt.date, df: pandas.DataFrame, watermark: str) -> None:
+        index = pandas.DatetimeIndex(df.index).normalize().to_numpy(dtype="datetime64[ns]")
+        arrays = [pyarrow.array(index, type=pyarrow.timestamp("ns"))]
+        arrays += [pyarrow.array(df[col].to_numpy(dtype=numpy.float64), type=pyarrow.float64()) for col in OHLCV_COLUMNS]
+        schema = pyarrow.schema(
+            [("Date", pyarrow.timestamp("ns"))] + [(col, pyarrow.float64()) for col in OHLCV_COLUMNS],
+            metadata={"first": first.isoformat(), "last": last.isoformat(), "watermark": watermark},
+        )
+        batch = pyarrow.record_batch(arrays, schema=schema)
+
+        path = self.path_of(security_id)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with pyarrow.OSFile(str(tmp), "wb") as sink:
+            with pyarrow.ipc.new_file(sink, schema) as writer:
+                writer.write_batch(batch)
+        os.replace(tmp, path)
+        self.writes += 1
+
+    def metrics(self) -> dict:
+        return dict(
+            directory = str(self.directory),
+            hits = self.hits,
+            misses = self.misses,
+            writes = self.writes,
+            stale = self.stale,
+        )
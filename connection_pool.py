@@ -0,0 +1,188 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# スレッドセーフなDB接続プール
+# 同時に貸し出す接続数はmax_sizeまでで、空きがなければ返却を待つ
+# 同じスレッド内で入れ子にconnection()を呼んだ場合は同じ接続を使い回す
+class ConnectionPool:
+    # factory：新しい接続を作る関数
+    # max_size：プールが持つ接続数の上限
+    # max_idle_seconds：これより長く使われていなかった接続は貸し出す前に生存確認する
+    # checkout_timeout：空き接続を待つ最大秒数
+    def __init__(self, factory, max_size: int = 8, max_idle_seconds: float = 60.0, checkout_timeout: float = 30.0):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+
+        self.factory = factory
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self.checkout_timeout = checkout_timeout
+
+        # (接続, 最終返却時刻) 直近に返却されたものから使う
+        self._idle: list[tuple[object, float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._created = 0
+        self._pings = 0
+        self._discarded = 0
+
+    # 接続を借りるコンテキストマネージャ
+    # with pool.connection() as conn: の形で使い、ブロックを抜けると返却される
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            # 入れ子の呼び出しは外側の接続をそのまま使う
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = not self._rollback(conn)
+            raise
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self._checkin(conn, broken)
+
+    # 空き接続を取り出す（なければ作成するか返却を待つ）
+    def _checkout(self):
+        begin = time.monotonic()
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+
+                remaining = self.checkout_timeout - (time.monotonic() - begin)
+                if remaining <= 0:
+                    raise TimeoutError(f"DB接続の空きを{self.checkout_timeout}秒待ちましたが取得できませんでした。")
+
+                waited = True
+                self._cond.wait(remaining)
+
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                wait_time = time.monotonic() - begin
+                self._waits += 1
+                self._wait_time += wait_time
+                self._max_wait_time = max(self._max_wait_time, wait_time)
+
+        try:
+            if conn is None:
+                return self._create()
+
+            # しばらく使われていなかった接続だけ生存確認する
+            if time.monotonic() - last_used > self.max_idle_seconds and not self._is_alive(conn):
+                self._close(conn)
+                with self._cond:
+                    self._discarded += 1
+                return self._create()
+
+            return conn
+        except Exception:
+            # 接続を用意できなかった場合は枠を空ける
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    # 接続をプールに戻す
+    # 壊れている可能性がある接続は閉じて枠だけ空ける
+    def _checkin(self, conn, broken: bool = False) -> None:
+        if broken:
+            self._close(conn)
+
+        with self._cond:
+            self._in_use -= 1
+            if broken:
+                self._size -= 1
+                self._discarded += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _create(self):
+        conn = self.factory()
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def _is_alive(self, conn) -> bool:
+        with self._cond:
+            self._pings += 1
+        try:
+            conn.ping()
+            return True
+        except Exception:
+            return False
+
+    # 例外で抜けた場合は書きかけのトランザクションを破棄する
+    # return：接続を引き続き使えるかどうか
+    @staticmethod
+    def _rollback(conn) -> bool:
+        try:
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # プールしている接続をすべて閉じる（貸出中の接続は返却時にプールへ戻る）
+    def close(self) -> None:
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+
+        for conn, _ in idle:
+            self._close(conn)
+
+    # プールの状態と累計値
+    def metrics(self) -> dict:
+        with self._cond:
+            return dict(
+                size = self._size,
+                max_size = self.max_size,
+                idle = len(self._idle),
+                in_use = self._in_use,
+                checkouts = self._checkouts,
+                waits = self._waits,
+                wait_time = self._wait_time,
+                max_wait_time = self._max_wait_time,
+                created = self._created,
+                pings = self._pings,
+                discarded = self._discarded,
+            )
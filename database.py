@@ -1,243 +1,771 @@
 import datetime as dt
+import threading
+from contextlib import contextmanager
 import MySQLdb
+import MySQLdb.cursors
+import numpy
 import pandas
 from zoneinfo import ZoneInfo
+from typing import NamedTuple
+from connection_pool import ConnectionPool
+from market_hours import MarketHours
+from security_master import SecurityMaster
+from tracing import tracer
+
+# 発行したクエリ数を数えるカーソル
+# スレッドごとの件数と全体の件数を持つ
+class CountingCursor(MySQLdb.cursors.Cursor):
+    _lock = threading.Lock()
+    _local = threading.local()
+    total_queries = 0
+
+    def execute(self, query, args=None):
+        CountingCursor.count_query()
+        return super().execute(query, args)
+
+    def executemany(self, query, args):
+        CountingCursor.count_query()
+        return super().executemany(query, args)
+
+    @classmethod
+    def count_query(cls) -> None:
+        cls._local.queries = getattr(cls._local, "queries", 0) + 1
+        with cls._lock:
+            cls.total_queries += 1
+
+    # 呼び出したスレッドで発行したクエリ数
+    @classmethod
+    def thread_queries(cls) -> int:
+        return getattr(cls._local, "queries", 0)
+
+# 段階ごとのクエリ数はこのスレッドごとの件数の差で数える
+tracer.query_counter = CountingCursor.thread_queries
+
+# 結果をサーバー側に置いたまま少しずつ読み出すカーソル（件数はCountingCursorに合算する）
+class CountingSSCursor(MySQLdb.cursors.SSCursor):
+    def execute(self, query, args=None):
+        CountingCursor.count_query()
+        return super().execute(query, args)
+
+# DBに格納済みの日足の範囲
+# first_date、end_dateはデータがない場合None、rowsは0
+# rows_in_rangeはget_price_coverageに渡した期間内の件数
+class PriceCoverage(NamedTuple):
+    security_id: int
+    market: MarketHours
+    first_date: dt.date | None
+    end_date: dt.date | None
+    rows: int
+    rows_in_range: int = 0
 
 class DB:
-    # 初回get_cursor実行時に接続される
-    conn: MySQLdb.Connection = None
+    # 接続先
+    CONNECT_ARGS = dict(
+        #host="db",        # docker-compose の service 名
+        host="192.168.2.199",
+        user="user",      # docker-compose.yml の MYSQL_USER
+        passwd="pass",    # MYSQL_PASSWORD
+        db="stocks",        # MYSQL_DATABASE
+        port=3306,
+        connect_timeout=10
+    )
+
+    # 接続プールの設定
+    POOL_MAX_SIZE = 8
+    # これより長く使われていなかった接続は貸し出し前にpingする
+    POOL_MAX_IDLE_SECONDS = 60.0
+    POOL_CHECKOUT_TIMEOUT = 30.0
+
+    # 初回connection実行時に作成される
+    pool: ConnectionPool = None
+    _pool_lock = threading.Lock()
+
+    # securities、marketsのマスタキャッシュ（初回get_master実行時に作成される）
+    # MASTER_TTL_SECONDSを過ぎると次の参照時に読み直す
+    MASTER_TTL_SECONDS = 3600.0
+    master: SecurityMaster = None
 
     def __init__(self):
         pass
 
     # DB接続
+    # 読み出しのたびにトランザクションが残らないようautocommitにしておく
+    # 発行したクエリ数はCountingCursorで数える
     # タイムアウトの場合はOperationalErrorで落ちる
     @staticmethod
     def get_connection() ->  MySQLdb.Connection:
-        return MySQLdb.connect(
-            #host="db",        # docker-compose の service 名
-            host="192.168.2.199",
-            user="user",      # docker-compose.yml の MYSQL_USER
-            passwd="pass",    # MYSQL_PASSWORD
-            db="stocks",        # MYSQL_DATABASE
-            port=3306,
-            connect_timeout=10
-        )
-    
-    # connからcursorを取得
-    # 接続が切れていた場合は再接続する
+        return MySQLdb.connect(**DB.CONNECT_ARGS, autocommit=True, cursorclass=CountingCursor)
+
+    # 接続プールを取得する（初回のみ作成）
     @classmethod
-    def get_cursor(cls):
-        try:
-            # 初回はそのまま接続
-            if cls.conn is None:
-                cls.conn = cls.get_connection()
-            else:
-                cls.conn.ping(reconnect=True)
-        except Exception:
-            # 再接続
-            cls.conn = cls.get_connection()
-        
-        return cls.conn.cursor()
+    def get_pool(cls) -> ConnectionPool:
+        if cls.pool is None:
+            with cls._pool_lock:
+                if cls.pool is None:
+                    cls.pool = ConnectionPool(
+                        cls.get_connection,
+                        max_size=cls.POOL_MAX_SIZE,
+                        max_idle_seconds=cls.POOL_MAX_IDLE_SECONDS,
+                        checkout_timeout=cls.POOL_CHECKOUT_TIMEOUT
+                    )
+        return cls.pool
+
+    # プールから接続を借りる
+    # with DB.connection() as conn: の形で使い、ブロックを抜けると返却される
+    @classmethod
+    @contextmanager
+    def connection(cls):
+        with cls.get_pool().connection() as conn:
+            yield conn
+
+    # マスタキャッシュを取得する（初回のみ作成）
+    @classmethod
+    def get_master(cls) -> SecurityMaster:
+        if cls.master is None:
+            with cls._pool_lock:
+                if cls.master is None:
+                    cls.master = SecurityMaster(cls.fetchall, ttl_seconds=cls.MASTER_TTL_SECONDS)
+        return cls.master
+
+    # マスタキャッシュを明示的に読み直す
+    @classmethod
+    def refresh_master(cls) -> None:
+        cls.get_master().refresh()
+
+    # SELECTを実行して1行目を返す
+    @classmethod
+    def fetchone(cls, sql: str, params: tuple = ()) -> tuple | None:
+        with cls.connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                return cur.fetchone()
+            finally:
+                cur.close()
+
+    # SELECTを実行して全行を返す
+    @classmethod
+    def fetchall(cls, sql: str, params: tuple = ()) -> tuple:
+        with cls.connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                return cur.fetchall()
+            finally:
+                cur.close()
+
+    # SELECTの結果をfloat64の2次元配列として受け取る
+    # サーバー側カーソルでchunk_size行ずつ読み出して変換するので、全行分のタプルを一度に持たない
+    # 数値以外の列を含めないこと（NULLはNaNになる）
+    @classmethod
+    def fetch_array(cls, sql: str, params: tuple, width: int, chunk_size: int = 50000) -> numpy.ndarray:
+        chunks = []
+        with tracer.stage("select") as span:
+            with cls.connection() as conn:
+                cur = conn.cursor(CountingSSCursor)
+                try:
+                    cur.execute(sql, params)
+                    while True:
+                        rows = cur.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        chunks.append(numpy.array(rows, dtype=numpy.float64))
+                finally:
+                    cur.close()
+
+            result = numpy.concatenate(chunks) if chunks else numpy.empty((0, width), dtype=numpy.float64)
+            span["rows"] = len(result)
+            span["bytes"] = result.nbytes
+
+        return result
+
+    # fetch_arrayで読み出した配列からOHLCVのDataFrameを作る
+    # days_colはUNIX epochからの日数（unit="s"の場合は秒数）の列、OHLCVはその後ろに並んでいること
+    # 行ごとの文字列変換やDecimalを経由せず、列単位で型を付ける
+    @staticmethod
+    def price_frame(values: numpy.ndarray, days_col: int = 0, unit: str = "D") -> pandas.DataFrame:
+        with tracer.stage("decode", rows=len(values)):
+            return DB._price_frame(values, days_col, unit)
+
+    @staticmethod
+    def _price_frame(values: numpy.ndarray, days_col: int, unit: str) -> pandas.DataFrame:
+        days = values[:, days_col].astype(numpy.int64).astype(f"datetime64[{unit}]")
+        index = pandas.DatetimeIndex(days.astype("datetime64[ns]"))
+
+        ohlcv = values[:, days_col + 1:days_col + 6]
+        result_df = pandas.DataFrame({
+            "Open": ohlcv[:, 0],
+            "High": ohlcv[:, 1],
+            "Low": ohlcv[:, 2],
+            "Close": ohlcv[:, 3],
+            "Volume": ohlcv[:, 4],
+        }, index=index)
+
+        # 出来高はNULLがなければ整数にしておく
+        if not numpy.isnan(ohlcv[:, 4]).any():
+            result_df["Volume"] = ohlcv[:, 4].astype(numpy.int64)
+
+        return result_df
+
+    # 該当tickerが上場している市場の取引時間を取得する（マスタキャッシュを参照）
+    # 該当銘柄なしの場合はNone
+    def get_market_hours(self, ticker: str) -> MarketHours | None:
+        return DB.get_master().get_market_hours(ticker)
 
     # 現在時刻が取引時間中であるか
     # 昼休みも考慮する
     def is_market_active(self, ticker: str) -> bool:
-        cur = DB.get_cursor()
-        cur.execute("""
-            SELECT 
-                m.timezone,
-                m.open1,
-                m.close1,
-                m.open2,
-                m.close2
-            FROM securities s
-            JOIN markets m ON s.market_id = m.id
-            WHERE s.code = %s
-        """, (ticker,))
-
-        row = cur.fetchone()
-        if not row:
+        market = self.get_market_hours(ticker)
+        if market is None:
             return False  # 該当銘柄なし
-    
-        # 現在時刻を市場のタイムゾーンで取得
-        t = dt.datetime.now(ZoneInfo(row[0])).time()
-        now = dt.timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
-    
-        # 時間1の判定
-        if row[1] <= now <= row[2]:
-            return True
-    
-        # 時間2がある場合のみ判定
-        if row[3] and row[4]:
-            if row[3] <= now <= row[4]:
-                return True
-    
-        return False
+
+        return market.is_active()
     
     # 現在時刻が取引開始時刻よりも後であるか
     def is_market_open(self, ticker: str) -> bool:
-        cur = DB.get_cursor()
-        cur.execute("""
-            SELECT 
-                m.timezone,
-                m.open1
-            FROM securities s
-            JOIN markets m ON s.market_id = m.id
-            WHERE s.code = %s
-        """, (ticker,))
-
-        row = cur.fetchone()
-        if not row:
+        market = self.get_market_hours(ticker)
+        if market is None:
             return False  # 該当銘柄なし
-    
-        # 現在時刻を市場のタイムゾーンで取得
-        t = dt.datetime.now(ZoneInfo(row[0])).time()
-        now = dt.timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
-    
-        # 時間1の判定
-        if row[1] <= now:
-            return True
-    
-        return False
+
+        return market.is_open()
     
     # 現在時刻が取引終了時刻よりも後であるか
-    def is_market_closed(self, ticker: str, test_now: dt.timedelta) -> bool:
-        cur = DB.get_cursor()
-        cur.execute("""
-            SELECT 
-                m.timezone,
-                m.close1,
-                m.close2
+    # test_nowを渡した場合は現在時刻の代わりに使う
+    def is_market_closed(self, ticker: str, test_now: dt.timedelta | None = None) -> bool:
+        market = self.get_market_hours(ticker)
+        if market is None:
+            return False  # 該当銘柄なし
+
+        return market.is_closed(test_now)
+
+    # 該当tickerのsecurity_id、市場、DBに格納済みの日足の範囲と件数を取得する
+    # begin、endを渡した場合はその期間内の件数も数える
+    # 銘柄と市場はマスタキャッシュから引き、DBへは主キー (security_id, date, time) の範囲を集計する1回のクエリのみ
+    # 該当銘柄なしの場合はNone
+    def get_price_coverage(self, ticker: str, begin: dt.date | None = None, end: dt.date | None = None) -> PriceCoverage | None:
+        entry = DB.get_master().get(ticker)
+        if entry is None:
+            return None
+
+        row = DB.fetchone("""
+            SELECT MIN(date), MAX(date), COUNT(*), COALESCE(SUM(date BETWEEN %s AND %s), 0)
+            FROM prices
+            WHERE security_id = %s AND time = '00:00:00'
+        """, (begin, end, entry.security_id))
+
+        return PriceCoverage(entry.security_id, DB.get_master().get_market(entry.market_id), row[0], row[1], row[2], int(row[3]))
+
+    # 複数銘柄の get_price_coverage を1回のクエリでまとめて取得する
+    # 未登録の銘柄は結果に含めない
+    def get_price_coverages(self, tickers: list[str], begin: dt.date | None = None, end: dt.date | None = None) -> dict[str, PriceCoverage]:
+        master = DB.get_master()
+        entries = {ticker: master.get(ticker) for ticker in tickers}
+        entries = {ticker: entry for ticker, entry in entries.items() if entry is not None}
+        if not entries:
+            return {}
+
+        ids = [entry.security_id for entry in entries.values()]
+        rows = DB.fetchall(f"""
+            SELECT security_id, MIN(date), MAX(date), COUNT(*), COALESCE(SUM(date BETWEEN %s AND %s), 0)
+            FROM prices
+            WHERE security_id IN ({", ".join(["%s"] * len(ids))}) AND time = '00:00:00'
+            GROUP BY security_id
+        """, (begin, end, *ids))
+        stats = {row[0]: row[1:] for row in rows}
+
+        result = {}
+        for ticker, entry in entries.items():
+            # データがない銘柄は集計結果に出てこない
+            first_date, end_date, count, count_in_range = stats.get(entry.security_id, (None, None, 0, 0))
+            result[ticker] = PriceCoverage(entry.security_id, master.get_market(entry.market_id), first_date, end_date, count, int(count_in_range))
+
+        return result
+
+    # 該当銘柄のbegin～endの期間でDBに格納済みの日足の日付
+    def select_price_dates(self, security_id: int, begin: dt.date, end: dt.date) -> list[dt.date]:
+        rows = DB.fetchall("""
+            SELECT date
+            FROM prices
+            WHERE security_id = %s AND date BETWEEN %s AND %s AND time = '00:00:00'
+        """, (security_id, begin, end))
+
+        return [row[0] for row in rows]
+
+    # 業種（sectors.name　TSE33・TOPIX17のどちらの業種名でもよい）、指数（indices.code）に属する銘柄のsecurity_id
+    # 両方指定した場合は両方に属する銘柄、どちらも指定しない場合はNone（全銘柄）
+    def select_universe(self, sectors: list[str] | None = None, index_code: str | None = None) -> list[int] | None:
+        conditions = []
+        params: tuple = ()
+        if sectors:
+            conditions.append(f"""
+                s.id IN (
+                    SELECT ss.security_id
+                    FROM security_sectors ss
+                    JOIN sectors sec ON sec.id = ss.sector_id
+                    WHERE sec.name IN ({", ".join(["%s"] * len(sectors))})
+                )
+            """)
+            params += tuple(sectors)
+        if index_code:
+            conditions.append("""
+                s.id IN (
+                    SELECT ic.security_id
+                    FROM index_components ic
+                    JOIN indices i ON i.id = ic.index_id
+                    WHERE i.code = %s
+                )
+            """)
+            params += (index_code,)
+
+        if not conditions:
+            return None
+
+        rows = DB.fetchall(f"""
+            SELECT s.id
             FROM securities s
-            JOIN markets m ON s.market_id = m.id
-            WHERE s.code = %s
-        """, (ticker,))
+            WHERE {" AND ".join(conditions)}
+        """, params)
 
-        row = cur.fetchone()
-        if not row:
-            return False  # 該当銘柄なし
+        return [row[0] for row in rows]
 
-        # 現在時刻を市場のタイムゾーンで取得
-        t = dt.datetime.now(ZoneInfo(row[0])).time()
-        #now = dt.timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
-        now = test_now
+    # 該当銘柄の、取得してもデータが返ってこなかった期間 [(最初の日, 最後の日, 確認した日), ...]
+    def select_empty_spans(self, security_id: int) -> list[tuple[dt.date, dt.date, dt.date | None]]:
+        rows = DB.fetchall("""
+            SELECT first_date, last_date, checked_at
+            FROM price_empty_spans
+            WHERE security_id = %s
+            ORDER BY first_date ASC
+        """, (security_id,))
 
-        # 時間2がある場合のみ判定
-        if row[2]:
-            if now >= row[2]:
-                return True
-            # 時間2がある場合は時間1をチェックしない
-            else:
-                return False
+        return [(row[0], row[1], row[2]) for row in rows]
 
-        # 終了時刻を過ぎているか
-        if now >= row[1]:
-            return True
+    # 取得してもデータが返ってこなかった期間を、確認した日とともに記録する
+    # 同じ期間を確認し直した場合は確認した日を更新する
+    def insert_empty_spans(self, security_id: int, spans: list[tuple[dt.date, dt.date]], checked_at: dt.date) -> None:
+        if not spans:
+            return
 
-        return False
-    
-    # 現在時刻が取引時間中であるか
-    def is_market_active(self, ticker: str) -> bool:
-        if self.is_market_open(ticker) and not self.is_market_closed(ticker):
-            return True
-        
-        return False
+        with DB.connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.executemany("""
+                    INSERT INTO price_empty_spans (security_id, first_date, last_date, checked_at)
+                    VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE last_date = GREATEST(last_date, VALUES(last_date)), checked_at = VALUES(checked_at)
+                """, [(security_id, first, last, checked_at) for first, last in spans])
+            finally:
+                cur.close()
     
+    # pricesテーブルへのINSERT文
+    # executemanyで複数行のVALUESにまとめて送られる
+    # 既に同じ(security_id, date, time)がある場合は値を更新する
+    # 日足のtimeはNULLではなくDAILY_TIME（00:00:00）にする（NULLは主キーにできず、一意キーでも重複を防げないため）
+    INSERT_PRICES_SQL = """
+        INSERT INTO prices (security_id, date, time, open, high, low, close, volume)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            open = VALUES(open),
+            high = VALUES(high),
+            low = VALUES(low),
+            close = VALUES(close),
+            volume = VALUES(volume)
+    """
+
+    # 分足からまとめた日足のINSERT文
+    # 読み出してから書き込むまでの間に取得元の日足が書き込まれた場合は、そちらを優先して上書きしない
+    INSERT_COMPACTED_PRICES_SQL = """
+        INSERT INTO prices (security_id, date, time, open, high, low, close, volume)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            security_id = security_id
+    """
+
+    INSERT_INTRADAY_PRICES_SQL = """
+        INSERT INTO intraday_prices (security_id, bar_minutes, ts, open, high, low, close, volume)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            open = VALUES(open),
+            high = VALUES(high),
+            low = VALUES(low),
+            close = VALUES(close),
+            volume = VALUES(volume)
+    """
+
+    # 日足のtimeの値
+    DAILY_TIME = dt.time(0, 0, 0)
+
+    # 分足の粒度と足の長さ（分）
+    # 分足はpricesではなくintraday_pricesに格納する
+    INTRADAY_GRANULARITIES = {
+        "minute": 1,
+        "5minute": 5,
+    }
+
+    # 一度にcommitする行数の既定値
+    INSERT_CHUNK_SIZE = 1000
+
+    # insert_into_pricesで書き込んだ後に呼ばれる関数
+    # listener(security_id, chart_granularity, prices) の形で呼ばれる（キャッシュの破棄などに使う）
+    insert_listeners: list = []
+
+    # insert_into_pricesの書き込み後に呼ばれる関数を登録する
+    @classmethod
+    def add_insert_listener(cls, listener) -> None:
+        cls.insert_listeners.append(listener)
+
+    # 該当tickerのsecurities.idを取得する（マスタキャッシュを参照）
+    # 未登録の場合はNone
+    def get_security_id(self, ticker: str) -> int | None:
+        return DB.get_master().get_security_id(ticker)
+
+    # 該当security_idのticker（マスタキャッシュを参照）
+    # 未登録の場合はNone
+    def get_ticker(self, security_id: int) -> str | None:
+        return DB.get_master().get_ticker(security_id)
+
+    # 該当tickerの銘柄名（マスタキャッシュを参照）
+    # 未登録の場合はNone
+    def get_name(self, ticker: str) -> str | None:
+        return DB.get_master().get_name(ticker)
+
+    # 日足のDataFrameからpricesへのINSERT用の行を作る（分足はbuild_intraday_rowsでintraday_pricesに入れる）
+    # 時刻は常にDAILY_TIME
+    # iterrowsは使わず列単位でPythonの型に変換してからまとめる
+    @staticmethod
+    def build_price_rows(security_id: int, prices: pandas.DataFrame) -> list[tuple]:
+        index = pandas.DatetimeIndex(prices.index)
+        dates = index.date
+        times = [DB.DAILY_TIME] * len(index)
+
+        # NaNはNULLとして格納する
+        columns = []
+        for col in ["Open", "High", "Low", "Close", "Volume"]:
+            values = prices[col].to_numpy(dtype=object)
+            values[pandas.isna(values)] = None
+            columns.append(values)
+
+        return list(zip([security_id] * len(index), dates, times, *columns))
+
+    # 分足のDataFrameからintraday_pricesへのINSERT用の行を作る
+    # indexは市場の現地時刻（タイムゾーンなし）
+    @staticmethod
+    def build_intraday_rows(security_id: int, bar_minutes: int, prices: pandas.DataFrame) -> list[tuple]:
+        index = pandas.DatetimeIndex(prices.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+
+        columns = []
+        for col in ["Open", "High", "Low", "Close", "Volume"]:
+            values = prices[col].to_numpy(dtype=object)
+            values[pandas.isna(values)] = None
+            columns.append(values)
+
+        return list(zip([security_id] * len(index), [bar_minutes] * len(index), index.to_pydatetime(), *columns))
+
     # yfinanceから取得した株価をDBに格納する
+    # 分足（INTRADAY_GRANULARITIES）はintraday_pricesに、それ以外はpricesに格納する
+    # security_idは最初に一度だけ解決し、chunk_size件ずつまとめてINSERTしてcommitする
     # return：格納件数
-    def insert_into_prices(self, ticker: str, prices: pandas.DataFrame, chart_granularity: str) -> int:
+    def insert_into_prices(self, ticker: str, prices: pandas.DataFrame, chart_granularity: str, chunk_size: int = INSERT_CHUNK_SIZE) -> int:
         if not ticker:
             raise ValueError("ticker is empty or none")
         
         if prices is None or prices.empty:
             raise ValueError("prices is empty or none")
-        
-        count = 0
-        cur = DB.get_cursor()
-        for index, row in prices.iterrows():
-
-            time = None
-            if chart_granularity == "minute":
-                time = index.time()
-
-            cur.execute("""
-                    INSERT INTO prices (security_id, date, time, open, high, low, close, volume)
-                    SELECT s.id, %s, %s, %s, %s, %s, %s, %s
-                    FROM securities s
-                    WHERE s.code = %s
-                """, (index.date(), time, row["Open"], row["High"], row["Low"], row["Close"], row["Volume"], ticker))
-
-            count += cur.rowcount
-
-        # トランザクション処理を確定
-        DB.conn.commit()
-        return count
+
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+
+        # 該当銘柄なし
+        security_id = self.get_security_id(ticker)
+        if security_id is None:
+            return 0
+
+        if chart_granularity in DB.INTRADAY_GRANULARITIES:
+            sql = DB.INSERT_INTRADAY_PRICES_SQL
+            rows = DB.build_intraday_rows(security_id, DB.INTRADAY_GRANULARITIES[chart_granularity], prices)
+        else:
+            sql = DB.INSERT_PRICES_SQL
+            rows = DB.build_price_rows(security_id, prices)
+
+        with tracer.stage("insert", rows=len(rows)):
+            with DB.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    for i in range(0, len(rows), chunk_size):
+                        # 接続はautocommitなのでチャンクごとに明示的にトランザクションを張る
+                        cur.execute("START TRANSACTION")
+                        cur.executemany(sql, rows[i:i + chunk_size])
+                        # トランザクション処理を確定
+                        conn.commit()
+                finally:
+                    cur.close()
+
+        for listener in DB.insert_listeners:
+            listener(security_id, chart_granularity, prices)
+
+        return len(rows)
     
+    # pricesの読み出し列
+    # 日付はUNIX epochからの日数(TO_DAYS('1970-01-01') = 719528)、価格は+0E0でDOUBLEにしてDecimalを経由しない
+    PRICE_SELECT_COLUMNS = "TO_DAYS(date) - 719528, open + 0E0, high + 0E0, low + 0E0, close + 0E0, volume"
+
+    # 週足・月足のバケツ（日足をまとめる単位）
+    # 週は月曜始まり（price_resampler.bucket_keysと同じ区切り）
+    PRICE_BUCKETS = {
+        "weekly": "YEARWEEK(date, 3)",
+        "monthly": "YEAR(date) * 100 + MONTH(date)",
+    }
+    # 日足をバケツごとに1行にまとめる列（並びはPRICE_SELECT_COLUMNSと同じ）
+    # 日付はバケツ内の最初の取引日、始値は最初の日の始値、終値は最後の日の終値とする
+    # NULLの扱いは日足のキャッシュからの集計（price_resampler.aggregate_ohlcv）と揃える
+    #   始値・終値：GROUP_CONCATはNULLを飛ばすので空文字にして並べ、最初（最後）の日がNULLならNULL（NaN）にする
+    #   高値・安値：NULLを除いた最大・最小（すべてNULLならNULL）　出来高：NULLを除いた合計（すべてNULLなら0）
+    PRICE_AGGREGATE_COLUMNS = """TO_DAYS(MIN(date)) - 719528,
+        NULLIF(SUBSTRING_INDEX(GROUP_CONCAT(IFNULL(open, '') ORDER BY date ASC), ',', 1), '') + 0E0,
+        MAX(high) + 0E0,
+        MIN(low) + 0E0,
+        NULLIF(SUBSTRING_INDEX(GROUP_CONCAT(IFNULL(close, '') ORDER BY date DESC), ',', 1), '') + 0E0,
+        COALESCE(SUM(volume), 0)"""
+
+    # intraday_pricesの読み出し列
+    # 時刻はUNIX epochからの秒数（市場の現地時刻のまま）
+    INTRADAY_SELECT_COLUMNS = "TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', ts), open + 0E0, high + 0E0, low + 0E0, close + 0E0, volume"
+
+    # 対応している粒度か
+    @staticmethod
+    def is_supported_granularity(chart_granularity: str) -> bool:
+        return chart_granularity == "daily" or chart_granularity in DB.PRICE_BUCKETS or chart_granularity in DB.INTRADAY_GRANULARITIES
+
     # pricesテーブルからOHLCVの値を取得する
+    # 週足・月足は格納済みの日足をDB側でGROUP BYしてまとめてから読み出す
     # データがDBに存在するかの確認はしないので注意
     def select_from_prices(self, ticker: str, begin_range: dt.datetime, end_range: dt.datetime, chart_granularity: str) -> pandas.DataFrame:
+        if not DB.is_supported_granularity(chart_granularity):
+            raise NotImplementedError(f"未対応の粒度です：{chart_granularity}")
+
+        # securitiesとJOINせずsecurity_idで直接絞り込む
+        security_id = self.get_security_id(ticker)
+
+        # begin_range、end_rangeにに渡されているのがdatetimeである場合はdateに変換しておく
+        if type(begin_range) is dt.datetime:
+            begin_range = begin_range.date()
+
+        if type(end_range) is dt.datetime:
+            end_range = end_range.date()
+
         if chart_granularity == "daily":
-            # begin_range、end_rangeにに渡されているのがdatetimeである場合はdateに変換しておく
-            if type(begin_range) is dt.datetime:
-                begin_range = begin_range.date()
-
-            if type(end_range) is dt.datetime:
-                end_range = end_range.date()
- 
-            cur = DB.get_cursor()
-            cur.execute("""
-                SELECT date, COALESCE(time, '00:00:00') AS time, open, high, low, close, volume
-                FROM prices p
-                JOIN securities s ON p.security_id = s.id
-                WHERE s.code = %s AND p.date BETWEEN %s AND %s AND p.time IS NULL
-                ORDER BY p.date ASC
-            """, (ticker, begin_range, end_range))
-            
+            values = DB.fetch_array(f"""
+                SELECT {DB.PRICE_SELECT_COLUMNS}
+                FROM prices
+                WHERE security_id = %s AND date BETWEEN %s AND %s AND time = '00:00:00'
+                ORDER BY date ASC
+            """, (security_id, begin_range, end_range), 6)
+
+        elif chart_granularity in DB.INTRADAY_GRANULARITIES:
+            # 終了日の足をすべて含むように翌日0時未満で絞り込む（月ごとのパーティションに絞り込まれる）
+            values = DB.fetch_array(f"""
+                SELECT {DB.INTRADAY_SELECT_COLUMNS}
+                FROM intraday_prices
+                WHERE security_id = %s AND bar_minutes = %s AND ts >= %s AND ts < %s
+                ORDER BY ts ASC
+            """, (security_id, DB.INTRADAY_GRANULARITIES[chart_granularity], begin_range, end_range + dt.timedelta(days=1)), 6)
+            return DB.price_frame(values, unit="s")
+
         else:
-            raise NotImplementedError("日足以外は未実装")
-        
-        rows = cur.fetchall()
-        dates = [pandas.to_datetime(str(d) + " " + str(t)) for d, t, *_ in rows]
-        ohlcv = [row[2:] for row in rows]
+            bucket = DB.PRICE_BUCKETS[chart_granularity]
+            values = DB.fetch_array(f"""
+                SELECT {DB.PRICE_AGGREGATE_COLUMNS}
+                FROM prices
+                WHERE security_id = %s AND date BETWEEN %s AND %s AND time = '00:00:00'
+                GROUP BY {bucket}
+                ORDER BY {bucket} ASC
+            """, (security_id, begin_range, end_range), 6)
+
+        return DB.price_frame(values)
+
+    # 複数銘柄の足を WHERE security_id IN (...) の1回のクエリでまとめて取得する
+    # 戻り値は銘柄コードをTicker列に持つ縦持ち（long format）のDataFrame
+    # データがDBに存在するかの確認はしないので注意
+    def select_from_prices_many(self, tickers: list[str], begin_range: dt.datetime, end_range: dt.datetime, chart_granularity: str) -> pandas.DataFrame:
+        if not DB.is_supported_granularity(chart_granularity):
+            raise NotImplementedError(f"未対応の粒度です：{chart_granularity}")
+
+        if type(begin_range) is dt.datetime:
+            begin_range = begin_range.date()
+
+        if type(end_range) is dt.datetime:
+            end_range = end_range.date()
+
+        ids = {}
+        for ticker in tickers:
+            security_id = self.get_security_id(ticker)
+            if security_id is not None:
+                ids[security_id] = ticker
 
         ohlcv_column = ["Open", "High", "Low", "Close", "Volume"]
-        result_df = pandas.DataFrame(ohlcv, columns=ohlcv_column, index=pandas.DatetimeIndex(dates))
-        for col in ohlcv_column:
-            result_df[col] = pandas.to_numeric(result_df[col], errors="coerce")
+        if not ids:
+            return pandas.DataFrame(columns=["Ticker"] + ohlcv_column, index=pandas.DatetimeIndex([]))
+
+        if chart_granularity == "daily":
+            values = DB.fetch_array(f"""
+                SELECT security_id, {DB.PRICE_SELECT_COLUMNS}
+                FROM prices
+                WHERE security_id IN ({", ".join(["%s"] * len(ids))}) AND date BETWEEN %s AND %s AND time = '00:00:00'
+                ORDER BY security_id ASC, date ASC
+            """, (*ids.keys(), begin_range, end_range), 7)
+
+        elif chart_granularity in DB.INTRADAY_GRANULARITIES:
+            values = DB.fetch_array(f"""
+                SELECT security_id, {DB.INTRADAY_SELECT_COLUMNS}
+                FROM intraday_prices
+                WHERE security_id IN ({", ".join(["%s"] * len(ids))}) AND bar_minutes = %s AND ts >= %s AND ts < %s
+                ORDER BY security_id ASC, ts ASC
+            """, (*ids.keys(), DB.INTRADAY_GRANULARITIES[chart_granularity], begin_range, end_range + dt.timedelta(days=1)), 7)
+
+        else:
+            bucket = DB.PRICE_BUCKETS[chart_granularity]
+            values = DB.fetch_array(f"""
+                SELECT security_id, {DB.PRICE_AGGREGATE_COLUMNS}
+                FROM prices
+                WHERE security_id IN ({", ".join(["%s"] * len(ids))}) AND date BETWEEN %s AND %s AND time = '00:00:00'
+                GROUP BY security_id, {bucket}
+                ORDER BY security_id ASC, {bucket} ASC
+            """, (*ids.keys(), begin_range, end_range), 7)
+
+        result_df = DB.price_frame(values, days_col=1, unit="s" if chart_granularity in DB.INTRADAY_GRANULARITIES else "D")
+        # 銘柄コードはsecurity_idの種類ごとに1回だけ引き、配列の添字でまとめて割り当てる
+        unique_ids, inverse = numpy.unique(values[:, 0].astype(numpy.int64), return_inverse=True)
+        labels = numpy.array([ids[i] for i in unique_ids.tolist()], dtype=object)
+        result_df.insert(0, "Ticker", labels[inverse])
 
         return result_df
     
-    # 該当tickerが証券テーブルに登録済みであるか確認する
+    # before（この日を含まない）より前の分足を日足にまとめてpricesに格納する
+    # まとめるのは取引時間を通して分足が揃っている日のみ（最初の足が寄り付き（open1）以前、最後の足が引け（close2、なければclose1）のbar_minutes分前以降）
+    # 取り始めが場中だった日や途中で取得が止まった日は、日足にすると始値・終値・出来高が誤ったものになるので格納しない（yfinanceから取得される）
+    # 日足がすでにある日（yfinanceから取得したもの）はそちらを優先して書き込まない
+    # 始値・終値はGROUP_CONCATの先頭を使うので、group_concat_max_lenで切り詰められても値は変わらない
+    # まとめた日足は同じトランザクションで読み出してから書き込み、銘柄ごとにその日足をinsert_listenersに渡す
+    # （指標の計算状態、業種・指数の集計値、列指向ストアが書き込まれた日付から計算し直せるように）
+    # return：格納した日足の件数
+    def compact_intraday_prices(self, bar_minutes: int, before: dt.date) -> int:
+        with DB.connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("START TRANSACTION")
+                # 取引時間は銘柄の市場ごとに1つなので、GROUP BYの中ではMAXで取り出す
+                cur.execute("""
+                    SELECT i.security_id, DATE(i.ts),
+                        SUBSTRING_INDEX(GROUP_CONCAT(i.open ORDER BY i.ts ASC), ',', 1) + 0E0,
+                        MAX(i.high) + 0E0,
+                        MIN(i.low) + 0E0,
+                        SUBSTRING_INDEX(GROUP_CONCAT(i.close ORDER BY i.ts DESC), ',', 1) + 0E0,
+                        SUM(i.volume)
+                    FROM intraday_prices i
+                    JOIN securities s ON s.id = i.security_id
+                    JOIN markets m ON m.id = s.market_id
+                    WHERE i.bar_minutes = %s AND i.ts < %s
+                        AND NOT EXISTS (
+                            SELECT 1 FROM prices p
+                            WHERE p.security_id = i.security_id AND p.date = DATE(i.ts) AND p.time = '00:00:00'
+                        )
+                    GROUP BY i.security_id, DATE(i.ts)
+                    HAVING TIME(MIN(i.ts)) <= MAX(m.open1)
+                        AND TIME(MAX(i.ts)) >= SUBTIME(MAX(COALESCE(m.close2, m.close1)), SEC_TO_TIME(%s * 60))
+                    ORDER BY i.security_id ASC, DATE(i.ts) ASC
+                """, (bar_minutes, before, bar_minutes))
+                compacted = cur.fetchall()
+                if compacted:
+                    cur.executemany(DB.INSERT_COMPACTED_PRICES_SQL, [(security_id, date, DB.DAILY_TIME, *ohlcv) for security_id, date, *ohlcv in compacted])
+                conn.commit()
+            finally:
+                cur.close()
+
+        # 銘柄ごとに、まとめた日足（indexが日付）を書き込んだものとして知らせる
+        by_security: dict[int, list[tuple]] = {}
+        for security_id, date, *ohlcv in compacted:
+            by_security.setdefault(security_id, []).append((date, *ohlcv))
+        for security_id, rows in by_security.items():
+            prices = pandas.DataFrame([row[1:] for row in rows], columns=["Open", "High", "Low", "Close", "Volume"], index=pandas.DatetimeIndex([row[0] for row in rows]))
+            for listener in DB.insert_listeners:
+                listener(security_id, "daily", prices)
+
+        return len(compacted)
+
+    # intraday_pricesの月ごとのパーティション（名前, その月の翌月1日）
+    # 最後のpmax（MAXVALUE）は含めない
+    def select_intraday_partitions(self) -> list[tuple[str, dt.date]]:
+        rows = DB.fetchall("""
+            SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+            FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'intraday_prices'
+                AND PARTITION_NAME IS NOT NULL AND PARTITION_DESCRIPTION <> 'MAXVALUE'
+            ORDER BY PARTITION_ORDINAL_POSITION ASC
+        """)
+        # PARTITION_DESCRIPTIONはTO_DAYSの値（0000-00-00からの日数）
+        return [(name, dt.date.fromordinal(int(description) - 365)) for name, description in rows]
+
+    # untilを含む月までの月ごとのパーティションを作る
+    # pmaxを分割して作るので、未来の月のパーティションは空のうちに作っておく
+    def ensure_intraday_partitions(self, until: dt.date) -> list[str]:
+        partitions = self.select_intraday_partitions()
+        month = partitions[-1][1] if partitions else dt.date.today().replace(day=1)
+
+        added = []
+        definitions = []
+        while month <= until:
+            next_month = (month + dt.timedelta(days=32)).replace(day=1)
+            name = f"p{month:%Y%m}"
+            definitions.append(f"PARTITION {name} VALUES LESS THAN (TO_DAYS('{next_month:%Y-%m-%d}'))")
+            added.append(name)
+            month = next_month
+
+        if definitions:
+            definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+            with DB.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute(f"ALTER TABLE intraday_prices REORGANIZE PARTITION pmax INTO ({', '.join(definitions)})")
+                finally:
+                    cur.close()
+
+        return added
+
+    # before（この日を含まない）より前の月のパーティションを丸ごと捨てる
+    # DELETEと違い行ごとの削除やインデックスの更新が起きないので、件数が多くてもすぐに終わる
+    def drop_intraday_partitions(self, before: dt.date) -> list[str]:
+        names = [name for name, upper in self.select_intraday_partitions() if upper <= before]
+        if names:
+            with DB.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute(f"ALTER TABLE intraday_prices DROP PARTITION {', '.join(names)}")
+                finally:
+                    cur.close()
+
+        return names
+
+    # 該当tickerが証券テーブルに登録済みであるか確認する（マスタキャッシュを参照）
     def is_ticker_exists(self, ticker: str) -> bool:
         if not ticker:
             return False
         
-        cur = DB.get_cursor()
-        cur.execute("""
-                SELECT 1
-                FROM securities
-                WHERE code = %s 
-            """, (ticker,))
-        
-        return cur.fetchone() is not None
+        return self.get_security_id(ticker) is not None
     
     # 該当tickerの最初のレコードの日時を取得
     def get_first_record_datetime(self, ticker: str) -> tuple[dt.date, dt.time] | None:
         if not ticker:
             raise ValueError("ticker is empty or none")
         
-        cur = DB.get_cursor()
-        cur.execute("""
+        first_record = DB.fetchone("""
             SELECT date, time
-            FROM prices p
-            JOIN securities s ON p.security_id = s.id
-            WHERE s.code = %s
+            FROM prices
+            WHERE security_id = %s
             ORDER BY date ASC, time ASC
             LIMIT 1
-        """, (ticker,))
+        """, (self.get_security_id(ticker),))
             
-        first_record = cur.fetchone()
         # 該当するデータがDBにない場合
         if first_record is None:
             return None
@@ -249,17 +777,14 @@ class DB:
         if not ticker:
             raise ValueError("ticker is empty or none")
         
-        cur = DB.get_cursor()
-        cur.execute("""
+        end_record = DB.fetchone("""
             SELECT date, time
-            FROM prices p
-            JOIN securities s ON p.security_id = s.id
-            WHERE s.code = %s
+            FROM prices
+            WHERE security_id = %s
             ORDER BY date DESC, time DESC
             LIMIT 1
-        """, (ticker,))
+        """, (self.get_security_id(ticker),))
             
-        end_record = cur.fetchone()
         # 該当するデータがDBにない場合
         if end_record is None:
             return None
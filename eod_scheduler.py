@@ -0,0 +1,318 @@
+import argparse
+import collections
+import datetime as dt
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+import pandas
+from market_hours import MarketHours
+from my_logging import Logging
+
+# 最近求められた銘柄（引け後に先回りして取得・キャッシュする対象）
+# 求められるたびに数え、古い分はHALF_LIFE_SECONDSごとに半分の重みになる
+class HotList:
+    HALF_LIFE_SECONDS = 3 * 24 * 3600
+
+    def __init__(self, half_life: float = HALF_LIFE_SECONDS):
+        self.half_life = half_life
+        self._lock = threading.Lock()
+        # 銘柄コード -> (重み, 最後に求められた時刻（time.time）)
+        self._scores: dict[str, tuple[float, float]] = {}
+
+    def touch(self, tickers: list[str]) -> None:
+        now = time.time()
+        with self._lock:
+            for ticker in tickers:
+                score, last = self._scores.get(ticker, (0.0, now))
+                self._scores[ticker] = (self._decay(score, now - last) + 1.0, now)
+
+    # 重みの大きい順に最大limit銘柄
+    def top(self, limit: int) -> list[str]:
+        now = time.time()
+        with self._lock:
+            scores = {ticker: self._decay(score, now - last) for ticker, (score, last) in self._scores.items()}
+        return sorted(scores, key=scores.get, reverse=True)[:limit]
+
+    def _decay(self, score: float, elapsed: float) -> float:
+        return score * 0.5 ** (elapsed / self.half_life)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._scores)
+
+# 取得元への呼び出しの間隔を空ける（1秒あたりrate回、まとめてburst回まで）
+class RateLimiter:
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+# 各市場の引け（close2、なければclose1）の後に、その日の確定した日足を先回りして取得・格納するスケジューラ
+# 対象はsecuritiesの全銘柄（universe）か、最近求められた銘柄（hot　Backend.hot_listの上位HOT_LIMIT銘柄）
+# 取得はbatch_size銘柄ずつworkers本のスレッドでhistory_manyにまとめ、rate_per_secondで間隔を空け、失敗した場合は間隔を広げながら取り直す
+# 格納後に以下を温めておき、引け後の最初の呼び出しで取得元に問い合わせずに済むようにする
+#   テクニカル指標：計算状態がある銘柄の続きを逐次計算する
+#   結果キャッシュ・列指向ストア：hotの銘柄のWARM_DAYS日分を読み込む
+#   業種・指数の集計値：universeの場合のみ
+# 実行例：python eod_scheduler.py --mode universe --workers 4
+class EodScheduler:
+    MODES = ("hot", "universe")
+    HOT_LIMIT = 200
+    # 引けから取得を始めるまでの時間（取得元で日足が確定するのを待つ）
+    SETTLE_MINUTES = 30
+    # 取得していなかった日があれば、この取引日数までさかのぼって取り直す
+    MAX_CATCHUP_SESSIONS = 10
+    # 結果キャッシュに読み込んでおく日数
+    WARM_DAYS = 365
+    # 業種・指数の集計値を保存していない場合に計算を始める日数
+    AGGREGATE_DAYS = 365
+
+    # backend：kabu.Backend（db、calendar、planner、provider、price_cache、column_store、indicators、aggregator、hot_listを使う）
+    def __init__(self, backend, mode: str = "hot", workers: int = 4, batch_size: int = 50, rate_per_second: float = 1.0,
+                 max_retries: int = 3, backoff_seconds: float = 5.0, poll_seconds: float = 60.0, log: Logging | None = None):
+        if mode not in self.MODES:
+            raise ValueError(f"未対応の対象です：{mode}（{', '.join(self.MODES)}のいずれか）")
+
+        self.backend = backend
+        self.mode = mode
+        self.workers = workers
+        self.batch_size = batch_size
+        self.limiter = RateLimiter(rate_per_second, burst=workers)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.poll_seconds = poll_seconds
+        self.log = log if log is not None else Logging()
+
+        # 取得を済ませた日（市場の現地日付） MarketHours -> date
+        self._done: dict[MarketHours, dt.date] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self.runs = 0
+        self.rows = 0
+        self.retries = 0
+        self.errors = 0
+
+    # 対象の銘柄
+    def targets(self) -> list[str]:
+        if self.mode == "universe":
+            return [row[0] for row in self.backend.db.fetchall("SELECT code FROM securities ORDER BY id")]
+        return [ticker for ticker in self.backend.hot_list.top(self.HOT_LIMIT) if self.backend.db.is_ticker_exists(ticker)]
+
+    # 引けてからSETTLE_MINUTESが過ぎ、その日の取得をまだ済ませていない市場ごとの銘柄
+    def due(self) -> dict[MarketHours, list[str]]:
+        markets = collections.defaultdict(list)
+        for ticker in self.targets():
+            markets[self.backend.db.get_market_hours(ticker)].append(ticker)
+
+        due = {}
+        for market, tickers in markets.items():
+            if market is None:
+                continue
+            today = market.today()
+            close = market.close2 or market.close1
+            if self.backend.calendar.is_session(today) and market.now() >= close + dt.timedelta(minutes=self.SETTLE_MINUTES) and self._done.get(market) != today:
+                due[market] = tickers
+        return due
+
+    # 1市場分の取得・格納と温め
+    # return：格納件数
+    def run_market(self, market: MarketHours, tickers: list[str]) -> int:
+        session = market.today()
+        last_final = self.backend.planner.last_finalized_session(market)
+        floor = self.backend.calendar.sessions_between(session - dt.timedelta(days=self.MAX_CATCHUP_SESSIONS * 2), session)[-self.MAX_CATCHUP_SESSIONS].item()
+
+        # 銘柄ごとに格納済みの最後の日の翌取引日から（データがない銘柄はfloorから）
+        # 当日より前から欠けている銘柄（上場廃止、売買停止中など）は、確認済みの空白期間を除いて欠けている最初の日から取り、
+        # 欠けがなければ取らない（毎回同じ空の結果を取りに行かない）
+        coverages = self.backend.db.get_price_coverages(tickers)
+        starts = {}
+        for ticker, coverage in coverages.items():
+            start = floor if coverage.end_date is None else max(floor, self.backend.calendar.next_session(coverage.end_date, inclusive=False))
+            if start < session:
+                missing = self.backend.plan_price_gaps(coverage, start, session, last_final)
+                missing = missing[missing >= numpy.datetime64(start, "D")]
+                if len(missing) == 0:
+                    continue
+                start = missing[0].item()
+            if start <= session:
+                starts[ticker] = start
+
+        # 最後の日が同じ銘柄が同じバッチに入るように並べる
+        pending = sorted(starts, key=lambda ticker: (starts[ticker], ticker))
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="EodScheduler") as pool:
+            results = list(pool.map(lambda batch: self.ingest(batch, {ticker: starts[ticker] for ticker in batch}, coverages, session, last_final), batches))
+
+        failed = sum(1 for result in results if result is None)
+        rows = sum(result[0] for result in results if result is not None)
+        stored = {ticker for result in results if result is not None for ticker in result[1]}
+        # 格納済みだった銘柄と、今回格納できた銘柄だけを温める（取得できなかった銘柄は古いデータを入れてしまう）
+        ready = [ticker for ticker in tickers if ticker in coverages and (ticker not in starts or ticker in stored)]
+
+        self.sync_indicators(ready, session)
+        if self.mode == "hot":
+            self.warm_prices(ready, session)
+        else:
+            # 失敗したバッチの銘柄の日足が後から格納されると、その銘柄が属するグループは計算し直される（GroupAggregator.on_prices_inserted）
+            # ので、一部のバッチが失敗しても市場全体の集計は止めない
+            self.backend.aggregator.update_all(session - dt.timedelta(days=self.AGGREGATE_DAYS), session)
+
+        # 失敗したバッチがあれば済ませたことにせず、次のpoll_seconds後に取り直す
+        if failed == 0:
+            self._done[market] = session
+        else:
+            self.log.emit("INFO", "EodScheduler.run_market", message=f"{failed}/{len(batches)}バッチの取得に失敗したので取り直します", session=session.isoformat())
+        self.rows += rows
+        return rows
+
+    # 1バッチ分をまとめて取得して格納する
+    # return：(格納件数, データを格納できた銘柄)　取得に失敗した場合はNone
+    def ingest(self, tickers: list[str], starts: dict[str, dt.date], coverages: dict, session: dt.date, last_final: dt.date) -> tuple[int, list[str]] | None:
+        histories = self.fetch_with_retry(tickers, min(starts.values()), session)
+        if histories is None:
+            return None
+
+        count = 0
+        stored = []
+        for ticker in tickers:
+            history = histories.get(ticker)
+            missing = self.backend.calendar.sessions_between(starts[ticker], session)
+            count += self.backend.store_fetched_prices(ticker, coverages[ticker].security_id, history, missing, last_final, "daily", coverages[ticker].end_date)
+            if history is not None and len(history) > 0:
+                stored.append(ticker)
+        return count, stored
+
+    # 失敗した場合はbackoff_seconds、その倍…と間隔を広げて（ゆらぎを加えて）max_retries回まで取り直す
+    # 取得元は通信エラーや回数制限の場合に例外（price_provider.ProviderError）を送出するので、空の結果は失敗として扱わない
+    # （全銘柄が空のバッチは上場廃止・売買停止中の銘柄ばかりのもので、空白期間として記録される）
+    # それでも失敗した場合はNone（次のpoll_seconds後に取り直される）
+    def fetch_with_retry(self, tickers: list[str], start: dt.date, end: dt.date) -> dict[str, pandas.DataFrame] | None:
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                return self.backend.provider.history_many(tickers, start, end)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.errors += 1
+                    self.log.emit("ERROR", "EodScheduler.fetch", message=repr(e), tickers=tickers)
+                    return None
+                self.retries += 1
+                if self._stop.wait(self.backoff_seconds * 2 ** attempt * random.uniform(0.5, 1.5)):
+                    return None
+
+    # 計算状態がある銘柄の指標を逐次計算で続ける（状態がない銘柄は最初に求められた時に一括計算する）
+    def sync_indicators(self, tickers: list[str], session: dt.date) -> None:
+        engine = self.backend.indicators
+        for ticker in tickers:
+            security_id = self.backend.db.get_security_id(ticker)
+            state = engine.get_state(security_id)
+            if state is None or state.last_date >= session:
+                continue
+            prices = self.backend.db.select_from_prices(ticker, state.last_date, session, "daily")
+            if len(prices) > 1:
+                engine.sync(security_id, prices, state.valid_from)
+
+    # 結果キャッシュ（と列指向ストア）に直近WARM_DAYS日分を読み込んでおく（get_priceの確定済みの期間と同じ形で入れる）
+    # 欠けている取引日（確認済みの空白期間を除く）が残っている銘柄は入れない
+    def warm_prices(self, tickers: list[str], session: dt.date) -> None:
+        begin = session - dt.timedelta(days=self.WARM_DAYS)
+        cache = self.backend.price_cache
+        coverages = self.backend.db.get_price_coverages(tickers, begin, session)
+        for ticker in tickers:
+            security_id = self.backend.db.get_security_id(ticker)
+            if cache.get(security_id, "daily", begin, session) is not None or ticker not in coverages:
+                continue
+            if len(self.backend.plan_price_gaps(coverages[ticker], begin, session, session)) > 0:
+                continue
+            version = cache.version(security_id)
+            df = self.backend.db.select_from_prices(ticker, begin, session, "daily")
+            if not cache.put(security_id, "daily", begin, session, df, version):
+                continue
+            if self.backend.column_store is not None:
+                self.backend.column_store.put(security_id, begin, session, df)
+
+    # 引け後の市場があれば処理する
+    def run_once(self) -> int:
+        count = 0
+        for market, tickers in self.due().items():
+            count += self.run_market(market, tickers)
+        self.runs += 1
+        return count
+
+    # stopされるまでpoll_secondsごとにrun_onceを繰り返す
+    # 失敗しても止めずに次の回で取り直す
+    def run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                self.log.emit("ERROR", "EodScheduler.run", message=repr(e))
+
+            self._stop.wait(self.poll_seconds)
+
+    # 別スレッドで動かす
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="EodScheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def metrics(self) -> dict:
+        return dict(
+            mode = self.mode,
+            running = self._thread is not None and self._thread.is_alive(),
+            done = {f"{market.timezone} {market.close2 or market.close1}": day.isoformat() for market, day in self._done.items()},
+            runs = self.runs,
+            rows = self.rows,
+            retries = self.retries,
+            errors = self.errors,
+        )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=EodScheduler.MODES, default="universe")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=1.0, help="取得元への1秒あたりの呼び出し回数")
+    parser.add_argument("--once", action="store_true", help="引け後の市場を1回処理して終わる")
+    parser.add_argument("--column-store", help="日足の列指向ストアのディレクトリ（読み出し側と同じものを指定すると、書き込んだ日足をファイルにも取り込む）")
+    args = parser.parse_args()
+
+    import kabu
+    kabu.Backend.set_column_store(args.column_store)
+    scheduler = EodScheduler(kabu.Backend(), args.mode, workers=args.workers, batch_size=args.batch_size, rate_per_second=args.rate)
+    if args.once:
+        print(scheduler.run_once(), scheduler.metrics())
+        return
+
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
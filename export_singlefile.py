@@ -4,8 +4,23 @@ import re
 
 FILES = [
     "my_logging.py",
+    "tracing.py",
     "my_model.py",
+    "connection_pool.py",
+    "market_hours.py",
+    "security_master.py",
+    "trading_calendar.py",
+    "fetch_planner.py",
+    "price_provider.py",
+    "price_cache.py",
+    "quote_service.py",
+    "price_resampler.py",
+    "columnar_store.py",
     "database.py",
+    "indicators.py",
+    "screener.py",
+    "group_aggregates.py",
+    "eod_scheduler.py",
     "kabu.py",
     "tools.py",
 ]
@@ -16,7 +31,22 @@ OUTPUT.parent.mkdir(exist_ok=True)
 REMOVE_IMPORTS = [
     r"from my_model import",
     r"from my_logging import",
+    r"from tracing import",
+    r"from connection_pool import",
+    r"from market_hours import",
+    r"from security_master import",
+    r"from trading_calendar import",
+    r"from fetch_planner import",
+    r"from price_provider import",
+    r"from price_cache import",
+    r"from quote_service import",
+    r"from price_resampler import",
+    r"from columnar_store import",
     r"from database import",
+    r"from indicators import",
+    r"from screener import",
+    r"from group_aggregates import",
+    r"from eod_scheduler import",
     r"import kabu",
 ]
 
@@ -0,0 +1,129 @@
+import datetime as dt
+import threading
+import numpy
+from market_hours import MarketHours
+from trading_calendar import TradingCalendar
+
+# yfinanceから取得する期間を決める
+# DBに格納済みの取引日とTradingCalendarの取引日を比べ、途中の歯抜けも含めて実際に欠けている取引日だけを取りに行く
+# 取得してもデータが返ってこなかった期間（上場前・上場廃止・売買停止など）は確認済みの空白期間として覚えておき、
+# 確認してからEMPTY_SPAN_RECHECK_DAYS日が過ぎるまでは取りに行かない
+class FetchPlanner:
+    # DBにデータがない銘柄を初めて取得する際に最低限取る日数（概ね半年）
+    MIN_INITIAL_DAYS = 180
+    # 直近この日数の取引日はデータの反映が遅れている可能性があるので空白期間として記録しない
+    EMPTY_SPAN_GRACE_DAYS = 7
+    # 空白期間を確認してからこの日数が過ぎたら、空白とみなさずに取得し直す
+    EMPTY_SPAN_RECHECK_DAYS = 30
+    # 欠けている期間の間にある格納済みの取引日がこの日数以下なら、取り直しても呼び出しを減らす方が得なので1回の取得にまとめる
+    MAX_STORED_GAP_SESSIONS = 20
+
+    def __init__(self, calendar: TradingCalendar):
+        self.calendar = calendar
+
+        # security_id -> 確認済みの空白期間 [(最初の日, 最後の日, 確認した日), ...]
+        self._empty_spans: dict[int, list[tuple[dt.date, dt.date, dt.date | None]]] = {}
+        self._lock = threading.Lock()
+
+    # 確定済みの日足が存在する最後の取引日
+    # 当日が取引日で引け後なら当日、それ以外は前の取引日
+    def last_finalized_session(self, market: MarketHours) -> dt.date:
+        today = market.today()
+        if self.calendar.is_session(today) and market.is_closed():
+            return today
+
+        return self.calendar.previous_session(today, inclusive=False)
+
+    # 当日の取引時間中（昼休みを含む）で、まだ確定していない足があるか
+    def has_intraday_bar(self, market: MarketHours) -> bool:
+        today = market.today()
+        return self.calendar.is_session(today) and market.is_open() and not market.is_closed()
+
+    # DBに揃っているべき期間を返す 揃えるものがない場合はNone
+    # 該当銘柄のデータが存在しない場合はbeginから最後の確定日まで（ただし最低半年分）とする
+    def target_range(self, rows: int, begin: dt.date, end: dt.date, last_final: dt.date) -> tuple[dt.date, dt.date] | None:
+        if rows == 0:
+            begin = min(begin, last_final - dt.timedelta(days=self.MIN_INITIAL_DAYS))
+            end = last_final
+
+        # 未確定の日は取りに行かない
+        end = min(end, last_final)
+        if begin > end:
+            return None
+
+        return begin, end
+
+    # first～lastで揃っているべき取引日（確認済みの空白期間を除く）
+    # 確認してからEMPTY_SPAN_RECHECK_DAYS日を過ぎた空白期間（確認した日がないものを含む）は除かずに取得し直す
+    def expected_sessions(self, security_id: int, first: dt.date, last: dt.date, today: dt.date | None = None) -> numpy.ndarray:
+        if today is None:
+            today = dt.date.today()
+        fresh = today - dt.timedelta(days=self.EMPTY_SPAN_RECHECK_DAYS)
+
+        sessions = self.calendar.sessions_between(first, last)
+        for span_first, span_last, checked_at in self.get_empty_spans(security_id) or []:
+            if checked_at is None or checked_at < fresh:
+                continue
+            sessions = sessions[(sessions < numpy.datetime64(span_first, "D")) | (numpy.datetime64(span_last, "D") < sessions)]
+
+        return sessions
+
+    # 揃っているべき取引日のうちDBにないもの
+    def missing_sessions(self, expected: numpy.ndarray, stored_dates: list[dt.date]) -> numpy.ndarray:
+        stored = numpy.array(stored_dates, dtype="datetime64[D]")
+        return numpy.setdiff1d(expected, stored, assume_unique=True)
+
+    # 欠けている取引日を、カレンダー上で連続する取引日ごとの取得期間にまとめる
+    def merge_windows(self, missing: numpy.ndarray) -> list[tuple[dt.date, dt.date]]:
+        return self.calendar.split_runs(missing)
+
+    # 取得元から取る期間（欠けている取引日を含む連続した取引日のまとまり）
+    # merge_windowsのウィンドウのうち、間の格納済みの取引日がMAX_STORED_GAP_SESSIONS日以下のものは1つにまとめる
+    # 古い歯抜けと直近の欠けのように離れたものは別々に取り、間の格納済みの期間を取り直さない
+    def fetch_windows(self, missing: numpy.ndarray) -> list[tuple[dt.date, dt.date]]:
+        windows: list[tuple[dt.date, dt.date]] = []
+        for first, last in self.merge_windows(missing):
+            # 前のウィンドウの最後の日と今回の最初の日の間の取引日の数（両端を除く）
+            if windows and self.calendar.count_sessions(windows[-1][1], first) - 2 <= self.MAX_STORED_GAP_SESSIONS:
+                windows[-1] = (windows[-1][0], last)
+            else:
+                windows.append((first, last))
+        return windows
+
+    # 取得した結果、データが返ってこなかった期間
+    # fetched_datesは取得できた日付（取得元が返したすべての日付）、last_tradeはDBに格納済みの最後の日（ない場合はNone）
+    # 取得元は取得に失敗した場合に例外（price_provider.ProviderError）を送出するので、返ってこなかった取引日はデータがないものとして記録する
+    # 取得できた日の間の抜けに加え、その前後（上場前、上場廃止・売買停止）や、何も返ってこなかった期間も記録する
+    # 直近EMPTY_SPAN_GRACE_DAYS日分は取得元への反映が遅れているだけかもしれないので除くが、
+    # 最後に取引があった日がそれより前の場合（上場廃止、売買停止中）は遅れではないので最後の確定日まで記録する
+    def empty_spans_after_fetch(self, missing: numpy.ndarray, fetched_dates: numpy.ndarray, last_final: dt.date, last_trade: dt.date | None = None) -> list[tuple[dt.date, dt.date]]:
+        fetched = numpy.asarray(fetched_dates, dtype="datetime64[D]")
+        empty = numpy.setdiff1d(missing, fetched, assume_unique=False)
+        empty = empty[empty <= numpy.datetime64(last_final, "D")]
+
+        cutoff = numpy.datetime64(last_final - dt.timedelta(days=self.EMPTY_SPAN_GRACE_DAYS), "D")
+        traded = [numpy.datetime64(last_trade, "D")] if last_trade is not None else []
+        if len(fetched) > 0:
+            traded.append(fetched.max())
+        if not traded or max(traded) >= cutoff:
+            empty = empty[empty < cutoff]
+        return self.calendar.split_runs(empty)
+
+    # 確認済みの空白期間（まだ読み込んでいない場合はNone）
+    def get_empty_spans(self, security_id: int) -> list[tuple[dt.date, dt.date, dt.date | None]] | None:
+        return self._empty_spans.get(security_id)
+
+    def set_empty_spans(self, security_id: int, spans: list[tuple[dt.date, dt.date, dt.date | None]]) -> None:
+        with self._lock:
+            self._empty_spans[security_id] = sorted(spans, key=lambda span: span[0])
+
+    # 同じ最初の日の空白期間はDBと同じく1つにまとめる（最後の日は長い方、確認した日は新しい方）
+    def add_empty_spans(self, security_id: int, spans: list[tuple[dt.date, dt.date, dt.date | None]]) -> None:
+        with self._lock:
+            merged = {span[0]: span for span in self._empty_spans.get(security_id, [])}
+            for first, last, checked_at in spans:
+                if first in merged:
+                    _, old_last, _ = merged[first]
+                    last = max(last, old_last)
+                merged[first] = (first, last, checked_at)
+            self._empty_spans[security_id] = sorted(merged.values(), key=lambda span: span[0])
@@ -0,0 +1,339 @@
+import datetime as dt
+import threading
+import numpy
+import pandas
+from database import DB
+from trading_calendar import TradingCalendar
+from indicators import to_panel
+from screener import previous_close
+
+# 業種（sectors／security_sectors）、指数（indices／index_components）ごとの集計値
+#   リターン：構成銘柄の日次リターンの単純平均（equal）と、index_components.weightによる加重平均（weighted　指数のみ）
+#   水準：初日を100としてリターンを積み上げた値
+#   騰落・ブレス：値上がり・値下がり銘柄数、SMA25/50/75を上回る銘柄の割合（指標が計算済みの銘柄のうち）
+# DBに格納済みの日足だけから計算し、group_aggregatesに日ごとに保存する
+# 保存済みの最後の日より後の分だけを計算して追加するので、新しい足が入った後の更新は数日分の読み込みで済む
+# 保存済みの期間内の日足が書き込まれた（取り直された）場合は、on_prices_insertedで構成銘柄のグループにその日を記録しておき、
+# 次のupdateでその日から計算し直す（水準は積み上げなので、その日より後もすべて計算し直す）
+# 全グループをまとめて更新する場合も、構成銘柄の行列（グループ×銘柄）との行列積で一度に計算する
+class GroupAggregator:
+    KINDS = ("sector", "index")
+
+    # 前日の終値を求めるために、計算する期間の前に読み込む取引日の数（売買停止明けの銘柄用）
+    MARGIN_SESSIONS = 10
+
+    # 水準の基準値
+    BASE_LEVEL = 100.0
+
+    VALUE_COLUMNS = ["equal_return", "equal_level", "weighted_return", "weighted_level", "members", "advancers", "decliners", "above_sma25", "above_sma50", "above_sma75"]
+
+    UPSERT_SQL = f"""
+        INSERT INTO group_aggregates (kind, group_id, date, {", ".join(VALUE_COLUMNS)})
+        VALUES (%s, %s, %s, {", ".join(["%s"] * len(VALUE_COLUMNS))})
+        ON DUPLICATE KEY UPDATE
+            {", ".join(f"{col} = VALUES({col})" for col in VALUE_COLUMNS)}
+    """
+
+    LOAD_SQL = """
+        SELECT p.security_id, TO_DAYS(p.date) - 719528, p.close + 0E0, v.sma25, v.sma50, v.sma75
+        FROM prices p
+        LEFT JOIN indicator_values v ON v.security_id = p.security_id AND v.date = p.date
+        WHERE p.date BETWEEN %s AND %s AND p.time = '00:00:00' AND p.security_id IN ({placeholders})
+    """
+
+    def __init__(self, db: DB, calendar: TradingCalendar):
+        self.db = db
+        self.calendar = calendar
+        self._lock = threading.Lock()
+
+        # 書き込まれた日足の最初の日　security_id -> 日付（次のupdateでグループに振り分ける）
+        # 書き込みの度にDBへ問い合わせないように、振り分けはupdateでまとめて行う
+        self._inserted: dict[int, dt.date] = {}
+        # 計算し直す最初の日　(kind, group_id) -> 日付
+        self._dirty: dict[tuple[str, int], dt.date] = {}
+        self._dirty_lock = threading.Lock()
+
+    # 業種名（classificationの分類の中の名前）または指数コードからgroup_idを求める　該当しない場合はValueError
+    def resolve(self, kind: str, name: str, classification: str = "TSE33") -> int:
+        if kind == "sector":
+            row = DB.fetchone("""
+                SELECT s.id
+                FROM sectors s
+                JOIN sector_classifications c ON c.id = s.sector_classification_id
+                WHERE s.name = %s AND c.code = %s
+            """, (name, classification))
+        elif kind == "index":
+            row = DB.fetchone("SELECT id FROM indices WHERE code = %s", (name,))
+        else:
+            raise ValueError(f"未対応の集計の種類です：{kind}（{', '.join(self.KINDS)}のいずれか）")
+
+        if row is None:
+            raise ValueError(f"該当する業種・指数がありません：{name}")
+        return row[0]
+
+    # kindの全グループのgroup_id
+    def group_ids(self, kind: str) -> list[int]:
+        if kind == "sector":
+            rows = DB.fetchall("SELECT id FROM sectors")
+        else:
+            rows = DB.fetchall("SELECT id FROM indices")
+        return [row[0] for row in rows]
+
+    # グループごとの構成銘柄と比率
+    # return：group_id -> (security_idの配列, weightの配列（業種、weightがNULLの銘柄はNaN）)
+    def members(self, kind: str, group_ids: list[int]) -> dict[int, tuple[numpy.ndarray, numpy.ndarray]]:
+        placeholders = ", ".join(["%s"] * len(group_ids))
+        if kind == "sector":
+            rows = DB.fetchall(f"""
+                SELECT sector_id, security_id, NULL
+                FROM security_sectors
+                WHERE sector_id IN ({placeholders})
+            """, tuple(group_ids))
+        else:
+            rows = DB.fetchall(f"""
+                SELECT index_id, security_id, weight + 0E0
+                FROM index_components
+                WHERE index_id IN ({placeholders})
+            """, tuple(group_ids))
+
+        result = {}
+        for group_id in group_ids:
+            group_rows = [row for row in rows if row[0] == group_id]
+            result[group_id] = (
+                numpy.array([row[1] for row in group_rows], dtype=numpy.int64),
+                numpy.array([numpy.nan if row[2] is None else row[2] for row in group_rows], dtype=numpy.float64),
+            )
+        return result
+
+    # 保存済みの期間と最後の日の水準
+    # return：group_id -> (最初の日, 最後の日, 単純平均の水準, 加重平均の水準)
+    def stored(self, kind: str, group_ids: list[int]) -> dict[int, tuple[dt.date, dt.date, float | None, float | None]]:
+        placeholders = ", ".join(["%s"] * len(group_ids))
+        rows = DB.fetchall(f"""
+            SELECT a.group_id, r.first_date, r.last_date, a.equal_level, a.weighted_level
+            FROM group_aggregates a
+            JOIN (
+                SELECT group_id, MIN(date) AS first_date, MAX(date) AS last_date
+                FROM group_aggregates
+                WHERE kind = %s AND group_id IN ({placeholders})
+                GROUP BY group_id
+            ) r ON a.group_id = r.group_id AND a.date = r.last_date
+            WHERE a.kind = %s
+        """, (kind, *group_ids, kind))
+
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    # group_idの、before より前で保存済みの最後の日とその日の水準　なければNone
+    def stored_before(self, kind: str, group_id: int, before: dt.date) -> tuple[dt.date, float | None, float | None] | None:
+        return DB.fetchone("""
+            SELECT date, equal_level, weighted_level
+            FROM group_aggregates
+            WHERE kind = %s AND group_id = %s AND date < %s
+            ORDER BY date DESC
+            LIMIT 1
+        """, (kind, group_id, before))
+
+    # DB.add_insert_listenerに登録する
+    # 日足が書き込まれた銘柄と最初の日を覚えておく（どのグループに属するかはupdateでまとめて調べる）
+    def on_prices_inserted(self, security_id: int, chart_granularity: str, prices: pandas.DataFrame) -> None:
+        if chart_granularity != "daily" or prices is None or prices.empty:
+            return
+
+        first = pandas.DatetimeIndex(prices.index).min().date()
+        with self._dirty_lock:
+            if security_id not in self._inserted or first < self._inserted[security_id]:
+                self._inserted[security_id] = first
+
+    # 書き込まれた銘柄を、属する業種・指数のグループの計算し直す日に振り分ける
+    # return：(kind, group_id) -> 計算し直す最初の日
+    def dirty_groups(self) -> dict[tuple[str, int], dt.date]:
+        with self._dirty_lock:
+            inserted, self._inserted = self._inserted, {}
+
+        if inserted:
+            placeholders = ", ".join(["%s"] * len(inserted))
+            rows = DB.fetchall(f"""
+                SELECT 'sector', sector_id, security_id FROM security_sectors WHERE security_id IN ({placeholders})
+                UNION ALL
+                SELECT 'index', index_id, security_id FROM index_components WHERE security_id IN ({placeholders})
+            """, (*inserted, *inserted))
+
+            with self._dirty_lock:
+                for kind, group_id, security_id in rows:
+                    key = (kind, group_id)
+                    if key not in self._dirty or inserted[security_id] < self._dirty[key]:
+                        self._dirty[key] = inserted[security_id]
+
+        with self._dirty_lock:
+            return dict(self._dirty)
+
+    # 日付×銘柄の終値とSMAの行列、構成銘柄の行列（グループ×銘柄）から、日付×グループの集計値を計算する
+    # weightsは構成銘柄でない所を0、比率がない所をNaNとした行列
+    @staticmethod
+    def aggregate(close: numpy.ndarray, smas: dict[int, numpy.ndarray], membership: numpy.ndarray, weights: numpy.ndarray) -> dict[str, numpy.ndarray]:
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            returns = close / previous_close(close) - 1
+            valid = ~numpy.isnan(returns)
+            r = numpy.where(valid, returns, 0.0)
+
+            members = valid.astype(numpy.float64) @ membership.T
+            result = dict(
+                equal_return = (r @ membership.T) / members,
+                members = members,
+                advancers = (returns > 0).astype(numpy.float64) @ membership.T,
+                decliners = (returns < 0).astype(numpy.float64) @ membership.T,
+            )
+
+            # 比率がない銘柄を含むグループは加重平均を出さない
+            has_weights = ~numpy.isnan(weights).any(axis=1) & (numpy.nan_to_num(weights).sum(axis=1) > 0)
+            w = numpy.nan_to_num(weights)
+            weighted = (r @ w.T) / (valid.astype(numpy.float64) @ w.T)
+            weighted[:, ~has_weights] = numpy.nan
+            result["weighted_return"] = weighted
+
+            for length, sma in smas.items():
+                has = ~numpy.isnan(sma) & ~numpy.isnan(close)
+                above = (close > sma) & has
+                result[f"above_sma{length}"] = (above.astype(numpy.float64) @ membership.T) / (has.astype(numpy.float64) @ membership.T)
+
+        return result
+
+    # group_idsの集計値をendまで計算して保存する
+    # 保存済みのグループは最後の日の翌日から、保存されていない（またはbeginが保存済みの最初の日より前の）グループはbeginから計算し直す
+    # 保存済みの期間内に日足が書き込まれたグループは、その日の前の保存済みの日から保存済みの最後の日（endより後ならそこ）まで計算し直す
+    # return：保存した行数
+    def update(self, kind: str, group_ids: list[int], begin: dt.date, end: dt.date) -> int:
+        if not group_ids:
+            return 0
+
+        with self._lock:
+            stored = self.stored(kind, group_ids)
+            dirty = self.dirty_groups()
+            # グループごとの計算を始める日（この日より後を保存する）とその日の水準、計算し直すか、計算する最後の日
+            starts: dict[int, tuple[dt.date, float | None, float | None, bool, dt.date]] = {}
+            # 途中から計算し直すグループ -> この日より後の保存済みの行を消す
+            truncated: dict[int, dt.date] = {}
+            for group_id in group_ids:
+                if group_id in stored and stored[group_id][0] <= begin:
+                    first, last, equal_level, weighted_level = stored[group_id]
+                    since = dirty.get((kind, group_id))
+                    if since is not None and since <= last:
+                        previous = self.stored_before(kind, group_id, since)
+                        if previous is None:
+                            starts[group_id] = (first, None, None, True, max(end, last))
+                        else:
+                            starts[group_id] = (*previous, False, max(end, last))
+                            truncated[group_id] = previous[0]
+                    elif last < end:
+                        starts[group_id] = (last, equal_level, weighted_level, False, end)
+                else:
+                    starts[group_id] = (begin, None, None, True, end)
+            if not starts:
+                self.clear_dirty(kind, group_ids, dirty)
+                return 0
+            end = max(until for _, _, _, _, until in starts.values())
+
+            members = self.members(kind, list(starts))
+            ids = numpy.unique(numpy.concatenate([security_ids for security_ids, _ in members.values()] + [numpy.array([], dtype=numpy.int64)]))
+            if len(ids) == 0:
+                self.clear_dirty(kind, group_ids, dirty)
+                return 0
+
+            # 計算を始める日の前日の終値が要るので、少し前から読み込む
+            first = min(start for start, _, _, _, _ in starts.values())
+            sessions = self.calendar.sessions_between(first - dt.timedelta(days=self.MARGIN_SESSIONS * 2 + 10), first)
+            load_begin = sessions[max(0, len(sessions) - 1 - self.MARGIN_SESSIONS)].item()
+            values = DB.fetch_array(self.LOAD_SQL.format(placeholders=", ".join(["%s"] * len(ids))), (load_begin, end, *ids.tolist()), 6)
+            days, panel_ids, (close, sma25, sma50, sma75) = to_panel(values)
+
+            # 構成銘柄の行列（グループ×銘柄）
+            groups = list(starts)
+            membership = numpy.zeros((len(groups), len(panel_ids)))
+            weights = numpy.zeros((len(groups), len(panel_ids)))
+            for g, group_id in enumerate(groups):
+                security_ids, group_weights = members[group_id]
+                columns = numpy.searchsorted(panel_ids, security_ids)
+                found = (columns < len(panel_ids)) & (panel_ids[numpy.minimum(columns, len(panel_ids) - 1)] == security_ids)
+                membership[g, columns[found]] = 1.0
+                weights[g, columns[found]] = group_weights[found]
+
+            result = self.aggregate(close, {25: sma25, 50: sma50, 75: sma75}, membership, weights)
+
+            rows = []
+            recomputed = []
+            for g, group_id in enumerate(groups):
+                start, equal_level, weighted_level, is_new, until = starts[group_id]
+                # 新しく計算するグループは開始日を含め、開始日の水準を基準値にする
+                target = (days >= numpy.datetime64(start, "D")) if is_new else (days > numpy.datetime64(start, "D"))
+                target &= (days <= numpy.datetime64(until, "D")) & (result["members"][:, g] > 0)
+                positions = numpy.flatnonzero(target)
+                if len(positions) == 0:
+                    continue
+                if is_new:
+                    recomputed.append(group_id)
+
+                levels = {}
+                for name, level in (("equal", equal_level), ("weighted", weighted_level)):
+                    r = result[f"{name}_return"][positions, g]
+                    growth = numpy.cumprod(1 + numpy.nan_to_num(r))
+                    if is_new:
+                        # 開始日を基準値とし、翌日からのリターンを積み上げる
+                        growth, level = growth / growth[0], self.BASE_LEVEL
+                    if level is None or numpy.isnan(r).all():
+                        levels[name] = numpy.full(len(r), numpy.nan)
+                    else:
+                        levels[name] = level * growth
+
+                columns = [
+                    result["equal_return"][positions, g], levels["equal"],
+                    result["weighted_return"][positions, g], levels["weighted"],
+                    result["members"][positions, g], result["advancers"][positions, g], result["decliners"][positions, g],
+                    result["above_sma25"][positions, g], result["above_sma50"][positions, g], result["above_sma75"][positions, g],
+                ]
+                for i, p in enumerate(positions):
+                    values = [None if numpy.isnan(column[i]) else float(column[i]) for column in columns]
+                    rows.append((kind, group_id, days[p].item(), *values))
+
+            self.save(kind, recomputed, rows, truncated)
+            self.clear_dirty(kind, group_ids, dirty)
+            return len(rows)
+
+    # 計算し直したグループの記録を消す（dirty_groupsで読んだ後に記録された日は残す）
+    def clear_dirty(self, kind: str, group_ids: list[int], dirty: dict[tuple[str, int], dt.date]) -> None:
+        with self._dirty_lock:
+            for group_id in group_ids:
+                key = (kind, group_id)
+                if key in dirty and self._dirty.get(key) == dirty[key]:
+                    del self._dirty[key]
+
+    # 行を書き込む　計算し直したグループは先に保存済みの行を消す（truncatedのグループはその日より後の行のみ）
+    def save(self, kind: str, recomputed: list[int], rows: list[tuple], truncated: dict[int, dt.date] | None = None, chunk_size: int = DB.INSERT_CHUNK_SIZE) -> None:
+        with DB.connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("START TRANSACTION")
+                if recomputed:
+                    cur.execute(f"DELETE FROM group_aggregates WHERE kind = %s AND group_id IN ({', '.join(['%s'] * len(recomputed))})", (kind, *recomputed))
+                for group_id, after in (truncated or {}).items():
+                    cur.execute("DELETE FROM group_aggregates WHERE kind = %s AND group_id = %s AND date > %s", (kind, group_id, after))
+                for i in range(0, len(rows), chunk_size):
+                    cur.executemany(self.UPSERT_SQL, rows[i:i + chunk_size])
+                conn.commit()
+            finally:
+                cur.close()
+
+    # 全業種・全指数をendまで更新する（保存されていないグループはbeginから）
+    def update_all(self, begin: dt.date, end: dt.date) -> dict[str, int]:
+        return {kind: self.update(kind, self.group_ids(kind), begin, end) for kind in self.KINDS}
+
+    # begin～end（両端を含む）の保存済みの集計値（indexは日付）
+    def select(self, kind: str, group_id: int, begin: dt.date, end: dt.date) -> pandas.DataFrame:
+        values = DB.fetch_array(f"""
+            SELECT TO_DAYS(date) - 719528, {", ".join(self.VALUE_COLUMNS)}
+            FROM group_aggregates
+            WHERE kind = %s AND group_id = %s AND date BETWEEN %s AND %s
+            ORDER BY date ASC
+        """, (kind, group_id, begin, end), 1 + len(self.VALUE_COLUMNS))
+
+        index = pandas.DatetimeIndex(values[:, 0].astype(numpy.int64).astype("datetime64[D]").astype("datetime64[ns]"))
+        return pandas.DataFrame(values[:, 1:], columns=self.VALUE_COLUMNS, index=index)
@@ -0,0 +1,118 @@
+import argparse
+import datetime as dt
+import time
+import numpy
+from database import DB
+from trading_calendar import TradingCalendar
+from indicators import IndicatorEngine, IndicatorState, INDICATOR_COLUMNS, compute_indicators, to_panel
+
+# 全銘柄（または指定した銘柄）の日足を日付×銘柄の行列として読み込み、テクニカル指標を全銘柄まとめて計算するジョブ
+# 計算はindicators.compute_indicatorsの2次元版（時間軸方向のrolling・ewmを全列まとめて）で行い、
+# 値と逐次計算の状態をIndicatorEngineのテーブルに一括で書き込む（以降は銘柄ごとに逐次計算で続きを追加できる）
+# DBに格納済みの日足だけを使う（足りない日足の取得は行わない）
+# 実行例：python indicator_panel.py --begin 2024-01-01
+#         python indicator_panel.py --begin 2024-01-01 --tickers 7203.T 9432.T
+class IndicatorPanel:
+    LOAD_SQL = """
+        SELECT security_id, TO_DAYS(date) - 719528, close + 0E0, volume
+        FROM prices
+        WHERE date BETWEEN %s AND %s AND time = '00:00:00'{condition}
+    """
+
+    def __init__(self, db: DB | None = None, calendar: TradingCalendar | None = None, engine: IndicatorEngine | None = None):
+        self.db = db if db is not None else DB()
+        self.calendar = calendar if calendar is not None else TradingCalendar()
+        self.engine = engine if engine is not None else IndicatorEngine(self.db, self.calendar)
+
+    # begin～end（両端を含む）の日足を読み込み、(日付の配列, security_idの配列, 終値の行列, 出来高の行列)を返す
+    # 行列は日付×銘柄で、足がない所（上場前、売買停止など）はNaN
+    # security_idsがNoneの場合は格納済みの全銘柄
+    def load(self, begin: dt.date, end: dt.date, security_ids: list[int] | None = None) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        condition = ""
+        params: tuple = (begin, end)
+        if security_ids is not None:
+            if not security_ids:
+                empty = numpy.empty((0, 0))
+                return numpy.array([], dtype="datetime64[D]"), numpy.array([], dtype=numpy.int64), empty, empty
+            condition = f" AND security_id IN ({', '.join(['%s'] * len(security_ids))})"
+            params += tuple(security_ids)
+
+        values = DB.fetch_array(self.LOAD_SQL.format(condition=condition), params, 4)
+        days, ids, (close, volume) = to_panel(values)
+        return days, ids, close, volume
+
+    # 日付×銘柄の終値の行列から指標を計算する（戻り値の行列の形は入力と同じ、足がない所はNaN）
+    # 銘柄ごとに足がある行だけを上に詰めて計算し、元の位置に戻す
+    # 売買停止などで間に足がない銘柄も、1銘柄ずつ計算した場合（get_technical_analysis）と同じ値になる
+    # intermediates=Trueの場合は詰めたままの途中の値（状態を作るため）と列ごとの足の数も返す
+    @staticmethod
+    def compute(close: numpy.ndarray, intermediates: bool = False) -> tuple[dict[str, numpy.ndarray], dict[str, numpy.ndarray] | None, numpy.ndarray]:
+        valid = ~numpy.isnan(close)
+        order = numpy.argsort(~valid, axis=0, kind="stable")
+        packed = compute_indicators(numpy.take_along_axis(close, order, axis=0), intermediates=intermediates)
+
+        result = {}
+        for col in INDICATOR_COLUMNS:
+            values = numpy.empty_like(close)
+            numpy.put_along_axis(values, order, packed[col], axis=0)
+            values[~valid] = numpy.nan
+            result[col] = values
+
+        return result, packed if intermediates else None, valid.sum(axis=0)
+
+    # begin～endの指標を全銘柄まとめて計算して書き込む
+    # 開始日の前の助走期間（IndicatorEngine.WARMUP_SESSIONS本）も読み込み、値はbegin以降を書き込む
+    # return：件数と所要時間
+    def run(self, begin: dt.date, end: dt.date, security_ids: list[int] | None = None) -> dict:
+        started = time.perf_counter()
+        days, ids, close, _ = self.load(self.engine.warmup_begin(begin), end, security_ids)
+        loaded = time.perf_counter()
+
+        result, packed, counts = self.compute(close, intermediates=True)
+        computed = time.perf_counter()
+
+        # 銘柄ごとの最後の足まで進めた計算状態（詰めた途中の値の先頭counts本から作る）
+        states = {}
+        for j in numpy.flatnonzero(counts > 0):
+            column = {name: values[:counts[j], j] for name, values in packed.items()}
+            last_date = days[numpy.flatnonzero(~numpy.isnan(close[:, j]))[-1]].item()
+            states[int(ids[j])] = IndicatorState.from_batch(begin, last_date, column)
+
+        # begin以降で足がある所を(security_id, date, *値)の行にする
+        target = ~numpy.isnan(close)
+        target[days < numpy.datetime64(begin, "D")] = False
+        rows_at, columns_at = numpy.nonzero(target)
+        values = numpy.column_stack([result[col][rows_at, columns_at] for col in INDICATOR_COLUMNS])
+        missing = numpy.isnan(values)
+        values = values.astype(object)
+        values[missing] = None
+        records = list(zip(ids[columns_at].tolist(), days[rows_at].astype(object), *values.T))
+
+        self.engine.save_many(records, states)
+        saved = time.perf_counter()
+
+        return dict(
+            securities = len(states),
+            sessions = int((days >= numpy.datetime64(begin, "D")).sum()),
+            rows = len(records),
+            load_seconds = round(loaded - started, 3),
+            compute_seconds = round(computed - loaded, 3),
+            save_seconds = round(saved - computed, 3),
+        )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--begin", type=dt.date.fromisoformat, required=True)
+    parser.add_argument("--end", type=dt.date.fromisoformat, default=dt.date.today())
+    parser.add_argument("--tickers", nargs="*", default=None, help="対象の銘柄（省略した場合は格納済みの全銘柄）")
+    args = parser.parse_args()
+
+    panel = IndicatorPanel()
+    security_ids = None
+    if args.tickers is not None:
+        security_ids = [security_id for security_id in map(panel.db.get_security_id, args.tickers) if security_id is not None]
+
+    print(panel.run(args.begin, args.end, security_ids))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+import datetime as dt
+import json
+import threading
+import numpy
+import pandas
+from database import DB
+from trading_calendar import TradingCalendar
+from tracing import tracer
+
+# テクニカル指標（SMA25/50/75、RSI14、MACD）の計算
+# do_technical_analysis（pandas_ta_classic）と同じ定義で、
+#   一括計算：日付×銘柄の2次元配列に対して列ごとにまとめて計算する（バックフィル、パネル計算用）
+#   逐次計算：銘柄ごとの計算状態（IndicatorState）を持ち、新しい足1本ごとにO(1)で更新する
+# の2通りを持つ
+# EMA、RSIのRMA、MACDのシグナルはいずれも「最初のn本の単純平均を初期値にした指数平滑」なので、
+# (入力の本数, 最初のn本の合計, 現在値) の3つを持てば続きから計算できる
+
+SMA_LENGTHS = (25, 50, 75)
+RSI_LENGTH = 14
+MACD_FAST = 12
+MACD_SLOW = 26
+MACD_SIGNAL = 9
+
+# 出力列（do_technical_analysisと同じ列名）
+INDICATOR_COLUMNS = [f"SMA_{length}" for length in SMA_LENGTHS] + [f"RSI_{RSI_LENGTH}", "MACD", "MACD_histogram", "MACD_signal"]
+
+# 最初のn本（列ごとに最初の有効値から数える）の単純平均を初期値にした指数平滑
+# valuesは日付×銘柄の2次元配列、初期値より前はNaN
+def seeded_ema(values: numpy.ndarray, length: int, alpha: float) -> numpy.ndarray:
+    values = numpy.array(values, dtype=numpy.float64)
+    n = values.shape[0]
+    valid = ~numpy.isnan(values)
+    first = numpy.where(valid.any(axis=0), valid.argmax(axis=0), n)
+    seed = first + length - 1
+
+    # 初期値の位置より前を捨て、初期値の位置に最初のn本の平均を入れる
+    cumsum = numpy.concatenate((numpy.zeros((1, values.shape[1])), numpy.nancumsum(values, axis=0)))
+    columns = numpy.flatnonzero(seed < n)
+    rows = numpy.arange(n)[:, None]
+    values[rows < seed[None, :]] = numpy.nan
+    values[seed[columns], columns] = (cumsum[seed[columns] + 1, columns] - cumsum[first[columns], columns]) / length
+
+    return pandas.DataFrame(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+
+# 終値（1次元：1銘柄、2次元：日付×銘柄）から全指標を一括で計算する
+# intermediates=Trueの場合は逐次計算の状態を作るための途中の値も返す
+def compute_indicators(close: numpy.ndarray, intermediates: bool = False) -> dict[str, numpy.ndarray]:
+    close = numpy.asarray(close, dtype=numpy.float64)
+    squeeze = close.ndim == 1
+    if squeeze:
+        close = close[:, None]
+
+    frame = pandas.DataFrame(close)
+    result = {f"SMA_{length}": frame.rolling(length, min_periods=length).mean().to_numpy() for length in SMA_LENGTHS}
+
+    diff = numpy.full_like(close, numpy.nan)
+    diff[1:] = close[1:] - close[:-1]
+    up = numpy.where(diff > 0, diff, numpy.where(numpy.isnan(diff), numpy.nan, 0.0))
+    down = numpy.where(diff < 0, -diff, numpy.where(numpy.isnan(diff), numpy.nan, 0.0))
+    up_avg = seeded_ema(up, RSI_LENGTH, 1.0 / RSI_LENGTH)
+    down_avg = seeded_ema(down, RSI_LENGTH, 1.0 / RSI_LENGTH)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        result[f"RSI_{RSI_LENGTH}"] = 100 * up_avg / (up_avg + down_avg)
+
+    fast = seeded_ema(close, MACD_FAST, 2.0 / (MACD_FAST + 1))
+    slow = seeded_ema(close, MACD_SLOW, 2.0 / (MACD_SLOW + 1))
+    macd = fast - slow
+    signal = seeded_ema(macd, MACD_SIGNAL, 2.0 / (MACD_SIGNAL + 1))
+    result["MACD"] = macd
+    result["MACD_histogram"] = macd - signal
+    result["MACD_signal"] = signal
+
+    if intermediates:
+        result.update(_close=close, _up=up, _down=down, _up_avg=up_avg, _down_avg=down_avg, _fast=fast, _slow=slow, _macd=macd, _signal=signal)
+
+    if squeeze:
+        result = {name: values[:, 0] for name, values in result.items()}
+    return result
+
+# (security_id, UNIX epochからの日数, 値...)の行の配列を、日付×銘柄の行列にする
+# return：(日付の配列, security_idの配列, 値の列ごとの行列のリスト)　足がない所はNaN
+def to_panel(values: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, list[numpy.ndarray]]:
+    ids, columns = numpy.unique(values[:, 0].astype(numpy.int64), return_inverse=True)
+    days, rows = numpy.unique(values[:, 1].astype(numpy.int64), return_inverse=True)
+    matrices = []
+    for i in range(2, values.shape[1]):
+        matrix = numpy.full((len(days), len(ids)), numpy.nan)
+        matrix[rows, columns] = values[:, i]
+        matrices.append(matrix)
+
+    return days.astype("datetime64[D]"), ids, matrices
+
+# 初期値付き指数平滑の逐次計算の状態
+class SeededEMA:
+    def __init__(self, length: int, alpha: float, count: int = 0, seed_sum: float = 0.0, value: float = numpy.nan):
+        self.length = length
+        self.alpha = alpha
+        self.count = count
+        self.seed_sum = seed_sum
+        self.value = value
+
+    # 1本分進めて現在値を返す（初期値ができるまではNaN）
+    def update(self, x: float) -> float:
+        if numpy.isnan(x):
+            return self.value if self.count >= self.length else numpy.nan
+
+        self.count += 1
+        if self.count < self.length:
+            self.seed_sum += x
+        elif self.count == self.length:
+            self.value = (self.seed_sum + x) / self.length
+        else:
+            self.value = self.alpha * x + (1 - self.alpha) * self.value
+
+        return self.value if self.count >= self.length else numpy.nan
+
+    # 一括計算の入力と出力（1次元）から、最後の足まで進めた状態を作る
+    @classmethod
+    def from_batch(cls, length: int, alpha: float, inputs: numpy.ndarray, outputs: numpy.ndarray) -> "SeededEMA":
+        valid = ~numpy.isnan(inputs)
+        count = int(valid.sum())
+        seed_sum = float(inputs[valid][:length - 1].sum()) if count < length else 0.0
+        value = float(outputs[valid][-1]) if count >= length else numpy.nan
+        return cls(length, alpha, count, seed_sum, value)
+
+    def to_list(self) -> list:
+        return [self.count, self.seed_sum, None if numpy.isnan(self.value) else self.value]
+
+    @classmethod
+    def from_list(cls, length: int, alpha: float, values: list) -> "SeededEMA":
+        return cls(length, alpha, int(values[0]), float(values[1]), numpy.nan if values[2] is None else float(values[2]))
+
+# 1銘柄の逐次計算の状態
+# last_dateまでの足を反映済みで、valid_from以降の値は十分な助走期間を経ている
+class IndicatorState:
+    def __init__(self, valid_from: dt.date, last_date: dt.date, window: list[float], prev_close: float,
+                 up: SeededEMA, down: SeededEMA, fast: SeededEMA, slow: SeededEMA, signal: SeededEMA):
+        self.valid_from = valid_from
+        self.last_date = last_date
+        # SMAの計算用に直近max(SMA_LENGTHS)本の終値を持つ
+        self.window = window
+        self.prev_close = prev_close
+        self.up = up
+        self.down = down
+        self.fast = fast
+        self.slow = slow
+        self.signal = signal
+
+    @staticmethod
+    def new_emas() -> tuple[SeededEMA, ...]:
+        return (
+            SeededEMA(RSI_LENGTH, 1.0 / RSI_LENGTH),
+            SeededEMA(RSI_LENGTH, 1.0 / RSI_LENGTH),
+            SeededEMA(MACD_FAST, 2.0 / (MACD_FAST + 1)),
+            SeededEMA(MACD_SLOW, 2.0 / (MACD_SLOW + 1)),
+            SeededEMA(MACD_SIGNAL, 2.0 / (MACD_SIGNAL + 1)),
+        )
+
+    # dateの終値closeを反映し、その日の指標を返す
+    def update(self, date: dt.date, close: float) -> dict[str, float]:
+        self.window = (self.window + [close])[-max(SMA_LENGTHS):]
+        result = {}
+        for length in SMA_LENGTHS:
+            window = self.window[-length:]
+            result[f"SMA_{length}"] = sum(window) / length if len(window) == length and not numpy.isnan(window).any() else numpy.nan
+
+        diff = close - self.prev_close if self.prev_close is not None else numpy.nan
+        up = self.up.update(max(diff, 0.0) if not numpy.isnan(diff) else numpy.nan)
+        down = self.down.update(max(-diff, 0.0) if not numpy.isnan(diff) else numpy.nan)
+        result[f"RSI_{RSI_LENGTH}"] = 100 * up / (up + down) if up + down > 0 else numpy.nan
+
+        macd = self.fast.update(close) - self.slow.update(close)
+        signal = self.signal.update(macd)
+        result["MACD"] = macd
+        result["MACD_histogram"] = macd - signal
+        result["MACD_signal"] = signal
+
+        self.prev_close = close
+        self.last_date = date
+        return result
+
+    # 状態を変えずにdateの終値がcloseだった場合の指標を返す（場中の未確定の足用）
+    def preview(self, date: dt.date, close: float) -> dict[str, float]:
+        return IndicatorState.from_json(self.to_json()).update(date, close)
+
+    # compute_indicators(intermediates=True)の結果（1次元）から最後の足まで進めた状態を作る
+    @classmethod
+    def from_batch(cls, valid_from: dt.date, last_date: dt.date, result: dict[str, numpy.ndarray]) -> "IndicatorState":
+        close = result["_close"]
+        valid = close[~numpy.isnan(close)]
+        emas = cls.new_emas()
+        inputs = [result["_up"], result["_down"], close, close, result["_macd"]]
+        outputs = [result["_up_avg"], result["_down_avg"], result["_fast"], result["_slow"], result["_signal"]]
+        emas = [SeededEMA.from_batch(ema.length, ema.alpha, x, y) for ema, x, y in zip(emas, inputs, outputs)]
+        return cls(valid_from, last_date, close[-max(SMA_LENGTHS):].tolist(), float(valid[-1]) if len(valid) else None, *emas)
+
+    def to_json(self) -> str:
+        return json.dumps(dict(
+            valid_from = self.valid_from.isoformat(),
+            last_date = self.last_date.isoformat(),
+            window = [None if numpy.isnan(x) else x for x in self.window],
+            prev_close = self.prev_close,
+            emas = [ema.to_list() for ema in (self.up, self.down, self.fast, self.slow, self.signal)],
+        ))
+
+    @classmethod
+    def from_json(cls, text: str) -> "IndicatorState":
+        state = json.loads(text)
+        emas = [SeededEMA.from_list(ema.length, ema.alpha, values) for ema, values in zip(cls.new_emas(), state["emas"])]
+        return cls(
+            dt.date.fromisoformat(state["valid_from"]),
+            dt.date.fromisoformat(state["last_date"]),
+            [numpy.nan if x is None else x for x in state["window"]],
+            state["prev_close"],
+            *emas,
+        )
+
+# 銘柄ごとの指標の値（indicator_values）と計算状態（indicator_states）をDBに持ち、
+# 新しい足の分だけを逐次計算で追加する
+# 初回や、これまでより前の期間を求められた場合は助走期間（WARMUP_SESSIONS本）を含めて一括計算し直す
+class IndicatorEngine:
+    # 求められた期間の前に読む足の本数
+    # SMA75に足りる本数に加え、EMA・RMAの初期値の影響がほぼ消える（1e-7程度以下になる）だけの本数
+    WARMUP_SESSIONS = 250
+
+    # indicator_valuesの列（INDICATOR_COLUMNSと同じ並び）
+    VALUE_COLUMNS = ["sma25", "sma50", "sma75", "rsi14", "macd", "macd_histogram", "macd_signal"]
+
+    UPSERT_VALUES_SQL = f"""
+        INSERT INTO indicator_values (security_id, date, {", ".join(VALUE_COLUMNS)})
+        VALUES (%s, %s, {", ".join(["%s"] * len(VALUE_COLUMNS))})
+        ON DUPLICATE KEY UPDATE
+            {", ".join(f"{col} = VALUES({col})" for col in VALUE_COLUMNS)}
+    """
+
+    UPSERT_STATE_SQL = """
+        INSERT INTO indicator_states (security_id, valid_from, last_date, state)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            valid_from = VALUES(valid_from),
+            last_date = VALUES(last_date),
+            state = VALUES(state)
+    """
+
+    def __init__(self, db: DB, calendar: TradingCalendar):
+        self.db = db
+        self.calendar = calendar
+
+        # security_id -> 計算状態（DBから読んだものを覚えておく）
+        self._states: dict[int, IndicatorState] = {}
+        self._lock = threading.Lock()
+
+    # beginの指標を計算するのに読む最初の取引日
+    def warmup_begin(self, begin: dt.date) -> dt.date:
+        sessions = self.calendar.sessions_between(begin - dt.timedelta(days=self.WARMUP_SESSIONS * 2), begin)
+        return sessions[max(0, len(sessions) - 1 - self.WARMUP_SESSIONS)].item()
+
+    # 計算状態（ない場合はNone）
+    def get_state(self, security_id: int) -> IndicatorState | None:
+        with self._lock:
+            if security_id in self._states:
+                return self._states[security_id]
+
+        row = DB.fetchone("SELECT state FROM indicator_states WHERE security_id = %s", (security_id,))
+        state = IndicatorState.from_json(row[0]) if row is not None else None
+        with self._lock:
+            if state is not None:
+                self._states[security_id] = state
+        return state
+
+    # valid_from以降の指標が求められるように計算状態と値を最新にする
+    # pricesは確定済みの日足（日付順）で、一括計算が必要な場合に備えてvalid_fromの助走期間から含むこと
+    # return：新たに計算した値（indexは日付、列はINDICATOR_COLUMNS）
+    def sync(self, security_id: int, prices: pandas.DataFrame, valid_from: dt.date) -> pandas.DataFrame:
+        if prices.empty:
+            return pandas.DataFrame(columns=INDICATOR_COLUMNS, index=pandas.DatetimeIndex([]))
+
+        state = self.get_state(security_id)
+        index = pandas.DatetimeIndex(prices.index)
+        close = prices["Close"].to_numpy(dtype=numpy.float64)
+
+        with tracer.stage("indicators", rows=len(close)):
+            # 計算状態がない、より前の期間を求められた、または状態の最後の足がpricesより前で続きが分からない場合は一括計算
+            if state is None or valid_from < state.valid_from or state.last_date < index[0].date():
+                result = compute_indicators(close, intermediates=True)
+                state = IndicatorState.from_batch(valid_from, index[-1].date(), result)
+                values = pandas.DataFrame({col: result[col] for col in INDICATOR_COLUMNS}, index=index)
+                values = values.loc[pandas.Timestamp(valid_from):]
+            else:
+                new = index > pandas.Timestamp(state.last_date)
+                rows = [state.update(d.date(), c) for d, c in zip(index[new], close[new].tolist())]
+                values = pandas.DataFrame(rows, columns=INDICATOR_COLUMNS, index=index[new])
+
+        self.save(security_id, state, values)
+        return values
+
+    # 値と計算状態を書き込む
+    def save(self, security_id: int, state: IndicatorState, values: pandas.DataFrame) -> None:
+        columns = []
+        for col in INDICATOR_COLUMNS:
+            array = values[col].to_numpy(dtype=object)
+            array[pandas.isna(array)] = None
+            columns.append(array)
+        rows = list(zip([security_id] * len(values), pandas.DatetimeIndex(values.index).date, *columns))
+        self.save_many(rows, {security_id: state})
+
+    # 複数銘柄の値（(security_id, date, *INDICATOR_COLUMNSの値)のタプル）と計算状態をまとめて書き込む
+    # 値はchunk_size件ずつのトランザクションで書き、最後に計算状態を書く
+    # 途中で失敗しても計算状態が古いままなので、次回にその続きから計算し直されて値が上書きされる
+    def save_many(self, rows: list[tuple], states: dict[int, IndicatorState], chunk_size: int = DB.INSERT_CHUNK_SIZE) -> None:
+        state_rows = [(security_id, state.valid_from, state.last_date, state.to_json()) for security_id, state in states.items()]
+
+        with DB.connection() as conn:
+            cur = conn.cursor()
+            try:
+                for i in range(0, len(rows), chunk_size):
+                    cur.execute("START TRANSACTION")
+                    cur.executemany(self.UPSERT_VALUES_SQL, rows[i:i + chunk_size])
+                    conn.commit()
+                for i in range(0, len(state_rows), chunk_size):
+                    cur.execute("START TRANSACTION")
+                    cur.executemany(self.UPSERT_STATE_SQL, state_rows[i:i + chunk_size])
+                    conn.commit()
+            finally:
+                cur.close()
+
+        with self._lock:
+            self._states.update(states)
+
+    # begin～end（両端を含む）の保存済みの値
+    def select_values(self, security_id: int, begin: dt.date, end: dt.date) -> pandas.DataFrame:
+        values = DB.fetch_array(f"""
+            SELECT TO_DAYS(date) - 719528, {", ".join(self.VALUE_COLUMNS)}
+            FROM indicator_values
+            WHERE security_id = %s AND date BETWEEN %s AND %s
+            ORDER BY date ASC
+        """, (security_id, begin, end), 1 + len(self.VALUE_COLUMNS))
+
+        index = pandas.DatetimeIndex(values[:, 0].astype(numpy.int64).astype("datetime64[D]").astype("datetime64[ns]"))
+        return pandas.DataFrame(values[:, 1:], columns=INDICATOR_COLUMNS, index=index)
+
+    # begin～end（両端を含む）の保存済みの値と終値・出来高を、日付×銘柄の行列で返す
+    # security_idsがNoneの場合は全銘柄
+    # return：(日付の配列, security_idの配列, 列名（Close、Volume、INDICATOR_COLUMNS）->行列)
+    def select_panel(self, begin: dt.date, end: dt.date, security_ids: list[int] | None = None) -> tuple[numpy.ndarray, numpy.ndarray, dict[str, numpy.ndarray]]:
+        condition = ""
+        params: tuple = (begin, end)
+        if security_ids is not None:
+            condition = f" AND v.security_id IN ({', '.join(['%s'] * len(security_ids))})" if security_ids else " AND FALSE"
+            params += tuple(security_ids)
+
+        values = DB.fetch_array(f"""
+            SELECT v.security_id, TO_DAYS(v.date) - 719528, p.close + 0E0, p.volume, {", ".join(f"v.{col}" for col in self.VALUE_COLUMNS)}
+            FROM indicator_values v
+            JOIN prices p ON p.security_id = v.security_id AND p.date = v.date AND p.time = '00:00:00'
+            WHERE v.date BETWEEN %s AND %s{condition}
+        """, params, 4 + len(self.VALUE_COLUMNS))
+
+        days, ids, matrices = to_panel(values)
+        return days, ids, dict(zip(["Close", "Volume"] + INDICATOR_COLUMNS, matrices))
+
+    # 状態を変えずに、最後の足の翌日の終値がcloseだった場合の指標（場中の未確定の足用）
+    def preview(self, security_id: int, date: dt.date, close: float) -> dict[str, float] | None:
+        state = self.get_state(security_id)
+        if state is None:
+            return None
+        return state.preview(date, close)
+
+    # DB.add_insert_listenerに登録する
+    # 計算済みの足（last_date以前）が書き換えられた場合は計算状態を捨て、次回に一括計算し直す
+    def on_prices_inserted(self, security_id: int, chart_granularity: str, prices: pandas.DataFrame) -> None:
+        if chart_granularity != "daily" or prices is None or prices.empty:
+            return
+
+        first = pandas.DatetimeIndex(prices.index).min().date()
+        with self._lock:
+            state = self._states.get(security_id)
+            if state is not None and first <= state.last_date:
+                del self._states[security_id]
+
+        with DB.connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("DELETE FROM indicator_states WHERE security_id = %s AND last_date >= %s", (security_id, first))
+            finally:
+                cur.close()
@@ -50,18 +50,51 @@ CREATE TABLE security_sectors (
 );
 
 -- 株価テーブル (大量データ対応)
+-- 主キー (security_id, date, time) をそのままクラスタインデックスにし、銘柄ごとの期間の読み出しを主キーの範囲スキャン1回で済ませる
+-- 日足のtimeはNULLではなく 00:00:00 にする (NULLを含む一意キーでは重複を防げないため)
+-- 分足は intraday_prices に格納する
 CREATE TABLE prices (
-    id BIGINT AUTO_INCREMENT PRIMARY KEY,
     security_id INT NOT NULL,
     date DATE NOT NULL,
-    time TIME NULL,                   -- 日足以上なら NULL
+    time TIME NOT NULL DEFAULT '00:00:00', -- 日足は 00:00:00
     open DECIMAL(15,4),
     high DECIMAL(15,4),
     low DECIMAL(15,4),
     close DECIMAL(15,4),
     volume BIGINT,
-    FOREIGN KEY (security_id) REFERENCES securities(id),
-    UNIQUE KEY uq_prices (security_id, date, time)
+    PRIMARY KEY (security_id, date, time),
+    CONSTRAINT fk_prices_security FOREIGN KEY (security_id) REFERENCES securities(id)
+);
+
+-- 株価の取得を試みたがデータが返ってこなかった期間 (上場前・上場廃止・売買停止など)
+-- 同じ期間を毎回取りに行かないように記録しておく
+CREATE TABLE price_empty_spans (
+    security_id INT NOT NULL,
+    first_date DATE NOT NULL,
+    last_date DATE NOT NULL,
+    checked_at DATE,   -- 最後に確認した日 (FetchPlanner.EMPTY_SPAN_RECHECK_DAYS を過ぎたら取り直す、NULLは未確認扱い)
+    PRIMARY KEY (security_id, first_date),
+    FOREIGN KEY (security_id) REFERENCES securities(id)
+);
+
+-- 分足テーブル (場中に取得した1分足・5分足など)
+-- 日足のpricesとは分け、月ごとのパーティションで古い月を丸ごと捨てられるようにする
+-- 古い分足は日足にまとめてpricesに移してから捨てる (DB.compact_intraday_prices)
+-- パーティションを切ったテーブルには外部キーを付けられないのでsecuritiesへの参照は持たない
+-- 月ごとのパーティションはDB.ensure_intraday_partitionsでpmaxを分割して追加する
+CREATE TABLE intraday_prices (
+    security_id INT NOT NULL,
+    bar_minutes TINYINT UNSIGNED NOT NULL, -- 足の長さ (分)
+    ts DATETIME NOT NULL,                  -- 足の開始時刻 (市場の現地時刻)
+    open DECIMAL(15,4),
+    high DECIMAL(15,4),
+    low DECIMAL(15,4),
+    close DECIMAL(15,4),
+    volume BIGINT,
+    PRIMARY KEY (security_id, bar_minutes, ts)
+)
+PARTITION BY RANGE (TO_DAYS(ts)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
 );
 
 -- 指数テーブル
@@ -82,6 +115,53 @@ CREATE TABLE index_components (
     UNIQUE KEY uq_index_components (index_id, security_id)
 );
 
+-- テクニカル指標の値 (確定した日足ごと、列は indicators.INDICATOR_COLUMNS と同じ並び)
+-- 新しい足の分だけを IndicatorEngine が逐次計算して追加する
+CREATE TABLE indicator_values (
+    security_id INT NOT NULL,
+    date DATE NOT NULL,
+    sma25 DOUBLE,
+    sma50 DOUBLE,
+    sma75 DOUBLE,
+    rsi14 DOUBLE,
+    macd DOUBLE,
+    macd_histogram DOUBLE,
+    macd_signal DOUBLE,
+    PRIMARY KEY (security_id, date),
+    FOREIGN KEY (security_id) REFERENCES securities(id)
+);
+
+-- テクニカル指標の逐次計算の状態 (銘柄ごとに1行、indicators.IndicatorState をJSONにしたもの)
+-- valid_from 以降の値は助走期間を経ており、last_date までの足を反映済み
+CREATE TABLE indicator_states (
+    security_id INT NOT NULL PRIMARY KEY,
+    valid_from DATE NOT NULL,
+    last_date DATE NOT NULL,
+    state JSON NOT NULL,
+    FOREIGN KEY (security_id) REFERENCES securities(id)
+);
+
+-- 業種・指数ごとの日次の集計値 (group_aggregates.GroupAggregator が保存済みの最後の日の続きから追加する)
+-- group_id は kind が sector の場合は sectors.id、index の場合は indices.id
+-- 水準 (level) は計算を始めた日を100としてリターンを積み上げた値、加重平均は index_components.weight による (指数のみ)
+-- above_smaNN は指標が計算済みの構成銘柄のうち、終値がSMAを上回る銘柄の割合
+CREATE TABLE group_aggregates (
+    kind ENUM('sector', 'index') NOT NULL,
+    group_id INT NOT NULL,
+    date DATE NOT NULL,
+    equal_return DOUBLE,
+    equal_level DOUBLE,
+    weighted_return DOUBLE,
+    weighted_level DOUBLE,
+    members INT NOT NULL,   -- リターンを計算できた構成銘柄の数
+    advancers INT NOT NULL,
+    decliners INT NOT NULL,
+    above_sma25 DOUBLE,
+    above_sma50 DOUBLE,
+    above_sma75 DOUBLE,
+    PRIMARY KEY (kind, group_id, date)
+);
+
 -- =========================================
 -- 初期データ挿入
 -- =========================================
@@ -0,0 +1,167 @@
+import argparse
+import datetime as dt
+import threading
+import time
+from database import DB
+from trading_calendar import TradingCalendar
+from price_provider import PriceProvider, YFinanceProvider
+from my_logging import Logging
+
+# 監視銘柄の分足を場中に取得してintraday_pricesに格納するジョブ
+# yfinanceは過去の分足を後から取り直せない（1分足は直近数日分のみ）ので、場中に定期的に取っておく
+# 引け後は最後の足を取り直し、1日1回パーティションの追加と古い分足の日足へのまとめ・削除を行う
+# 実行例：python intraday_capture.py 7203.T 9432.T --interval 1m
+class IntradayCapture:
+    # 分足を残す日数（これより古い分足は日足にまとめてから月単位で捨てる）
+    RETENTION_DAYS = 30
+    # 何か月先までパーティションを作っておくか
+    PARTITION_MONTHS_AHEAD = 2
+
+    # interval：yfinanceの足の長さ（"1m"、"5m"など）
+    # poll_seconds：場中に取得し直す間隔（秒）
+    def __init__(self, watchlist: list[str], interval: str = "1m", poll_seconds: float = 60.0, retention_days: int = RETENTION_DAYS,
+                 db: DB | None = None, provider: PriceProvider | None = None, calendar: TradingCalendar | None = None, log: Logging | None = None):
+        self.db = db if db is not None else DB()
+        self.provider = provider if provider is not None else YFinanceProvider()
+        self.calendar = calendar if calendar is not None else TradingCalendar()
+        self.log = log if log is not None else Logging()
+        self.interval = interval
+        self.poll_seconds = poll_seconds
+        self.retention_days = retention_days
+
+        bar_minutes = int(interval[:-1]) if interval.endswith("m") else 1
+        granularities = {minutes: name for name, minutes in DB.INTRADAY_GRANULARITIES.items()}
+        if bar_minutes not in granularities:
+            raise ValueError(f"未対応の足の長さです：{interval}")
+        self.bar_minutes = bar_minutes
+        self.chart_granularity = granularities[bar_minutes]
+
+        # 重複を除き、登録されていない銘柄は除く
+        self.watchlist = [ticker for ticker in dict.fromkeys(watchlist) if self.db.is_ticker_exists(ticker)]
+
+        # 引け後の最後の取得を済ませた日（市場の現地日付） ticker -> date
+        self._finalized: dict[str, dt.date] = {}
+        # 保守処理を済ませた日
+        self._maintained: dt.date | None = None
+
+        self.captures = 0
+        self.rows = 0
+        self.errors = 0
+
+    # 今取得すべき銘柄
+    # 当日が取引日で取引時間中（前場open1～close1、後場open2～close2）のもの、
+    # および引け後でまだ最後の足を取り直していないもの
+    def due_tickers(self) -> list[str]:
+        due = []
+        for ticker in self.watchlist:
+            market = self.db.get_market_hours(ticker)
+            today = market.today()
+            if not self.calendar.is_session(today):
+                continue
+
+            if market.is_active():
+                due.append(ticker)
+            elif market.is_closed() and self._finalized.get(ticker) != today:
+                due.append(ticker)
+
+        return due
+
+    # 当日の分足をまとめて取得して格納する
+    # 取得中の最後の足は未確定だが、次の取得で同じ時刻の行が上書きされる
+    # return：格納件数
+    def capture(self, tickers: list[str]) -> int:
+        if not tickers:
+            return 0
+
+        histories = self.provider.recent(tickers, period="1d", interval=self.interval)
+        count = 0
+        for ticker in tickers:
+            history = histories.get(ticker)
+            if history is not None and not history.empty:
+                count += self.db.insert_into_prices(ticker, history, self.chart_granularity)
+
+            market = self.db.get_market_hours(ticker)
+            if market.is_closed():
+                self._finalized[ticker] = market.today()
+
+        self.captures += 1
+        self.rows += count
+        return count
+
+    # パーティションの追加、保持期間を過ぎた分足の日足へのまとめと削除
+    def maintain(self, today: dt.date | None = None) -> dict:
+        if today is None:
+            today = dt.date.today()
+
+        until = today
+        for _ in range(self.PARTITION_MONTHS_AHEAD):
+            until = (until.replace(day=1) + dt.timedelta(days=32)).replace(day=1)
+        added = self.db.ensure_intraday_partitions(until)
+
+        # 捨てる前に日足にまとめておく（捨てるのは月単位なので、まとめるのは保持期間を過ぎた日すべて）
+        cutoff = today - dt.timedelta(days=self.retention_days)
+        compacted = self.db.compact_intraday_prices(self.bar_minutes, cutoff)
+        dropped = self.db.drop_intraday_partitions(cutoff)
+
+        self._maintained = today
+        return dict(added=added, compacted=compacted, dropped=dropped)
+
+    # 1回分の処理（取得すべき銘柄の取得と、全市場の引け後の保守処理）
+    def run_once(self) -> int:
+        count = self.capture(self.due_tickers())
+
+        today = dt.date.today()
+        if self._maintained != today and all(self.db.get_market_hours(ticker).is_closed() for ticker in self.watchlist):
+            self.maintain(today)
+
+        return count
+
+    # stopがセットされるまでpoll_secondsごとにrun_onceを繰り返す
+    # 取得に失敗しても止めずに次の回で取り直す
+    def run(self, stop: threading.Event | None = None) -> None:
+        if stop is None:
+            stop = threading.Event()
+
+        while not stop.is_set():
+            begin = time.monotonic()
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                self.log.emit("ERROR", "IntradayCapture.run", message=repr(e))
+
+            stop.wait(max(0.0, self.poll_seconds - (time.monotonic() - begin)))
+
+    def metrics(self) -> dict:
+        return dict(
+            watchlist = len(self.watchlist),
+            captures = self.captures,
+            rows = self.rows,
+            errors = self.errors,
+            provider = self.provider.metrics(),
+        )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tickers", nargs="+")
+    parser.add_argument("--interval", default="1m")
+    parser.add_argument("--poll-seconds", type=float, default=60.0)
+    parser.add_argument("--retention-days", type=int, default=IntradayCapture.RETENTION_DAYS)
+    parser.add_argument("--log-file", default="intraday-capture-log.txt", help="空の場合はログを書かない")
+    parser.add_argument("--column-store", help="日足の列指向ストアのディレクトリ（読み出し側と同じものを指定すると、まとめた日足をファイルにも取り込む）")
+    args = parser.parse_args()
+
+    log = Logging(args.log_file)
+    job = IntradayCapture(args.tickers, interval=args.interval, poll_seconds=args.poll_seconds, retention_days=args.retention_days, log=log)
+    if args.column_store:
+        from columnar_store import ColumnarStore
+        DB.add_insert_listener(ColumnarStore(args.column_store, job.calendar).on_prices_inserted)
+    try:
+        job.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.flush()
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,26 @@
 from enum import IntEnum, auto
-from datetime import datetime, date, time, timedelta
+from datetime import datetime, date, timedelta
 from zoneinfo import ZoneInfo
+from pathlib import Path
 import json
 from pydantic import BaseModel, Field, ValidationError
-import yfinance as yf
+import numpy
 import pandas
 import pandas_ta_classic as ta
-import jpholiday
-from database import DB
+from database import DB, PriceCoverage
+from trading_calendar import TradingCalendar
+from fetch_planner import FetchPlanner
+from price_provider import PriceProvider, YFinanceProvider
+from price_cache import PriceCache
+from quote_service import QuoteService
+from eod_scheduler import EodScheduler, HotList
+from columnar_store import ColumnarStore
+from price_resampler import resample_ohlcv
+from indicators import IndicatorEngine, INDICATOR_COLUMNS
+from group_aggregates import GroupAggregator
+from screener import SCREEN_FIELDS, validate_condition, required_sessions, derive_fields, latest_row, evaluate
 from my_logging import Logging
-
-# yfinanceのticker.historyに設定できるYYYY-MM-DDの形に変換
-# 分足データは後から取得できないため、dateのみ考慮
-def date_to_yf_history(d: date) -> str:
-	return d.strftime("%Y-%m-%d")
+from tracing import tracer
 
 # dateをdatetimeに変換する
 # datetimeを渡した場合はそのまま返す
@@ -30,7 +37,8 @@ def convert_to_datetime(d) -> datetime:
     raise ValueError("引数にはdateもしくはdatetime型の変数を渡してください。")
 
 class GetCurrentPriceInput(BaseModel):
-    ticker: str
+    ticker: str | None = None
+    tickers: list[str] = []
 
 class GetPriceInput(BaseModel):
 	ticker: str 
@@ -38,14 +46,99 @@ class GetPriceInput(BaseModel):
 	end_range: datetime
 	chart_granularity: str
 
+class GetPricesInput(BaseModel):
+	tickers: list[str]
+	begin_range: datetime
+	end_range: datetime
+	chart_granularity: str
+
+class ScreenCondition(BaseModel):
+	field: str
+	op: str
+	value: float | str
+	within: int = 1
+
+class ScreenInput(BaseModel):
+	conditions: list[ScreenCondition]
+	sectors: list[str] = []
+	index_code: str | None = None
+	sort_by: str | None = None
+	ascending: bool = False
+	limit: int = 20
+
+class GetGroupAggregateInput(BaseModel):
+	kind: str
+	name: str
+	classification: str = "TSE33"
+	begin_range: datetime
+	end_range: datetime
+	weighting: str = "equal"
+
 class Backend:
 	db = DB()
+	calendar = TradingCalendar()
+	planner = FetchPlanner(calendar)
+	# 株価の取得元 ネットワークなしで動かす場合はLocalPriceProviderに差し替える
+	provider: PriceProvider = YFinanceProvider()
+	# get_priceの結果キャッシュ DBに新しい足が書き込まれた銘柄は破棄される
+	price_cache = PriceCache(calendar)
+	DB.add_insert_listener(price_cache.on_prices_inserted)
+	# 確定済みの日足のローカルの列指向ストア（set_column_storeで有効にする　Noneの場合は使わない）
+	column_store: ColumnarStore | None = None
+	# テクニカル指標の保存済みの値と逐次計算の状態 計算済みの足が書き換えられた銘柄は一括計算し直す
+	indicators = IndicatorEngine(db, calendar)
+	DB.add_insert_listener(indicators.on_prices_inserted)
+	# 業種・指数ごとの集計値 保存済みの期間内の足が書き換えられたグループはその日から計算し直す
+	aggregator = GroupAggregator(db, calendar)
+	DB.add_insert_listener(aggregator.on_prices_inserted)
+	# 現在値の短時間のキャッシュ（複数銘柄を1回で取得する　取得元はその時点のproviderを使う）
+	quotes = QuoteService(calendar, lambda tickers: Backend.provider.recent(tickers, period="1d"))
+	# 最近求められた銘柄（引け後のスケジューラが先回りして取得する対象）
+	hot_list = HotList()
+	# 引け後に日足を取得・格納してキャッシュを温めるスケジューラ（set_eod_schedulerで有効にする　Noneの場合は動かさない）
+	eod_scheduler: EodScheduler | None = None
 
 	def __init__(self):
 		pass
 
+	# 列指向ストアを有効にする（directoryが空の場合は無効にする）
+	# 同じディレクトリが指定されている場合は何もしない
+	@classmethod
+	def set_column_store(cls, directory: str | None) -> None:
+		if not directory:
+			cls.column_store = None
+			return
+
+		if cls.column_store is not None and str(cls.column_store.directory) == str(Path(directory)):
+			return
+
+		cls.column_store = ColumnarStore(directory, cls.calendar)
+
+	# 引け後のスケジューラを動かす（modeはEodScheduler.MODESのいずれか　空の場合は止める）
+	# 同じmodeで動いている場合は何もしない
+	@classmethod
+	def set_eod_scheduler(cls, mode: str | None, log: Logging | None = None) -> None:
+		if cls.eod_scheduler is not None and cls.eod_scheduler.mode == mode:
+			return
+
+		if cls.eod_scheduler is not None:
+			cls.eod_scheduler.stop()
+			cls.eod_scheduler = None
+
+		if mode:
+			cls.eod_scheduler = EodScheduler(cls(), mode, log=log)
+			cls.eod_scheduler.start()
+
+	# DB.add_insert_listenerに登録する（その時点で有効な列指向ストアに渡す）
+	@staticmethod
+	def on_prices_inserted(security_id: int, chart_granularity: str, prices: pandas.DataFrame) -> None:
+		if Backend.column_store is not None:
+			Backend.column_store.on_prices_inserted(security_id, chart_granularity, prices)
+
 	# リアルタイムの情報を返すときに使う想定　DBに格納しない
 	# ex)今～の株価何円？ -> この関数を経由して返す
+	# 複数銘柄はtickersで指定し、1回の取得でまとめて取る　取得した値は市場の状態に応じた時間だけキャッシュする（QuoteService）
+	# tickerだけを指定した場合はその銘柄の値、それ以外は銘柄コードをキーにした辞書を返す
 	def get_current_price(self, input: GetCurrentPriceInput, log: Logging = None) -> str:
 		if log == None:
 			log = Logging()
@@ -57,38 +150,29 @@ class Backend:
 			log.append_to_log_file_from_dict(input, f"ValidationError: {e}")
 			raise ValueError("入力値の形式が不正です") from e
 
-		if not input.ticker:
+		tickers = list(dict.fromkeys(input.tickers + ([input.ticker] if input.ticker else [])))
+		if not tickers:
 			err = "銘柄コードが指定されていません"
 			log.append_to_log_file_from_bm(input, err)
 			raise ValueError(err)
 		
-		if not self.db.is_ticker_exists(input.ticker):
-			err = "無効な銘柄コードが指定されました"
+		invalid = [ticker for ticker in tickers if not self.db.is_ticker_exists(ticker)]
+		if invalid:
+			err = f"無効な銘柄コードが指定されました（{', '.join(invalid)}）"
 			log.append_to_log_file_from_bm(input, err)
 			raise ValueError(err)
 
-		stock = yf.Ticker(input.ticker)
-		info = stock.info
-		price = stock.history(period="1d")
+		log.append_to_log_file_from_bm(input)
+		quotes = self.quotes.get_many(tickers, {ticker: self.db.get_market_hours(ticker) for ticker in tickers})
 
 		# ちゃんと取得できたかを確認
-		if len(price) <= 0:
+		failed = [ticker for ticker, quote in quotes.items() if quote is None]
+		if len(failed) == len(tickers):
 			err = "データの取得に失敗しました"
 			log.append_to_log_file_from_bm(input, err)
 			raise ValueError(err)
 
-		current = info.get("currentPrice")
-
-		result = dict(
-			current = float(current) if current is not None else None,
-			open = float(price["Open"].iloc[-1]),
-			high = float(price["High"].iloc[-1]),
-			low = float(price["Low"].iloc[-1]),
-			close = float(price["Close"].iloc[-1]),
-			volume = float(price["Volume"].iloc[-1])
-		)
-
-		log.append_to_log_file_from_bm(input)
+		result = quotes[input.ticker] if not input.tickers else quotes
 		log.append_to_log_file_from_dict(result)
 
 		return json.dumps(result, ensure_ascii=False)
@@ -99,23 +183,119 @@ class Backend:
 		if log == None:
 			log = Logging()
 
-		try:
-			if isinstance(input, dict):
-				input = GetPriceInput(**input)
-		except ValidationError as e:
-			log.append_to_log_file_from_dict(input, f"ValidationError: {e}")
-			raise ValueError("入力値の形式が不正です") from e
+		with tracer.stage("validation"):
+			try:
+				if isinstance(input, dict):
+					input = GetPriceInput(**input)
+			except ValidationError as e:
+				log.append_to_log_file_from_dict(input, f"ValidationError: {e}")
+				raise ValueError("入力値の形式が不正です") from e
 
-		if not input.ticker:
-			err = "銘柄コードが指定されていません。"
-			log.append_to_log_file_from_bm(input, err)
-			raise ValueError(err)
+			if not input.ticker:
+				err = "銘柄コードが指定されていません。"
+				log.append_to_log_file_from_bm(input, err)
+				raise ValueError(err)
 		
-		if not self.db.is_ticker_exists(input.ticker):
-			err = "無効な銘柄コードが指定されました。"
-			log.append_to_log_file_from_bm(input, err)
-			raise ValueError(err)
+			# 銘柄の存在確認はマスタキャッシュを参照するのでDBには問い合わせない
+			if not self.db.is_ticker_exists(input.ticker):
+				err = "無効な銘柄コードが指定されました。"
+				log.append_to_log_file_from_bm(input, err)
+				raise ValueError(err)
+		
+			self.normalize_range(input, log)
+		
+			# 日足・週足・月足に対応　それ以外が入力された場合は日足を指定したものとして扱う
+			chart_granularity = self.normalize_granularity(input.chart_granularity)
+		
+		# 入力に問題はなさそうなので一旦ログに書き込む
+		log.append_to_log_file_from_bm(input)
+		self.hot_list.touch([input.ticker])
+
+		# 取引時間の判定はマスタキャッシュの市場の情報で行うのでDBには問い合わせない
+		market = self.db.get_market_hours(input.ticker)
+		last_final = self.planner.last_finalized_session(market)
+
+		# 確定済みの期間は結果キャッシュに収まっていればDBに問い合わせずに切り出す
+		begin = input.begin_range.date()
+		final_end = min(input.end_range.date(), last_final)
+		security_id = self.db.get_security_id(input.ticker)
+		df: pandas.DataFrame = None
+		coverage: PriceCoverage = None
+		if chart_granularity in self.db.INTRADAY_GRANULARITIES:
+			# 分足は後から取得し直せないので、取得ジョブ（intraday_capture）が格納した分だけを返す
+			df = self.db.select_from_prices(input.ticker, input.begin_range, input.end_range, chart_granularity)
+		elif begin <= final_end:
+			# 週足・月足は日足のキャッシュから集計する
+			df = self.price_cache.get(security_id, "daily", begin, final_end)
+			# キャッシュになければローカルの列指向ストアを見る（DBには問い合わせない）
+			# ファイルの鮮度は挿入リスナーが更新するウォーターマークで判断する（リスナーを登録していないプロセスの書き込みは検知できない）
+			if df is None and self.column_store is not None:
+				version = self.price_cache.version(security_id)
+				df = self.column_store.read(security_id, begin, final_end)
+				if df is not None:
+					self.price_cache.put(security_id, "daily", begin, final_end, df, version)
+			if df is not None:
+				df = resample_ohlcv(df, chart_granularity)
+
+		if df is None:
+			# DBに格納されているデータの範囲と件数を1回のクエリで取得し、
+			# 取引日カレンダーと比べて歯抜けも含めて欠けている取引日だけをまとめて取得する
+			with tracer.stage("coverage"):
+				if coverage is None:
+					coverage = self.db.get_price_coverage(input.ticker, begin, final_end)
+				missing = self.plan_price_gaps(coverage, begin, input.end_range.date(), last_final)
+			# 取得しても欠けたままの取引日が残る場合は、キャッシュ・列指向ストアに入れない（次の呼び出しで取り直す）
+			filled = True
+			if len(missing) > 0:
+				# 近いウィンドウはまとめ、離れたウィンドウは別々に取る（間の格納済みの期間を取り直さない）
+				history = pandas.concat([self.provider.history(input.ticker, first, last) for first, last in self.planner.fetch_windows(missing)])
+				# DBには常に日足として格納する
+				self.store_fetched_prices(input.ticker, coverage.security_id, history, missing, last_final, "daily", coverage.end_date)
+				filled = self.is_filled(coverage.security_id, missing, history, begin, final_end)
+
+			if chart_granularity != "daily":
+				# 週足・月足はDB側でまとめてから読み出す（日足の行は転送しない）
+				df = self.db.select_from_prices(input.ticker, input.begin_range, input.end_range, chart_granularity)
+			elif begin <= final_end:
+				# キャッシュ済みの期間と重なるか隣り合う場合は両方を包む期間で読み出し、1本の配列にしてキャッシュし直す
+				# 読み出している間に他の呼び出しが書き込んだ場合は古いdfになるので、読み出す前の版でputする
+				select_begin, select_end = self.price_cache.union_range(security_id, chart_granularity, begin, final_end)
+				version = self.price_cache.version(security_id)
+				df = self.db.select_from_prices(input.ticker, select_begin, select_end, chart_granularity)
+				if filled and self.price_cache.put(security_id, chart_granularity, select_begin, select_end, df, version):
+					if self.column_store is not None:
+						self.column_store.put(security_id, select_begin, select_end, df)
+				df = df.loc[pandas.Timestamp(begin):pandas.Timestamp(final_end)]
+			else:
+				df = self.db.select_from_prices(input.ticker, input.begin_range, input.end_range, chart_granularity)
+
+		# 場中の場合は当日の足をDBに入れず、戻り値となるdfにだけデータを入れる
+		current: pandas.DataFrame = None
+		if chart_granularity not in self.db.INTRADAY_GRANULARITIES and input.end_range.date() > last_final and self.planner.has_intraday_bar(market):
+			current = self.provider.recent([input.ticker], period="1d")[input.ticker]
 		
+		if current is not None and not current.empty:
+			# DBの日足と同じ形（日付のみ）に揃える
+			current.index = pandas.DatetimeIndex(current.index.date)
+			df = pandas.concat([df, current])
+			# 週足・月足の場合は当日の足を最後の足にまとめ直す
+			df = resample_ohlcv(df, chart_granularity)
+
+		# データが取れていることを確認する（が、通常は問題ないはず）
+		if df is None:
+			raise LookupError("データフレームが空です。")
+		
+		# 日付をindexからレコード内に含めるように変更
+		df = df.reset_index()
+		# 日付のレコードが自動的にindexとなるのでDateに直しておく
+		df = df.rename(columns={"index": "Date",})
+
+		log.append_to_log_file_from_df(df)
+		return df
+	
+	# 解析期間の入力チェックを行い、input.begin_range、input.end_rangeを取引日に揃える
+	# 問題がある場合はValueError
+	def normalize_range(self, input: GetPriceInput | GetPricesInput, log: Logging) -> None:
 		if input.begin_range is None:
 			err = "解析期間の開始日が指定されていません。"
 			log.append_to_log_file_from_bm(input, err)
@@ -141,100 +321,391 @@ class Backend:
 			log.append_to_log_file_from_bm(input, err)
 			raise ValueError(err)
 		
-		# 指定した日が土日祝の場合はデータが取れないので範囲を狭める方向にずらす
-		# input.begin_rangeの場合は日を進める
-		while input.begin_range.weekday() >= 5 or jpholiday.is_holiday(input.begin_range):
-			input.begin_range = input.begin_range + timedelta(days=1)
-		# input.end_rangeの場合は日を戻す
-		while input.end_range.weekday() >= 5 or jpholiday.is_holiday(input.end_range):
-			input.end_range = input.end_range - timedelta(days=1)
-		
-		# 当面は日足のみ対応なのでchart_granularityに何が入力されていても日足を指定したものとして扱う
-		chart_granularity = "daily"
-		
+		# 指定した日が休場日の場合はデータが取れないので範囲を狭める方向に取引日へずらす
+		# input.begin_rangeの場合は次の取引日、input.end_rangeの場合は前の取引日
+		input.begin_range = convert_to_datetime(self.calendar.next_session(input.begin_range))
+		input.end_range = convert_to_datetime(self.calendar.previous_session(input.end_range))
+
+	# 複数銘柄の株価情報をまとめて取得する　DBになければyfから取得する
+	# 欠けている期間は全銘柄まとめてprovider.history_many（yfinanceではyf.download）で取得し、DBからは1回のクエリでまとめて読み出す
+	# by_ticker=Falseの場合はTicker列を持つ縦持ちのDataFrame、Trueの場合は銘柄コードをキーにしたDataFrameの辞書を返す
+	def get_prices(self, input: GetPricesInput, log: Logging = None, by_ticker: bool = False) -> pandas.DataFrame | dict[str, pandas.DataFrame]:
+		if log == None:
+			log = Logging()
+
+		with tracer.stage("validation"):
+			try:
+				if isinstance(input, dict):
+					input = GetPricesInput(**input)
+			except ValidationError as e:
+				log.append_to_log_file_from_dict(input, f"ValidationError: {e}")
+				raise ValueError("入力値の形式が不正です") from e
+
+			if not input.tickers:
+				err = "銘柄コードが指定されていません。"
+				log.append_to_log_file_from_bm(input, err)
+				raise ValueError(err)
+
+			# 重複を除き、指定された順序を保つ
+			tickers = list(dict.fromkeys(input.tickers))
+
+			# 銘柄の存在確認はマスタキャッシュを参照するのでDBには問い合わせない
+			invalid = [ticker for ticker in tickers if not self.db.is_ticker_exists(ticker)]
+			if invalid:
+				err = f"無効な銘柄コードが指定されました。（{', '.join(invalid)}）"
+				log.append_to_log_file_from_bm(input, err)
+				raise ValueError(err)
+
+			self.normalize_range(input, log)
+
+			# 日足・週足・月足に対応　それ以外が入力された場合は日足を指定したものとして扱う
+			chart_granularity = self.normalize_granularity(input.chart_granularity)
+
 		# 入力に問題はなさそうなので一旦ログに書き込む
 		log.append_to_log_file_from_bm(input)
+		self.hot_list.touch(tickers)
 
-		# DBに格納されているデータの範囲を取得する これらは(date, time)のタプルなので注意
-		# 当面は日足のみ対応なのでdateのみを抜き出す（Noneのときはそもそも抜き出せないから何もしない）
-		first_record: date = self.db.get_first_record_datetime(input.ticker)
-		if first_record is not None:
-			first_record = first_record[0]
-		end_record: date = self.db.get_end_record_datetime(input.ticker)
-		if end_record is not None:
-			end_record = end_record[0]
-
-		# 該当銘柄のデータが存在しない場合はinput.begin_rangeから今日までのデータを取ってくる
-		# ただし、input.begin_rangeから今日までの期間が半年未満の場合は半年分のデータを取る
-		if first_record == None and end_record == None:
-			history: pandas.DataFrame = None
-			# 概ね半年なので180日としておく
-			if now - input.begin_range >= timedelta(days=180):
-				# 半年以上の場合はinput.begin_rangeから今日までのデータを取得
-				history = yf.Ticker(input.ticker).history(start=date_to_yf_history(input.begin_range), end=date_to_yf_history(now.date()))
-			else:
-				# 半年未満の場合は今日から半年前までのデータを取得
-				history = yf.Ticker(input.ticker).history(period="6mo")
-			
-			self.db.insert_into_prices(input.ticker, history, chart_granularity)
-		
-		# DBに存在するデータよりも前のデータが必要な場合
-		# input.begin_rangeからfirst_recordの前日までのデータを取ってくる
-		if first_record is not None and first_record > input.begin_range.date():
-			history = yf.Ticker(input.ticker).history(start=date_to_yf_history(input.begin_range), end=date_to_yf_history((first_record - timedelta(days=1))))
-			self.db.insert_into_prices(input.ticker, history, chart_granularity)
+		begin = input.begin_range.date()
+		end = input.end_range.date()
+		markets = {ticker: self.db.get_market_hours(ticker) for ticker in tickers}
+		last_final = {ticker: self.planner.last_finalized_session(market) for ticker, market in markets.items()}
 
-		current: pandas.DataFrame = None
+		# 全銘柄の格納済みの範囲と件数を1回のクエリで取得し、銘柄ごとに欠けている取引日を求める
+		with tracer.stage("coverage"):
+			coverages = self.db.get_price_coverages(tickers, begin, min(end, min(last_final.values())))
+			missing = {ticker: self.plan_price_gaps(coverages[ticker], begin, end, last_final[ticker]) for ticker in tickers}
+			missing = {ticker: sessions for ticker, sessions in missing.items() if len(sessions) > 0}
+		# 分足は後から取得し直せないので、取得ジョブ（intraday_capture）が格納した分だけを返す
+		if chart_granularity in self.db.INTRADAY_GRANULARITIES:
+			missing = {}
 
-		# DBに存在するデータよりも後のデータが必要な場合
-		# end_recordの翌日から今日までのデータを取ってくる
-		if end_record is not None and end_record < input.end_range.date():
-			# 前日分までを取得してくる
-			history = yf.Ticker(input.ticker).history(start=date_to_yf_history((end_record + timedelta(days=1))), end=date_to_yf_history(now.date() - timedelta(days=1)))
-			self.db.insert_into_prices(input.ticker, history, chart_granularity)
-
-			# 場中の場合はDBにデータを入れず、戻り値となるdfにだけデータを入れる
-			if self.db.is_market_active(input.ticker):
-				current = history, yf.Ticker(input.ticker).history(period="1d")
-			# 場中でないかつ閉場時間を過ぎている場合は確定データが出ているからDBに入れる
-			elif(self.db.is_market_closed(input.ticker)):
-				history = yf.Ticker(input.ticker).history(period="1d")
-				self.db.insert_into_prices(input.ticker, history, chart_granularity)
-			# 取引開始前が当てはまるが取得できるデータがないので何もしない
-			else:
-				pass
-		
-		df = self.db.select_from_prices(input.ticker, input.begin_range, input.end_range, chart_granularity)
-		if current != None:
-			df = pandas.concat([df, current], ignore_index=True)
+		if missing:
+			# 全銘柄の欠けている取引日をまとめた期間ごとに、その期間に欠けがある銘柄を1回で取得する
+			# 離れた期間は別々に取るので、間の格納済みの期間は取り直さない
+			fetched: dict[str, list[pandas.DataFrame]] = {ticker: [] for ticker in missing}
+			for first, last in self.planner.fetch_windows(numpy.unique(numpy.concatenate(list(missing.values())))):
+				targets = [ticker for ticker, sessions in missing.items() if ((sessions >= numpy.datetime64(first, "D")) & (sessions <= numpy.datetime64(last, "D"))).any()]
+				for ticker, history in self.provider.history_many(targets, first, last).items():
+					fetched[ticker].append(history)
+			for ticker, sessions in missing.items():
+				history = pandas.concat(fetched[ticker]) if fetched[ticker] else None
+				self.store_fetched_prices(ticker, coverages[ticker].security_id, history, sessions, last_final[ticker], "daily", coverages[ticker].end_date)
+
+		df = self.db.select_from_prices_many(tickers, input.begin_range, input.end_range, chart_granularity)
+
+		# 場中の場合は当日の足をDBに入れず、戻り値となるdfにだけデータを入れる
+		intraday = []
+		if chart_granularity not in self.db.INTRADAY_GRANULARITIES:
+			intraday = [ticker for ticker in tickers if end > last_final[ticker] and self.planner.has_intraday_bar(markets[ticker])]
+		if intraday:
+			histories = self.provider.recent(intraday, period="1d")
+			for ticker in intraday:
+				current = histories[ticker]
+				if current.empty:
+					continue
+				# DBの日足と同じ形（日付のみ）に揃える
+				current.index = pandas.DatetimeIndex(current.index.date)
+				if chart_granularity != "daily":
+					# 週足・月足の場合は当日の足を該当銘柄の最後の足にまとめ直す
+					is_ticker = (df["Ticker"] == ticker).to_numpy()
+					current = resample_ohlcv(pandas.concat([df.loc[is_ticker].drop(columns="Ticker"), current]), chart_granularity)
+					df = df.loc[~is_ticker]
+				current.insert(0, "Ticker", ticker)
+				df = pandas.concat([df, current])
 
-		# データが取れていることを確認する（が、通常は問題ないはず）
-		if df is None:
-			raise LookupError("データフレームが空です。")
-		
 		# 日付をindexからレコード内に含めるように変更
 		df = df.reset_index()
 		# 日付のレコードが自動的にindexとなるのでDateに直しておく
 		df = df.rename(columns={"index": "Date",})
+		# 指定された銘柄の順、日付順に並べる
+		order = {ticker: i for i, ticker in enumerate(tickers)}
+		df = df.sort_values(["Ticker", "Date"], key=lambda col: col.map(order) if col.name == "Ticker" else col, kind="stable", ignore_index=True)
+
+		log.append_to_log_file_from_df(df)
+
+		if not by_ticker:
+			return df
+
+		result = {ticker: group.drop(columns="Ticker").reset_index(drop=True) for ticker, group in df.groupby("Ticker", sort=False)}
+		empty = df.drop(columns="Ticker").iloc[0:0]
+		return {ticker: result.get(ticker, empty) for ticker in tickers}
 
+	# 入力された粒度をDBが扱える粒度に揃える
+	# 未対応のもの（未指定を含む）は日足として扱う
+	def normalize_granularity(self, chart_granularity: str | None) -> str:
+		chart_granularity = (chart_granularity or "").strip().lower()
+		if self.db.is_supported_granularity(chart_granularity):
+			return chart_granularity
+
+		return "daily"
+
+	# DBに揃っているべき取引日のうち、欠けているものを返す
+	# 件数が揃っている場合は日付の一覧を読まずに済ませる
+	def plan_price_gaps(self, coverage: PriceCoverage, begin: date, end: date, last_final: date) -> numpy.ndarray:
+		target = self.planner.target_range(coverage.rows, begin, end, last_final)
+		if target is None:
+			return numpy.array([], dtype="datetime64[D]")
+		first, last = target
+
+		if coverage.rows > 0 and coverage.rows_in_range >= self.calendar.count_sessions(first, last):
+			return numpy.array([], dtype="datetime64[D]")
+
+		# 確認済みの空白期間はプロセス内で一度だけDBから読み込む
+		if self.planner.get_empty_spans(coverage.security_id) is None:
+			self.planner.set_empty_spans(coverage.security_id, self.db.select_empty_spans(coverage.security_id))
+
+		expected = self.planner.expected_sessions(coverage.security_id, first, last)
+		if coverage.rows > 0 and coverage.rows_in_range >= len(expected):
+			return numpy.array([], dtype="datetime64[D]")
+
+		stored = []
+		if coverage.rows > 0:
+			stored = self.db.select_price_dates(coverage.security_id, first, last)
+
+		return self.planner.missing_sessions(expected, stored)
+
+	# 取得した後、begin～endに欠けたままの取引日（確認済みの空白期間を除く）が残っていないか
+	def is_filled(self, security_id: int, missing: numpy.ndarray, history: pandas.DataFrame, begin: date, end: date) -> bool:
+		fetched = numpy.array([], dtype="datetime64[D]")
+		if history is not None and not history.empty:
+			fetched = numpy.array(history.index.date, dtype="datetime64[D]")
+
+		remaining = numpy.setdiff1d(missing, fetched)
+		remaining = remaining[(numpy.datetime64(begin, "D") <= remaining) & (remaining <= numpy.datetime64(end, "D"))]
+		if len(remaining) == 0:
+			return True
+
+		# 今回の取得で空白期間と確認できた取引日は欠けていないものとする
+		return len(numpy.intersect1d(remaining, self.planner.expected_sessions(security_id, begin, end))) == 0
+
+	# 取得したデータのうち欠けていた取引日の分だけをDBに格納し、
+	# データが返ってこなかった取引日は空白期間として記録する（記録する範囲はFetchPlanner.empty_spans_after_fetch）
+	# stored_endはDBに格納済みの最後の日（ない場合はNone）
+	def store_fetched_prices(self, ticker: str, security_id: int, history: pandas.DataFrame, missing: numpy.ndarray, last_final: date, chart_granularity: str, stored_end: date | None = None) -> int:
+		count = 0
+		fetched = numpy.array([], dtype="datetime64[D]")
+		if history is not None and not history.empty:
+			fetched = numpy.array(history.index.date, dtype="datetime64[D]")
+			keep = numpy.isin(fetched, missing)
+			if keep.any():
+				count = self.db.insert_into_prices(ticker, history.loc[keep], chart_granularity)
+
+		spans = self.planner.empty_spans_after_fetch(missing, fetched, last_final, stored_end)
+		if spans:
+			checked_at = date.today()
+			self.db.insert_empty_spans(security_id, spans, checked_at)
+			self.planner.add_empty_spans(security_id, [(first, last, checked_at) for first, last in spans])
+
+		return count
+
+	# 指定範囲の日足にテクニカル指標（SMA25/50/75、RSI14、MACD）を付けて返す
+	# 指標はDBに保存済みの値を読み出し、保存済みの最後の足より後の分だけを逐次計算して追加する
+	# 初めての銘柄や保存済みより前の期間の場合は、開始日の前の助走期間の日足も自動で読み込んで（なければ取得して）一括計算する
+	# 場中の場合の当日の足は、前日までの計算状態から求める（保存しない）
+	def get_technical_analysis(self, input: GetPriceInput, log: Logging = None) -> pandas.DataFrame:
+		if log == None:
+			log = Logging()
+
+		try:
+			if isinstance(input, dict):
+				input = GetPriceInput(**input)
+		except ValidationError as e:
+			log.append_to_log_file_from_dict(input, f"ValidationError: {e}")
+			raise ValueError("入力値の形式が不正です") from e
+
+		# 指標は日足で計算する（入力チェックと期間の正規化はget_priceで行う）
+		input.chart_granularity = "daily"
+		rows = self.get_price(input, log).set_index("Date")
+
+		market = self.db.get_market_hours(input.ticker)
+		last_final = self.planner.last_finalized_session(market)
+		begin = input.begin_range.date()
+		final_end = min(input.end_range.date(), last_final)
+		security_id = self.db.get_security_id(input.ticker)
+
+		current = rows.index > pandas.Timestamp(last_final)
+		if not rows.empty:
+			# 当日の足がある場合は最後の確定日まで計算状態を進めておく
+			sync_end = last_final if current.any() else final_end
+			self.sync_indicators(input.ticker, security_id, rows, min(begin, sync_end), sync_end, log)
+
+		if begin <= final_end:
+			rows = rows.join(self.indicators.select_values(security_id, begin, final_end))
+		else:
+			rows = rows.reindex(columns=list(rows.columns) + INDICATOR_COLUMNS)
+
+		with tracer.stage("indicators"):
+			for d in rows.index[current]:
+				preview = self.indicators.preview(security_id, d.date(), float(rows.at[d, "Close"]))
+				if preview is not None:
+					rows.loc[d, INDICATOR_COLUMNS] = [preview[col] for col in INDICATOR_COLUMNS]
+
+		df = rows.round(2).rename_axis("Date").reset_index()
 		log.append_to_log_file_from_df(df)
 		return df
-	
+
+	# valid_from～endの指標が保存済みになるように計算する
+	# rowsはget_priceで読み出した日足（indexは日付）で、足りない助走期間の日足だけを追加で読み出す
+	def sync_indicators(self, ticker: str, security_id: int, rows: pandas.DataFrame, valid_from: date, end: date, log: Logging) -> None:
+		state = self.indicators.get_state(security_id)
+		if state is None or valid_from < state.valid_from:
+			first = self.indicators.warmup_begin(valid_from)
+		elif state.last_date < end:
+			# 状態の最後の足から続きを計算する
+			first = state.last_date
+		else:
+			return
+
+		if first >= rows.index[0].date():
+			prices = rows.loc[pandas.Timestamp(first):pandas.Timestamp(end)]
+		else:
+			prices = self.get_price(GetPriceInput(ticker=ticker, begin_range=first, end_range=end, chart_granularity="daily"), log).set_index("Date")
+		self.indicators.sync(security_id, prices, valid_from)
+
+	# 保存済みの指標（get_technical_analysis、indicator_panelで計算したもの）を使って、条件に合う銘柄を全銘柄から探す
+	# 業種・指数で対象を絞り込み、最新の足の値で全条件を全銘柄まとめて判定して、sort_byの順に上位limit件を返す
+	# 条件に合った銘柄の総数はdf.attrs["matched"]に入れる
+	def screen(self, input: ScreenInput, log: Logging = None) -> pandas.DataFrame:
+		if log == None:
+			log = Logging()
+
+		try:
+			if isinstance(input, dict):
+				input = ScreenInput(**input)
+		except ValidationError as e:
+			log.append_to_log_file_from_dict(input, f"ValidationError: {e}")
+			raise ValueError("入力値の形式が不正です") from e
+
+		conditions = [(c.field, c.op, c.value, c.within) for c in input.conditions]
+		try:
+			for condition in conditions:
+				validate_condition(*condition)
+			if input.sort_by is not None and input.sort_by not in SCREEN_FIELDS:
+				raise ValueError(f"未対応の並び替えの項目です：{input.sort_by}（{', '.join(SCREEN_FIELDS)}のいずれか）")
+		except ValueError as e:
+			log.append_to_log_file_from_bm(input, str(e))
+			raise
+
+		security_ids = self.db.select_universe(input.sectors, input.index_code)
+		if security_ids is not None and not security_ids:
+			err = "指定した業種・指数に該当する銘柄がありません"
+			log.append_to_log_file_from_bm(input, err)
+			raise ValueError(err)
+
+		log.append_to_log_file_from_bm(input)
+
+		# 最新の足がそろっていない日があっても判定できるように、必要な本数より多めに読み込む
+		# 読み込む期間は必要な本数から決める（休場日を含めても足りるように暦日で2倍＋連休分さかのぼって数える）
+		today = date.today()
+		needed = required_sessions(conditions) + 10
+		sessions = self.calendar.sessions_between(today - timedelta(days=needed * 2 + 14), today)
+		begin = sessions[max(0, len(sessions) - needed)].item()
+		days, ids, fields = self.indicators.select_panel(begin, today, security_ids)
+		fields = derive_fields(fields)
+
+		row = latest_row(fields)
+		if row is None:
+			raise LookupError("指標が計算済みの銘柄がありません")
+
+		matched = evaluate(fields, conditions, row)
+		df = pandas.DataFrame({
+			"Ticker": [self.db.get_ticker(int(security_id)) for security_id in ids[matched]],
+			"Date": pandas.Timestamp(days[row]),
+		})
+		df["Name"] = [self.db.get_name(ticker) for ticker in df["Ticker"]]
+		for field in SCREEN_FIELDS:
+			df[field] = fields[field][row, matched]
+		# 出来高は整数にしておく（出来高がNULLの足は欠損値のまま）
+		df["Volume"] = df["Volume"].astype("Int64")
+
+		if input.sort_by is not None:
+			df = df.sort_values(input.sort_by, ascending=input.ascending, na_position="last", kind="stable")
+		matched_count = len(df)
+		df = df.head(max(0, input.limit)).reset_index(drop=True)
+		df[SCREEN_FIELDS] = df[SCREEN_FIELDS].round(2)
+		df.attrs["matched"] = matched_count
+
+		log.append_to_log_file_from_df(df)
+		return df
+
+	# 業種・指数の日次リターン、水準、騰落銘柄数、SMAを上回る銘柄の割合を返す
+	# 集計値は保存済みのものを読み出し、保存済みの最後の日より後の分だけを計算して追加する
+	# 構成銘柄の日足はDBに格納済みのものだけを使う（取得は引け後の取り込みに任せる）
+	def get_group_aggregate(self, input: GetGroupAggregateInput, log: Logging = None) -> pandas.DataFrame:
+		if log == None:
+			log = Logging()
+
+		try:
+			if isinstance(input, dict):
+				input = GetGroupAggregateInput(**input)
+		except ValidationError as e:
+			log.append_to_log_file_from_dict(input, f"ValidationError: {e}")
+			raise ValueError("入力値の形式が不正です") from e
+
+		if input.weighting not in ("equal", "weighted"):
+			err = f"未対応の平均の取り方です：{input.weighting}（equal、weightedのいずれか）"
+			log.append_to_log_file_from_bm(input, err)
+			raise ValueError(err)
+
+		try:
+			group_id = self.aggregator.resolve(input.kind, input.name, input.classification)
+		except ValueError as e:
+			log.append_to_log_file_from_bm(input, str(e))
+			raise
+
+		security_ids, _ = self.aggregator.members(input.kind, [group_id])[group_id]
+		if len(security_ids) == 0:
+			err = "構成銘柄が登録されていません"
+			log.append_to_log_file_from_bm(input, err)
+			raise ValueError(err)
+
+		self.normalize_range(input, log)
+		log.append_to_log_file_from_bm(input)
+
+		# 構成銘柄は同じ市場の想定で、その市場で確定済みの日までを集計する
+		market = self.db.get_market_hours(self.db.get_ticker(int(security_ids[0])))
+		last_final = self.planner.last_finalized_session(market)
+		begin = input.begin_range.date()
+		end = min(input.end_range.date(), last_final)
+
+		values = pandas.DataFrame(columns=GroupAggregator.VALUE_COLUMNS, index=pandas.DatetimeIndex([]), dtype=numpy.float64)
+		if begin <= end:
+			self.aggregator.update(input.kind, [group_id], begin, end)
+			values = self.aggregator.select(input.kind, group_id, begin, end)
+
+		df = pandas.DataFrame({
+			"Return_pct": values[f"{input.weighting}_return"] * 100,
+			"Level": values[f"{input.weighting}_level"],
+			"Members": values["members"],
+			"Advancers": values["advancers"],
+			"Decliners": values["decliners"],
+			"Above_SMA25_pct": values["above_sma25"] * 100,
+			"Above_SMA50_pct": values["above_sma50"] * 100,
+			"Above_SMA75_pct": values["above_sma75"] * 100,
+		}, index=values.index).round(2)
+		for col in ["Members", "Advancers", "Decliners"]:
+			df[col] = df[col].astype(numpy.int64)
+		df = df.rename_axis("Date").reset_index()
+
+		log.append_to_log_file_from_df(df)
+		return df
+
 	# テクニカル分析の内部関数　引数、戻り値ともに他の関数と連携しやすいDataFrameとする
 	def do_technical_analysis(self, df: pandas.DataFrame, log: Logging = None) -> pandas.DataFrame:
 		if log == None:
 			log = Logging()
 
-		# 移動平均線（短期）
-		df.ta.sma(length=25, append=True)
-		# 移動平均線（中期）
-		df.ta.sma(length=50, append=True)
-		# 移動平均線（長期）
-		df.ta.sma(length=75, append=True)
-		# RSI
-		df.ta.rsi(length=14, append=True)
-		# MACD
-		df.ta.macd(append=True)
+		with tracer.stage("indicators", rows=len(df)):
+			# 移動平均線（短期）
+			df.ta.sma(length=25, append=True)
+			# 移動平均線（中期）
+			df.ta.sma(length=50, append=True)
+			# 移動平均線（長期）
+			df.ta.sma(length=75, append=True)
+			# RSI
+			df.ta.rsi(length=14, append=True)
+			# MACD
+			df.ta.macd(append=True)
 
 		# MACD関連の列名が分かりづらいので一般的な形に直しておく
 		df = df.rename(columns={
@@ -247,4 +718,6 @@ class Backend:
 		df = df.round(2)
 
 		log.append_to_log_file_from_df(df)
-		return df
\ No newline at end of file
+		return df
+
+DB.add_insert_listener(Backend.on_prices_inserted)
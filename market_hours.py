@@ -0,0 +1,68 @@
+import datetime as dt
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+
+# marketsテーブルの1行分（取引時間）
+# 時刻はMySQLdbのTIME型と同じく0時からの経過時間(timedelta)で持つ
+# zoneはfrom_rowで作る際に一度だけ生成しておく
+class MarketHours(NamedTuple):
+    timezone: str
+    open1: dt.timedelta
+    close1: dt.timedelta
+    open2: dt.timedelta | None
+    close2: dt.timedelta | None
+    zone: ZoneInfo | None = None
+
+    # (timezone, open1, close1, open2, close2) の行から作る
+    @classmethod
+    def from_row(cls, row: tuple) -> "MarketHours":
+        return cls(*row[:5], zone=ZoneInfo(row[0]))
+
+    def get_zone(self) -> ZoneInfo:
+        if self.zone is not None:
+            return self.zone
+        return ZoneInfo(self.timezone)
+
+    # 市場のタイムゾーンでの現在時刻を0時からの経過時間で返す
+    def now(self) -> dt.timedelta:
+        t = dt.datetime.now(self.get_zone()).time()
+        return dt.timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
+
+    # 市場のタイムゾーンでの今日の日付
+    def today(self) -> dt.date:
+        return dt.datetime.now(self.get_zone()).date()
+
+    # 現在時刻が取引時間中であるか
+    # 昼休みも考慮する
+    def is_active(self, now: dt.timedelta | None = None) -> bool:
+        if now is None:
+            now = self.now()
+
+        # 時間1の判定
+        if self.open1 <= now <= self.close1:
+            return True
+
+        # 時間2がある場合のみ判定
+        if self.open2 and self.close2:
+            if self.open2 <= now <= self.close2:
+                return True
+
+        return False
+
+    # 現在時刻が取引開始時刻よりも後であるか
+    def is_open(self, now: dt.timedelta | None = None) -> bool:
+        if now is None:
+            now = self.now()
+
+        return self.open1 <= now
+
+    # 現在時刻が取引終了時刻よりも後であるか
+    def is_closed(self, now: dt.timedelta | None = None) -> bool:
+        if now is None:
+            now = self.now()
+
+        # 時間2がある場合は時間1をチェックしない
+        if self.close2:
+            return now >= self.close2
+
+        return now >= self.close1
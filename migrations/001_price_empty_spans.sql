@@ -0,0 +1,11 @@
+-- =========================================
+-- 既存DB向けマイグレーション
+-- データが返ってこなかった期間を記録するテーブルを追加する
+-- =========================================
+CREATE TABLE IF NOT EXISTS price_empty_spans (
+    security_id INT NOT NULL,
+    first_date DATE NOT NULL,
+    last_date DATE NOT NULL,
+    PRIMARY KEY (security_id, first_date),
+    FOREIGN KEY (security_id) REFERENCES securities(id)
+);
@@ -0,0 +1,23 @@
+-- =========================================
+-- 既存DB向けマイグレーション
+-- 分足を格納するテーブルを追加する
+-- =========================================
+-- 分足テーブル (場中に取得した1分足・5分足など)
+-- 日足のpricesとは分け、月ごとのパーティションで古い月を丸ごと捨てられるようにする
+-- 古い分足は日足にまとめてpricesに移してから捨てる (DB.compact_intraday_prices)
+-- パーティションを切ったテーブルには外部キーを付けられないのでsecuritiesへの参照は持たない
+-- 月ごとのパーティションはDB.ensure_intraday_partitionsでpmaxを分割して追加する
+CREATE TABLE IF NOT EXISTS intraday_prices (
+    security_id INT NOT NULL,
+    bar_minutes TINYINT UNSIGNED NOT NULL, -- 足の長さ (分)
+    ts DATETIME NOT NULL,                  -- 足の開始時刻 (市場の現地時刻)
+    open DECIMAL(15,4),
+    high DECIMAL(15,4),
+    low DECIMAL(15,4),
+    close DECIMAL(15,4),
+    volume BIGINT,
+    PRIMARY KEY (security_id, bar_minutes, ts)
+)
+PARTITION BY RANGE (TO_DAYS(ts)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
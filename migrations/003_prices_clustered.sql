@@ -0,0 +1,49 @@
+-- =========================================
+-- 既存DB向けマイグレーション
+-- pricesを主キー (security_id, date, time) のクラスタインデックスに作り直す
+-- これまでは AUTO_INCREMENT の id が主キーで、期間の読み出しは uq_prices を引いてから id で行を読みに行っていた
+-- 日足のtimeはNULLから 00:00:00 にする (NULLを含む uq_prices では同じ日の日足の重複を防げていなかった)
+-- 重複していた日足は後から入った行 (idが大きい方) を残す
+-- timeが入っている行 (分足) は intraday_prices に1分足として移す
+-- 002_intraday_prices.sql を先に適用しておくこと
+-- 確認後、prices_old は DROP TABLE prices_old で削除する
+-- =========================================
+CREATE TABLE prices_new (
+    security_id INT NOT NULL,
+    date DATE NOT NULL,
+    time TIME NOT NULL DEFAULT '00:00:00', -- 日足は 00:00:00
+    open DECIMAL(15,4),
+    high DECIMAL(15,4),
+    low DECIMAL(15,4),
+    close DECIMAL(15,4),
+    volume BIGINT,
+    PRIMARY KEY (security_id, date, time),
+    CONSTRAINT fk_prices_security FOREIGN KEY (security_id) REFERENCES securities(id)
+);
+
+-- id順に入れ、同じ日の日足は後の行で上書きする
+INSERT INTO prices_new (security_id, date, time, open, high, low, close, volume)
+SELECT security_id, date, '00:00:00', open, high, low, close, volume
+FROM prices
+WHERE time IS NULL
+ORDER BY id ASC
+ON DUPLICATE KEY UPDATE
+    open = VALUES(open),
+    high = VALUES(high),
+    low = VALUES(low),
+    close = VALUES(close),
+    volume = VALUES(volume);
+
+INSERT INTO intraday_prices (security_id, bar_minutes, ts, open, high, low, close, volume)
+SELECT security_id, 1, TIMESTAMP(date, time), open, high, low, close, volume
+FROM prices
+WHERE time IS NOT NULL
+ORDER BY id ASC
+ON DUPLICATE KEY UPDATE
+    open = VALUES(open),
+    high = VALUES(high),
+    low = VALUES(low),
+    close = VALUES(close),
+    volume = VALUES(volume);
+
+RENAME TABLE prices TO prices_old, prices_new TO prices;
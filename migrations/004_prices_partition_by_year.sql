@@ -0,0 +1,47 @@
+-- =========================================
+-- 既存DB向けマイグレーション（任意）
+-- pricesを年ごとのRANGEパーティションに分ける
+-- 期間で絞り込む読み出しは該当する年のパーティションだけを読み、古い年の統計の更新や最適化も年単位で行える
+-- パーティションを切ったテーブルには外部キーを付けられないので、securitiesへの外部キーを外す
+-- 銘柄の存在確認はマスタキャッシュ (SecurityMaster) で行っているので、アプリケーション側の動作は変わらない
+-- 003_prices_clustered.sql を先に適用しておくこと
+-- 2031年以降の分は pmax に入るので、必要になったら REORGANIZE PARTITION pmax で年を追加する
+-- =========================================
+ALTER TABLE prices DROP FOREIGN KEY fk_prices_security;
+
+ALTER TABLE prices
+PARTITION BY RANGE (YEAR(date)) (
+    PARTITION p_old VALUES LESS THAN (2000),
+    PARTITION p2000 VALUES LESS THAN (2001),
+    PARTITION p2001 VALUES LESS THAN (2002),
+    PARTITION p2002 VALUES LESS THAN (2003),
+    PARTITION p2003 VALUES LESS THAN (2004),
+    PARTITION p2004 VALUES LESS THAN (2005),
+    PARTITION p2005 VALUES LESS THAN (2006),
+    PARTITION p2006 VALUES LESS THAN (2007),
+    PARTITION p2007 VALUES LESS THAN (2008),
+    PARTITION p2008 VALUES LESS THAN (2009),
+    PARTITION p2009 VALUES LESS THAN (2010),
+    PARTITION p2010 VALUES LESS THAN (2011),
+    PARTITION p2011 VALUES LESS THAN (2012),
+    PARTITION p2012 VALUES LESS THAN (2013),
+    PARTITION p2013 VALUES LESS THAN (2014),
+    PARTITION p2014 VALUES LESS THAN (2015),
+    PARTITION p2015 VALUES LESS THAN (2016),
+    PARTITION p2016 VALUES LESS THAN (2017),
+    PARTITION p2017 VALUES LESS THAN (2018),
+    PARTITION p2018 VALUES LESS THAN (2019),
+    PARTITION p2019 VALUES LESS THAN (2020),
+    PARTITION p2020 VALUES LESS THAN (2021),
+    PARTITION p2021 VALUES LESS THAN (2022),
+    PARTITION p2022 VALUES LESS THAN (2023),
+    PARTITION p2023 VALUES LESS THAN (2024),
+    PARTITION p2024 VALUES LESS THAN (2025),
+    PARTITION p2025 VALUES LESS THAN (2026),
+    PARTITION p2026 VALUES LESS THAN (2027),
+    PARTITION p2027 VALUES LESS THAN (2028),
+    PARTITION p2028 VALUES LESS THAN (2029),
+    PARTITION p2029 VALUES LESS THAN (2030),
+    PARTITION p2030 VALUES LESS THAN (2031),
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
@@ -0,0 +1,29 @@
+-- =========================================
+-- 既存DB向けマイグレーション
+-- テクニカル指標の値と逐次計算の状態を格納するテーブルを追加する
+-- =========================================
+-- テクニカル指標の値 (確定した日足ごと、列は indicators.INDICATOR_COLUMNS と同じ並び)
+-- 新しい足の分だけを IndicatorEngine が逐次計算して追加する
+CREATE TABLE IF NOT EXISTS indicator_values (
+    security_id INT NOT NULL,
+    date DATE NOT NULL,
+    sma25 DOUBLE,
+    sma50 DOUBLE,
+    sma75 DOUBLE,
+    rsi14 DOUBLE,
+    macd DOUBLE,
+    macd_histogram DOUBLE,
+    macd_signal DOUBLE,
+    PRIMARY KEY (security_id, date),
+    FOREIGN KEY (security_id) REFERENCES securities(id)
+);
+
+-- テクニカル指標の逐次計算の状態 (銘柄ごとに1行、indicators.IndicatorState をJSONにしたもの)
+-- valid_from 以降の値は助走期間を経ており、last_date までの足を反映済み
+CREATE TABLE IF NOT EXISTS indicator_states (
+    security_id INT NOT NULL PRIMARY KEY,
+    valid_from DATE NOT NULL,
+    last_date DATE NOT NULL,
+    state JSON NOT NULL,
+    FOREIGN KEY (security_id) REFERENCES securities(id)
+);
@@ -0,0 +1,24 @@
+-- =========================================
+-- 既存DB向けマイグレーション
+-- 業種・指数ごとの集計値を格納するテーブルを追加する
+-- =========================================
+-- 業種・指数ごとの日次の集計値 (group_aggregates.GroupAggregator が保存済みの最後の日の続きから追加する)
+-- group_id は kind が sector の場合は sectors.id、index の場合は indices.id
+-- 水準 (level) は計算を始めた日を100としてリターンを積み上げた値、加重平均は index_components.weight による (指数のみ)
+-- above_smaNN は指標が計算済みの構成銘柄のうち、終値がSMAを上回る銘柄の割合
+CREATE TABLE IF NOT EXISTS group_aggregates (
+    kind ENUM('sector', 'index') NOT NULL,
+    group_id INT NOT NULL,
+    date DATE NOT NULL,
+    equal_return DOUBLE,
+    equal_level DOUBLE,
+    weighted_return DOUBLE,
+    weighted_level DOUBLE,
+    members INT NOT NULL,   -- リターンを計算できた構成銘柄の数
+    advancers INT NOT NULL,
+    decliners INT NOT NULL,
+    above_sma25 DOUBLE,
+    above_sma50 DOUBLE,
+    above_sma75 DOUBLE,
+    PRIMARY KEY (kind, group_id, date)
+);
@@ -0,0 +1,8 @@
+-- =========================================
+-- 既存DB向けマイグレーション
+-- 空白期間に最後に確認した日を追加する
+-- =========================================
+-- 確認してから FetchPlanner.EMPTY_SPAN_RECHECK_DAYS を過ぎた空白期間は空白とみなさずに取り直す
+-- 既存の行は取得に失敗しただけの期間が混ざっている可能性があるので NULL (未確認扱い) のままにし、次の取得で確認し直す
+ALTER TABLE price_empty_spans
+    ADD COLUMN checked_at DATE AFTER last_date;
@@ -1,30 +1,195 @@
-import inspect
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
 from typing import overload
 import datetime as dt
+import numpy
 import pydantic
 import pandas
 
+# ログファイルへの書き込みを行うスレッド（ファイルごとに1つ、同じファイルに書くLoggingで共有する）
+# 呼び出し側はレコード（dict）をキューに積むだけで、JSONへの変換とファイルへの書き込みはこのスレッドでまとめて行う
+# ファイルがmax_bytesを超えたら kabu-log.txt.1、.2 … にずらしてbackup_count世代まで残す
+class LogWriter:
+    _writers: dict[str, "LogWriter"] = {}
+    _writers_lock = threading.Lock()
+
+    # 1回の書き込みにまとめる最大件数
+    BATCH_SIZE = 500
+    # キューに溜めておく最大件数（書き込みが追いつかない場合は古いものから捨てる）
+    MAX_QUEUE = 100000
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3, flush_interval: float = 0.5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+
+        self._queue: collections.deque = collections.deque(maxlen=self.MAX_QUEUE)
+        self._cond = threading.Condition()
+        self._put_count = 0
+        self._written_count = 0
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name=f"LogWriter({path})", daemon=True)
+        self._thread.start()
+
+    # ファイルごとの書き込みスレッド（なければ作る）
+    @classmethod
+    def get(cls, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3) -> "LogWriter":
+        key = os.path.abspath(path)
+        with cls._writers_lock:
+            writer = cls._writers.get(key)
+            if writer is None:
+                writer = cls(path, max_bytes, backup_count)
+                cls._writers[key] = writer
+            return writer
+
+    # 全ファイルの書き込みを待つ（終了時に呼ばれる）
+    @classmethod
+    def flush_all(cls, timeout: float = 5.0) -> None:
+        with cls._writers_lock:
+            writers = list(cls._writers.values())
+        for writer in writers:
+            writer.flush(timeout)
+
+    def put(self, record: dict) -> None:
+        with self._cond:
+            self._queue.append(record)
+            self._put_count += 1
+            if len(self._queue) >= self.BATCH_SIZE:
+                self._cond.notify_all()
+
+    # ここまでに積まれたレコードが書き込まれるまで待つ
+    def flush(self, timeout: float = 5.0) -> None:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            target = self._put_count
+            self._cond.notify_all()
+            while self._written_count < target and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self._cond.wait(remaining)
+
+    def _run(self) -> None:
+        f = None
+        try:
+            while True:
+                with self._cond:
+                    if not self._queue:
+                        self._cond.wait(self.flush_interval)
+                    records = [self._queue.popleft() for _ in range(min(len(self._queue), self.BATCH_SIZE))]
+                    # 捨てられた分も書き込み済みとして数える
+                    skipped = self._put_count - self._written_count - len(records) - len(self._queue)
+
+                if records:
+                    data = "".join(self._format(record) + "\n" for record in records).encode("utf-8")
+                    if f is None:
+                        f = open(self.path, "ab")
+                    if self.max_bytes > 0 and f.tell() > 0 and f.tell() + len(data) > self.max_bytes:
+                        f.close()
+                        self._rotate()
+                        f = open(self.path, "ab")
+                    f.write(data)
+                    f.flush()
+
+                with self._cond:
+                    self._written_count += len(records) + max(0, skipped)
+                    self._cond.notify_all()
+        except Exception as e:
+            # ログの失敗で本体を止めない
+            print(f"{dt.datetime.now()} | LogWriter | {e!r}", file=sys.stderr)
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+        finally:
+            if f is not None:
+                f.close()
+
+    # kabu-log.txt -> kabu-log.txt.1 -> kabu-log.txt.2 … とずらす
+    def _rotate(self) -> None:
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    # 1レコードを1行のJSONにする　DataFrameの中身（先頭・末尾の行）はここで初めて文字列にする
+    @staticmethod
+    def _format(record: dict) -> str:
+        frame = record.pop("_frame", None)
+        if frame is not None:
+            head, tail = frame
+            record["head"] = head.to_string()
+            if tail is not None:
+                record["tail"] = tail.to_string()
+        return json.dumps(record, ensure_ascii=False, default=LogWriter._default)
+
+    # JSONにできない値（日時、numpyの値など）の変換
+    @staticmethod
+    def _default(value):
+        if isinstance(value, numpy.datetime64):
+            return numpy.datetime_as_string(value, unit="s")
+        if isinstance(value, numpy.generic):
+            return value.item()
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        return str(value)
+
+atexit.register(LogWriter.flush_all)
+
 class Logging:
     # 自作ログの出力先
     KABU_LOG_FILE = "kabu-log.txt"
     IS_LOGGING: bool = True
 
+    # ログの詳しさ　DEBUGの場合のみDataFrameの先頭・末尾の行を出す（INFOでは行数・列名・期間のみ）
+    LEVELS = {"DEBUG": 10, "INFO": 20, "ERROR": 40}
+
+    # 呼び出しごとの所要時間を出すため、入力を記録した時刻をスレッドごとに覚えておく
+    _local = threading.local()
+
     # ログを作りたくない場合はファイル名を入れなくてよい
-    def __init__(self, logFileName = "", isLogging: bool = True):
+    def __init__(self, logFileName = "", isLogging: bool = True, level: str = "INFO", max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3):
+        self.level = self.LEVELS.get(level.upper(), self.LEVELS["INFO"])
+        self.writer: LogWriter | None = None
         if not logFileName:
             self.IS_LOGGING = False
             return
-        
+
         self.KABU_LOG_FILE = logFileName
         self.IS_LOGGING = isLogging
+        if isLogging:
+            self.writer = LogWriter.get(logFileName, max_bytes, backup_count)
+
+    # 書き込みスレッドにレコードを渡す
+    def emit(self, level: str, call: str, **fields) -> None:
+        if not self.IS_LOGGING or self.writer is None or self.LEVELS[level] < self.level:
+            return
+
+        record = dict(ts=dt.datetime.now().isoformat(timespec="microseconds"), level=level, call=call)
+        record.update(fields)
+        self.writer.put(record)
+
+    # 書き込み待ちのログがファイルに書き込まれるまで待つ
+    def flush(self, timeout: float = 5.0) -> None:
+        if self.writer is not None:
+            self.writer.flush(timeout)
 
     # 所定のログファイルにログを追記する
     def append_to_log_file(self, message: str) -> None:
         if not self.IS_LOGGING or not message:
             return
 
-        with open(self.KABU_LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(message + "\n")
+        self.emit("INFO", sys._getframe(1).f_code.co_name, message=message)
 
     @overload
     def append_to_log_file_from_bm(bm: pydantic.BaseModel) -> None: ...
@@ -34,14 +199,20 @@ class Logging:
     def append_to_log_file_from_bm(self, bm: pydantic.BaseModel, message: str | None = None) -> None:
         if not self.IS_LOGGING:
             return
-        
-        line = f"{dt.datetime.now()} | {bm.__class__.__name__} \n" + str(bm.model_dump())
 
-        with open(self.KABU_LOG_FILE, "a", encoding="utf-8") as f:
-            if not message:
-                f.write(line + "\n")
-            else:
-                f.write(line + " | " + message + "\n")
+        payload = bm.model_dump(mode="json")
+        fields = dict(model=bm.__class__.__name__, input=payload)
+        # 検索しやすいように銘柄と期間は別の項目にも出す
+        for key, name in (("ticker", "ticker"), ("tickers", "tickers"), ("begin_range", "begin"), ("end_range", "end")):
+            if key in payload:
+                fields[name] = payload[key]
+
+        if not message:
+            # 入力チェックを通った時点を呼び出しの開始とみなす
+            self._local.started = time.perf_counter()
+            self.emit("INFO", sys._getframe(1).f_code.co_name, **fields)
+        else:
+            self.emit("ERROR", sys._getframe(1).f_code.co_name, message=message, **fields)
 
     @overload
     def append_to_log_file_from_dict(payload: dict) -> None: ...
@@ -51,18 +222,13 @@ class Logging:
     def append_to_log_file_from_dict(self, payload: dict, message: str | None = None) -> None:
         if not self.IS_LOGGING:
             return
-        
-        def_name = inspect.currentframe().f_back.f_code.co_name
+
+        def_name = sys._getframe(1).f_code.co_name
 
         if not message:
-            line = f"{dt.datetime.now()} | {def_name} \n"
+            self.emit("INFO", def_name, payload=payload)
         else:
-            line = f"{dt.datetime.now()} | {def_name}  | {message}\n"
-
-        line += str(payload)
-
-        with open(self.KABU_LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(line + "\n")
+            self.emit("ERROR", def_name, message=message, payload=payload)
 
     @overload
     def append_to_log_file_from_df(df: pandas.DataFrame) -> None: ...
@@ -72,24 +238,27 @@ class Logging:
     def append_to_log_file_from_df(self, df: pandas.DataFrame, message: str | None = None) -> None:
         if not self.IS_LOGGING:
             return
-        
-        def_name = inspect.currentframe().f_back.f_code.co_name
 
-        if not message:
-            line = f"{dt.datetime.now()} | {def_name} \n"
-        else:
-            line = f"{dt.datetime.now()} | {def_name}  | {message}\n"
+        def_name = sys._getframe(1).f_code.co_name
 
-        # dfの大きさが6以下の場合は全行表示
-        if len(df) <= 6:
-            line += df.to_string()
-        # dfの大きさが6を超える場合は最初の３行と最後の３行を表示
-        else:
-            line += df.head(3).to_string() + "\n"
-            line += "(～中略～)\n"
-            line += df.tail(3).to_string()
+        fields = dict(rows=len(df), columns=[str(col) for col in df.columns])
+        if message:
+            fields["message"] = message
+
+        # 期間（Date列があればその最初と最後、なければindexの最初と最後）
+        # pandasの要素アクセスは遅いので配列から取る（文字列にするのは書き込みスレッド）
+        if len(df) > 0:
+            dates = df["Date"].values if "Date" in df.columns else df.index.values
+            fields["first"] = dates[0]
+            fields["last"] = dates[-1]
+
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            fields["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
 
-        line += "\n" + f"({len(df)} rows)\n"
+        # 行の中身はDEBUGの場合のみ（文字列にするのは書き込みスレッド）
+        # dfの大きさが6以下の場合は全行、6を超える場合は最初の３行と最後の３行
+        if self.level <= self.LEVELS["DEBUG"]:
+            fields["_frame"] = (df.copy(), None) if len(df) <= 6 else (df.head(3).copy(), df.tail(3).copy())
 
-        with open(self.KABU_LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(line + "\n")
\ No newline at end of file
+        self.emit("INFO", def_name, **fields)
@@ -0,0 +1,141 @@
+import datetime as dt
+import threading
+from collections import OrderedDict
+import numpy
+import pandas
+from trading_calendar import TradingCalendar
+
+# キャッシュの1銘柄分
+# first～last（両端を含む）の期間はDBにあるデータがすべて入っていることを表す
+# 列ごとに1本の連続したnumpy配列で持ち、期間の一部を求められた場合は二分探索で切り出す
+class PriceCacheEntry:
+    def __init__(self, first: dt.date, last: dt.date, df: pandas.DataFrame):
+        self.first = first
+        self.last = last
+        self.index = pandas.DatetimeIndex(df.index).to_numpy(dtype="datetime64[ns]")
+        self.columns = {col: numpy.ascontiguousarray(df[col].to_numpy()) for col in df.columns}
+        self.nbytes = self.index.nbytes + sum(values.nbytes for values in self.columns.values())
+
+    # begin～end（両端を含む）の行をDataFrameとして返す
+    def slice(self, begin: dt.date, end: dt.date) -> pandas.DataFrame:
+        i = numpy.searchsorted(self.index, numpy.datetime64(begin, "ns"), side="left")
+        j = numpy.searchsorted(self.index, numpy.datetime64(end + dt.timedelta(days=1), "ns"), side="left")
+        return pandas.DataFrame({col: values[i:j] for col, values in self.columns.items()}, index=pandas.DatetimeIndex(self.index[i:j]))
+
+# Backend.get_priceの結果（組み立て済みのOHLCV）を銘柄と粒度ごとに持つLRUキャッシュ
+# 上限は件数ではなく配列のバイト数で決め、超えた分は最も使われていないものから捨てる
+# DB.insert_into_pricesで新しい足が書き込まれた銘柄はon_prices_insertedで破棄する
+# 破棄するたびに銘柄ごとの版を進め、読み出す前に取ったversionと違う場合はputしない
+# （読み出している間に書き込まれた場合に、古いdfを入れてしまわないようにする）
+class PriceCache:
+    # max_bytes：キャッシュ全体の上限（バイト）
+    def __init__(self, calendar: TradingCalendar, max_bytes: int = 64 * 1024 * 1024):
+        self.calendar = calendar
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple[int, str], PriceCacheEntry] = OrderedDict()
+        self._bytes = 0
+        # security_id -> 版（invalidateのたびに1つ進む）
+        self._versions: dict[int, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    # begin～endがキャッシュ済みの期間に収まっていれば切り出して返す 収まっていなければNone
+    def get(self, security_id: int, chart_granularity: str, begin: dt.date, end: dt.date) -> pandas.DataFrame | None:
+        key = (security_id, chart_granularity)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or begin < entry.first or entry.last < end:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        return entry.slice(begin, end)
+
+    # begin～endを読み出す際に、既存のキャッシュと重なるか隣り合う場合は両方を包む期間を返す
+    # その期間で読み出してputすれば、1銘柄1本の連続した配列のまま範囲を広げられる
+    def union_range(self, security_id: int, chart_granularity: str, begin: dt.date, end: dt.date) -> tuple[dt.date, dt.date]:
+        with self._lock:
+            entry = self._entries.get((security_id, chart_granularity))
+
+        if entry is None:
+            return begin, end
+
+        # 間に取引日がなければ隣り合っているとみなす
+        if self.calendar.count_sessions(entry.last + dt.timedelta(days=1), begin - dt.timedelta(days=1)) > 0:
+            return begin, end
+        if self.calendar.count_sessions(end + dt.timedelta(days=1), entry.first - dt.timedelta(days=1)) > 0:
+            return begin, end
+
+        return min(begin, entry.first), max(end, entry.last)
+
+    # 該当銘柄の版　DBから読み出す前に取っておき、putに渡す
+    def version(self, security_id: int) -> int:
+        with self._lock:
+            return self._versions.get(security_id, 0)
+
+    # first～lastのデータをすべて含むdfを格納する
+    # versionを渡した場合、その後に破棄されていれば（dfが古い可能性があるので）格納しない
+    # return：格納した場合True
+    def put(self, security_id: int, chart_granularity: str, first: dt.date, last: dt.date, df: pandas.DataFrame, version: int | None = None) -> bool:
+        entry = PriceCacheEntry(first, last, df)
+        # 1件で上限を超えるものは格納しない
+        if entry.nbytes > self.max_bytes:
+            return False
+
+        key = (security_id, chart_granularity)
+        with self._lock:
+            if version is not None and version != self._versions.get(security_id, 0):
+                return False
+
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+        return True
+
+    # 該当銘柄のキャッシュをすべての粒度について破棄する
+    def invalidate(self, security_id: int) -> None:
+        with self._lock:
+            self._versions[security_id] = self._versions.get(security_id, 0) + 1
+            for key in [key for key in self._entries if key[0] == security_id]:
+                self._bytes -= self._entries.pop(key).nbytes
+                self.invalidations += 1
+
+    # DB.add_insert_listenerに登録する
+    # キャッシュするのは日足から組み立てたものだけなので、場中に繰り返し書き込まれる分足では破棄しない
+    def on_prices_inserted(self, security_id: int, chart_granularity: str, prices: pandas.DataFrame) -> None:
+        if chart_granularity != "daily":
+            return
+        self.invalidate(security_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(
+                entries = len(self._entries),
+                bytes = self._bytes,
+                max_bytes = self.max_bytes,
+                hits = self.hits,
+                misses = self.misses,
+                evictions = self.evictions,
+                invalidations = self.invalidations,
+            )
@@ -0,0 +1,292 @@
+import datetime as dt
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+import numpy
+import pandas
+import yfinance as yf
+from trading_calendar import TradingCalendar
+from tracing import tracer
+
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+# yf.downloadで複数銘柄をまとめて取得した結果から1銘柄分を取り出す
+# 他の銘柄だけに値がある日付はすべてNaNになるので除く
+def split_download(history: pandas.DataFrame, ticker: str) -> pandas.DataFrame:
+    if history is None or history.empty:
+        return pandas.DataFrame()
+
+    if isinstance(history.columns, pandas.MultiIndex):
+        if ticker not in history.columns.get_level_values(0):
+            return pandas.DataFrame()
+        history = history[ticker]
+
+    return history.dropna(how="all", subset=["Open", "High", "Low", "Close"])
+
+# 取得元からデータを取得できなかったこと（通信エラー、回数制限など）を表す例外
+# 取得元が返した空の結果は「その期間のデータがない」（上場前・上場廃止・売買停止など）として空白期間に記録されるので、
+# 実装クラスは取得に失敗した場合に空の結果を返さずにこの例外を送出する
+class ProviderError(Exception):
+    pass
+
+# 株価の取得元の基底クラス
+# 実装クラスは_history_many、_recent、_infoを実装する（_historyは必要なら上書きする）
+# 公開メソッドはすべて呼び出し回数、所要時間、取得したデータ量を同じ形で記録する
+class PriceProvider(ABC):
+    name = "base"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict] = {}
+
+    # 1銘柄のstart～end（両端を含む）の足
+    # 戻り値のindexはタイムゾーンなしの現地時刻、列はOHLCV
+    def history(self, ticker: str, start: dt.date, end: dt.date, interval: str = "1d") -> pandas.DataFrame:
+        return self._measure("history", lambda: self.normalize(self._history(ticker, start, end, interval)))
+
+    # 複数銘柄のstart～end（両端を含む）の足を1回の取得でまとめて取る
+    # 戻り値は銘柄コードをキーにした辞書 データがない銘柄は空のDataFrame
+    def history_many(self, tickers: list[str], start: dt.date, end: dt.date, interval: str = "1d") -> dict[str, pandas.DataFrame]:
+        return self._measure("history_many", lambda: {ticker: self.normalize(df) for ticker, df in self._history_many(tickers, start, end, interval).items()})
+
+    # 複数銘柄の直近の足（period="1d"で当日分）
+    def recent(self, tickers: list[str], period: str = "1d", interval: str = "1d") -> dict[str, pandas.DataFrame]:
+        return self._measure("recent", lambda: {ticker: self.normalize(df) for ticker, df in self._recent(tickers, period, interval).items()})
+
+    # 銘柄情報（currentPriceなど）
+    def info(self, ticker: str) -> dict:
+        return self._measure("info", lambda: self._info(ticker))
+
+    def _history(self, ticker: str, start: dt.date, end: dt.date, interval: str) -> pandas.DataFrame:
+        return self._history_many([ticker], start, end, interval).get(ticker, pandas.DataFrame())
+
+    @abstractmethod
+    def _history_many(self, tickers: list[str], start: dt.date, end: dt.date, interval: str) -> dict[str, pandas.DataFrame]:
+        ...
+
+    @abstractmethod
+    def _recent(self, tickers: list[str], period: str, interval: str) -> dict[str, pandas.DataFrame]:
+        ...
+
+    @abstractmethod
+    def _info(self, ticker: str) -> dict:
+        ...
+
+    # 取得結果の形を揃える
+    # OHLCVの列だけにし、値がすべてNaNの行を除き、indexをタイムゾーンなしの現地時刻にする
+    @staticmethod
+    def normalize(df: pandas.DataFrame) -> pandas.DataFrame:
+        if df is None or df.empty:
+            return pandas.DataFrame(columns=OHLCV_COLUMNS, index=pandas.DatetimeIndex([]))
+
+        df = df[OHLCV_COLUMNS].dropna(how="all", subset=["Open", "High", "Low", "Close"])
+        index = pandas.DatetimeIndex(df.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        df.index = index
+        return df
+
+    # データ量（DataFrameはメモリ上のバイト数）
+    @staticmethod
+    def size_of(result) -> int:
+        if isinstance(result, pandas.DataFrame):
+            return int(result.memory_usage(index=True, deep=True).sum())
+        if isinstance(result, dict):
+            return sum(PriceProvider.size_of(v) for v in result.values())
+        return len(str(result))
+
+    @staticmethod
+    def rows_of(result) -> int:
+        if isinstance(result, pandas.DataFrame):
+            return len(result)
+        if isinstance(result, dict):
+            return sum(PriceProvider.rows_of(v) for v in result.values())
+        return 0
+
+    def _measure(self, method: str, func):
+        begin = time.perf_counter()
+        result = None
+        try:
+            result = func()
+            return result
+        finally:
+            elapsed = time.perf_counter() - begin
+            with self._lock:
+                stats = self._stats.setdefault(method, dict(calls=0, errors=0, seconds=0.0, max_seconds=0.0, bytes=0, rows=0))
+                stats["calls"] += 1
+                stats["seconds"] += elapsed
+                stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+                if result is None:
+                    stats["errors"] += 1
+                else:
+                    size = self.size_of(result)
+                    rows = self.rows_of(result)
+                    stats["bytes"] += size
+                    stats["rows"] += rows
+
+            if result is None:
+                tracer.add("fetch", elapsed, errors=1)
+            else:
+                tracer.add("fetch", elapsed, rows=rows, bytes=size)
+
+    # メソッドごとの呼び出し回数、所要時間、データ量
+    def metrics(self) -> dict:
+        with self._lock:
+            return {method: dict(stats) for method, stats in self._stats.items()}
+
+    def reset_metrics(self) -> None:
+        with self._lock:
+            self._stats = {}
+
+# yfinanceから取得する
+# 1銘柄の取得も複数銘柄と同じくyf.downloadで行い、取得に失敗した銘柄があればProviderErrorにする
+class YFinanceProvider(PriceProvider):
+    name = "yfinance"
+
+    # yf.downloadのエラーのうち、データがないこと（上場廃止、期間内に取引がないなど）を表すもの
+    NO_DATA_ERRORS = ("delisted", "no price data found", "no data found", "YFPricesMissingError", "YFTzMissingError")
+
+    # yfinanceのendは当日を含まないので翌日を指定する
+    def _history_many(self, tickers: list[str], start: dt.date, end: dt.date, interval: str) -> dict[str, pandas.DataFrame]:
+        history = yf.download(tickers, start=start.strftime("%Y-%m-%d"), end=(end + dt.timedelta(days=1)).strftime("%Y-%m-%d"), interval=interval,
+                              group_by="ticker", auto_adjust=True, actions=False, progress=False)
+        self.raise_download_errors(tickers)
+        return {ticker: split_download(history, ticker) for ticker in tickers}
+
+    def _recent(self, tickers: list[str], period: str, interval: str) -> dict[str, pandas.DataFrame]:
+        history = yf.download(tickers, period=period, interval=interval, group_by="ticker", auto_adjust=True, actions=False, progress=False)
+        self.raise_download_errors(tickers)
+        return {ticker: split_download(history, ticker) for ticker in tickers}
+
+    # yf.downloadは銘柄ごとの取得の失敗を例外にせず、yf.shared._ERRORS（銘柄コード -> エラーの文字列）に残して空の結果を返す
+    # データがないことを表すもの以外が残っていれば、通信エラーなどで取得できなかったものとしてProviderErrorにする
+    @classmethod
+    def raise_download_errors(cls, tickers: list[str]) -> None:
+        errors = getattr(getattr(yf, "shared", None), "_ERRORS", None) or {}
+        failed = {ticker: errors[ticker] for ticker in tickers if ticker in errors and not cls.is_no_data_error(str(errors[ticker]))}
+        if failed:
+            raise ProviderError(f"取得に失敗した銘柄があります：{failed}")
+
+    @classmethod
+    def is_no_data_error(cls, message: str) -> bool:
+        message = message.lower()
+        return any(pattern.lower() in message for pattern in cls.NO_DATA_ERRORS)
+
+    def _info(self, ticker: str) -> dict:
+        return yf.Ticker(ticker).info
+
+# ネットワークを使わないローカルの取得元（ベンチマーク、負荷試験用）
+# directoryに {ticker}.csv（Date列＋OHLCV）があればそれを返し、なければ銘柄コードから決まる合成データを返す
+# 合成データは同じ銘柄・同じ日付なら何度取得しても同じ値になる
+class LocalPriceProvider(PriceProvider):
+    name = "local"
+
+    # 取引時間（分足の合成用）
+    SESSIONS = [(dt.time(9, 0), dt.time(11, 30)), (dt.time(12, 30), dt.time(15, 30))]
+
+    # directory：CSVを置くディレクトリ（Noneの場合は常に合成データ）
+    # latency：1回の取得ごとに待つ秒数（ネットワークの遅延を模擬する）
+    def __init__(self, directory: str | Path | None = None, calendar: TradingCalendar | None = None, latency: float = 0.0, origin_year: int = 2000):
+        super().__init__()
+        self.directory = Path(directory) if directory else None
+        self.calendar = calendar if calendar is not None else TradingCalendar(origin_year)
+        self.latency = latency
+        self.origin = dt.date(origin_year, 1, 1)
+
+        self._files: dict[str, pandas.DataFrame] = {}
+        self._files_lock = threading.Lock()
+
+    def _history_many(self, tickers: list[str], start: dt.date, end: dt.date, interval: str) -> dict[str, pandas.DataFrame]:
+        self._wait()
+        return {ticker: self._bars(ticker, start, end, interval) for ticker in tickers}
+
+    def _recent(self, tickers: list[str], period: str, interval: str) -> dict[str, pandas.DataFrame]:
+        self._wait()
+        # period="1d"は直近の取引日1日分
+        end = self.calendar.previous_session(dt.date.today())
+        days = int(period[:-1]) if period.endswith("d") else 1
+        start = self.calendar.sessions_between(self.origin, end)[-days].item()
+        return {ticker: self._bars(ticker, start, end, interval) for ticker in tickers}
+
+    def _info(self, ticker: str) -> dict:
+        self._wait()
+        end = self.calendar.previous_session(dt.date.today())
+        bars = self._bars(ticker, end, end, "1d")
+        return dict(currentPrice=float(bars["Close"].iloc[-1]) if not bars.empty else None)
+
+    def _wait(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _bars(self, ticker: str, start: dt.date, end: dt.date, interval: str) -> pandas.DataFrame:
+        daily = self._read_file(ticker)
+        if daily is None:
+            daily = self._synthetic_daily(ticker, end)
+
+        daily = daily.loc[pandas.Timestamp(start):pandas.Timestamp(end)]
+        if interval == "1d":
+            return daily
+
+        return self._synthetic_intraday(ticker, daily, interval)
+
+    # {ticker}.csvを読む（一度読んだものは覚えておく）
+    def _read_file(self, ticker: str) -> pandas.DataFrame | None:
+        if self.directory is None:
+            return None
+
+        with self._files_lock:
+            if ticker not in self._files:
+                path = self.directory / f"{ticker}.csv"
+                self._files[ticker] = pandas.read_csv(path, index_col="Date", parse_dates=["Date"]).sort_index() if path.exists() else None
+            return self._files[ticker]
+
+    # origin_yearの最初の取引日からendまでの日足を、銘柄コードから決まる乱数で作る
+    def _synthetic_daily(self, ticker: str, end: dt.date) -> pandas.DataFrame:
+        sessions = self.calendar.sessions_between(self.origin, end)
+        n = len(sessions)
+        # 列ごとに別の乱数列を使い、endが変わっても同じ日付の値が変わらないようにする
+        seed = zlib.crc32(ticker.encode("utf-8"))
+        rng = [numpy.random.default_rng([seed, i]) for i in range(6)]
+
+        base = rng[0].uniform(500, 5000)
+        close = base * numpy.exp(numpy.cumsum(rng[1].normal(0.0003, 0.015, n)))
+        opens = close * numpy.exp(rng[2].normal(0, 0.005, n))
+        high = numpy.maximum(opens, close) * numpy.exp(numpy.abs(rng[3].normal(0, 0.007, n)))
+        low = numpy.minimum(opens, close) * numpy.exp(-numpy.abs(rng[4].normal(0, 0.007, n)))
+        volume = rng[5].integers(10_000, 5_000_000, n)
+
+        return pandas.DataFrame({
+            "Open": opens.round(1),
+            "High": high.round(1),
+            "Low": low.round(1),
+            "Close": close.round(1),
+            "Volume": volume,
+        }, index=pandas.DatetimeIndex(sessions))
+
+    # 日足を取引時間の分足に割り振る（1m、5mなど）
+    def _synthetic_intraday(self, ticker: str, daily: pandas.DataFrame, interval: str) -> pandas.DataFrame:
+        minutes = int(interval[:-1]) if interval.endswith("m") else 1
+        frames = []
+        for day, bar in daily.iterrows():
+            times = []
+            for open_time, close_time in self.SESSIONS:
+                times += list(pandas.date_range(dt.datetime.combine(day.date(), open_time), dt.datetime.combine(day.date(), close_time), freq=f"{minutes}min", inclusive="left"))
+            n = len(times)
+            rng = numpy.random.default_rng(zlib.crc32(f"{ticker}{day.date()}".encode("utf-8")))
+            close = numpy.linspace(bar["Open"], bar["Close"], n) + rng.normal(0, (bar["High"] - bar["Low"]) / 10, n)
+            close = numpy.clip(close, bar["Low"], bar["High"])
+            opens = numpy.concatenate(([bar["Open"]], close[:-1]))
+            frames.append(pandas.DataFrame({
+                "Open": opens.round(1),
+                "High": numpy.maximum(opens, close).round(1),
+                "Low": numpy.minimum(opens, close).round(1),
+                "Close": close.round(1),
+                "Volume": numpy.full(n, int(bar["Volume"]) // n),
+            }, index=pandas.DatetimeIndex(times)))
+
+        if not frames:
+            return pandas.DataFrame(columns=OHLCV_COLUMNS, index=pandas.DatetimeIndex([]))
+
+        return pandas.concat(frames)
@@ -0,0 +1,143 @@
+import math
+import numpy
+import pandas
+
+# 日足を週足・月足などの粗い足にまとめる
+# 行のまとまり（バケツ）の境目を配列で求め、ufunc.reduceatで列ごとに一括で集計する
+# 始値はバケツ内の最初、高値は最大、安値は最小、終値は最後、出来高は合計とする
+# 各行の日付はバケツ内の最初の取引日（DBにある日付）になるので、休場日の日付が現れることはない
+
+# 粒度（細かい順）
+GRANULARITIES = ["daily", "weekly", "monthly"]
+
+# 日付（datetime64[D]）ごとのバケツの番号
+def bucket_keys(days: numpy.ndarray, granularity: str) -> numpy.ndarray:
+    days = numpy.asarray(days, dtype="datetime64[D]")
+    if granularity == "daily":
+        return days.astype(numpy.int64)
+    if granularity == "weekly":
+        # 1970-01-01は木曜日なので、3日ずらして月曜始まりの週にする
+        return (days.astype(numpy.int64) + 3) // 7
+    if granularity == "monthly":
+        return days.astype("datetime64[M]").astype(numpy.int64)
+
+    raise ValueError(f"未対応の粒度です：{granularity}")
+
+# 各バケツの先頭の行の位置
+# keysは日付順に並んだ行のバケツの番号
+def bucket_starts(keys: numpy.ndarray) -> numpy.ndarray:
+    if len(keys) == 0:
+        return numpy.array([], dtype=numpy.intp)
+    return numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(keys) != 0) + 1))
+
+# 日付順に並んだOHLCVのdf（indexが日付）を、startsで区切ったバケツごとに1行にまとめる
+# OHLCV以外の列は集計の方法が決まらないので落とす
+def aggregate_ohlcv(df: pandas.DataFrame, starts: numpy.ndarray) -> pandas.DataFrame:
+    if len(df) == 0:
+        return df[[col for col in df.columns if col in ("Open", "High", "Low", "Close", "Volume")]]
+
+    ends = numpy.concatenate((starts[1:], [len(df)])) - 1
+    columns = {}
+    if "Open" in df.columns:
+        columns["Open"] = df["Open"].to_numpy(dtype=numpy.float64)[starts]
+    if "High" in df.columns:
+        # NaNは無視する（fmaxは片方がNaNならもう片方を返す）
+        columns["High"] = numpy.fmax.reduceat(df["High"].to_numpy(dtype=numpy.float64), starts)
+    if "Low" in df.columns:
+        columns["Low"] = numpy.fmin.reduceat(df["Low"].to_numpy(dtype=numpy.float64), starts)
+    if "Close" in df.columns:
+        columns["Close"] = df["Close"].to_numpy(dtype=numpy.float64)[ends]
+    if "Volume" in df.columns:
+        volume = df["Volume"].to_numpy()
+        if pandas.api.types.is_integer_dtype(volume.dtype):
+            columns["Volume"] = numpy.add.reduceat(volume.astype(numpy.int64), starts)
+        else:
+            columns["Volume"] = numpy.add.reduceat(numpy.nan_to_num(volume.astype(numpy.float64)), starts)
+
+    index = pandas.DatetimeIndex(df.index)[starts]
+    return pandas.DataFrame(columns, index=index)
+
+# 日足を指定した粒度の足にまとめる
+def resample_ohlcv(df: pandas.DataFrame, granularity: str) -> pandas.DataFrame:
+    if granularity == "daily":
+        return df
+
+    keys = bucket_keys(pandas.DatetimeIndex(df.index).to_numpy(dtype="datetime64[D]"), granularity)
+    return calendar_bars(aggregate_ohlcv(df, bucket_starts(keys)))
+
+# 日足以上の足の日付を0時にする（分足からまとめた場合に最初の足の時刻が残らないようにする）
+def calendar_bars(df: pandas.DataFrame) -> pandas.DataFrame:
+    df.index = pandas.DatetimeIndex(df.index).normalize()
+    return df
+
+# 日付に関係なくbars本ずつまとめる（OHLCを保ったまま行数だけを減らす）
+def downsample_ohlcv(df: pandas.DataFrame, bars: int) -> pandas.DataFrame:
+    if bars <= 1:
+        return df
+
+    return aggregate_ohlcv(df, numpy.arange(0, len(df), bars))
+
+# max_rows行以内に収まる最も細かい足にまとめ、(まとめたdf, 使った粒度)を返す
+# granularityはdfの足の粒度で、それより細かい粒度にはしない（分足など日足より細かいものは日足から試す）
+# 月足でも収まらない場合はn本ずつまとめ、粒度は"{n}sessions"（日足以外は"{n}x{granularity}"）とする
+def fit_to_rows(df: pandas.DataFrame, max_rows: int, granularity: str = "daily") -> tuple[pandas.DataFrame, str]:
+    if max_rows <= 0 or len(df) <= max_rows:
+        return df, granularity
+
+    days = pandas.DatetimeIndex(df.index).to_numpy(dtype="datetime64[D]")
+    first = GRANULARITIES.index(granularity) + 1 if granularity in GRANULARITIES else 0
+    for coarser in GRANULARITIES[first:]:
+        # バケツの数は境目の数から求まるので、まとめる前に行数が分かる
+        keys = bucket_keys(days, coarser)
+        if numpy.count_nonzero(numpy.diff(keys)) + 1 <= max_rows:
+            return calendar_bars(aggregate_ohlcv(df, bucket_starts(keys))), coarser
+
+    bars = math.ceil(len(df) / max_rows)
+    return downsample_ohlcv(df, bars), f"{bars}sessions" if granularity == "daily" else f"{bars}x{granularity}"
+
+# 足の要約（期間の騰落、高値・安値とその日付、出来高の平均、ボラティリティ）
+# まとめた足だけでは失われる情報をLLMに渡すために使う
+def summarize_ohlcv(df: pandas.DataFrame) -> dict:
+    if len(df) == 0:
+        return dict(bars=0)
+
+    index = pandas.DatetimeIndex(df.index)
+    # 分足の場合は時刻まで出す
+    date_format = "%Y-%m-%d" if (index == index.normalize()).all() else "%Y-%m-%dT%H:%M:%S"
+    close = df["Close"].to_numpy(dtype=numpy.float64)
+    high = df["High"].to_numpy(dtype=numpy.float64)
+    low = df["Low"].to_numpy(dtype=numpy.float64)
+    volume = df["Volume"].to_numpy(dtype=numpy.float64)
+
+    first_close = float(close[0])
+    last_close = float(close[-1])
+    i_high = int(numpy.nanargmax(high)) if not numpy.isnan(high).all() else None
+    i_low = int(numpy.nanargmin(low)) if not numpy.isnan(low).all() else None
+
+    # 足ごとの対数収益率の標準偏差を年率にしたもの（%）
+    # 1年あたりの足の数は期間と本数から求めるので、日足・週足・月足のどれを渡してもよい
+    returns = numpy.diff(numpy.log(close))
+    returns = returns[numpy.isfinite(returns)]
+    years = (index[-1] - index[0]).days / 365.25
+    volatility = None
+    if len(returns) > 1 and years > 0:
+        volatility = float(numpy.std(returns, ddof=1) * math.sqrt((len(df) - 1) / years) * 100)
+
+    def to_float(value, digits: int = 2):
+        return None if value is None or math.isnan(value) else round(float(value), digits)
+
+    return dict(
+        begin = index[0].strftime(date_format),
+        end = index[-1].strftime(date_format),
+        bars = len(df),
+        first_close = to_float(first_close),
+        last_close = to_float(last_close),
+        change = to_float(last_close - first_close),
+        change_pct = to_float((last_close / first_close - 1) * 100) if first_close else None,
+        high = to_float(high[i_high]) if i_high is not None else None,
+        high_date = index[i_high].strftime(date_format) if i_high is not None else None,
+        low = to_float(low[i_low]) if i_low is not None else None,
+        low_date = index[i_low].strftime(date_format) if i_low is not None else None,
+        average_volume = to_float(numpy.nanmean(volume), 0) if not numpy.isnan(volume).all() else None,
+        volatility_pct = to_float(volatility),
+    )
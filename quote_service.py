@@ -0,0 +1,155 @@
+import datetime as dt
+import threading
+import time
+import pandas
+from market_hours import MarketHours
+from trading_calendar import TradingCalendar
+
+# 現在値の取得を待っている呼び出し（同じ銘柄の取得を1回にまとめるため）
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.quote: dict | None = None
+        self.error: BaseException | None = None
+
+# 銘柄ごとの現在値（当日の足）を短い時間だけ持つキャッシュ
+# 取得は呼び出し1回分の銘柄をまとめて1回で行い（yfinanceではyf.download）、銘柄情報（stock.info）は使わない
+# 持っておく時間は市場の状態で変える
+#   取引時間中：ACTIVE_TTL_SECONDS秒
+#   引け直後：値が確定するまでCLOSE_GRACE_SECONDSの間は取引時間中と同じ
+#   それ以外（寄り付き前、昼休み、引け後、休場日）：次に取引が始まるまで
+# 同じ銘柄を同時に求められた場合は、先に始まった取得の結果を待つ
+class QuoteService:
+    ACTIVE_TTL_SECONDS = 5.0
+    CLOSE_GRACE_SECONDS = 20 * 60
+    # 他の呼び出しが始めた取得を待つ最大の秒数
+    WAIT_TIMEOUT_SECONDS = 60.0
+
+    # fetch：銘柄コードのリストを受け取り、銘柄コードをキーにした当日の足（OHLCV）の辞書を返す関数
+    def __init__(self, calendar: TradingCalendar, fetch, active_ttl: float = ACTIVE_TTL_SECONDS, close_grace: float = CLOSE_GRACE_SECONDS,
+                 wait_timeout: float = WAIT_TIMEOUT_SECONDS):
+        self.calendar = calendar
+        self.fetch = fetch
+        self.active_ttl = active_ttl
+        self.close_grace = close_grace
+        self.wait_timeout = wait_timeout
+
+        self._lock = threading.Lock()
+        # 銘柄コード -> (現在値, 期限（time.monotonic）)
+        self._quotes: dict[str, tuple[dict | None, float]] = {}
+        self._in_flight: dict[str, _InFlight] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.fetches = 0
+
+    # 複数銘柄の現在値　データが返ってこなかった銘柄はNone
+    # marketsは銘柄コードをキーにした取引時間
+    def get_many(self, tickers: list[str], markets: dict[str, MarketHours]) -> dict[str, dict | None]:
+        result: dict[str, dict | None] = {}
+        waiting: dict[str, _InFlight] = {}
+        claimed: dict[str, _InFlight] = {}
+
+        now = time.monotonic()
+        with self._lock:
+            for ticker in dict.fromkeys(tickers):
+                cached = self._quotes.get(ticker)
+                if cached is not None and now < cached[1]:
+                    result[ticker] = cached[0]
+                    self.hits += 1
+                elif ticker in self._in_flight:
+                    waiting[ticker] = self._in_flight[ticker]
+                    self.coalesced += 1
+                else:
+                    claimed[ticker] = self._in_flight[ticker] = _InFlight()
+                    self.misses += 1
+
+            if claimed:
+                self.fetches += 1
+
+        if claimed:
+            self._fetch(claimed, markets)
+
+        for ticker, flight in {**claimed, **waiting}.items():
+            if not flight.done.wait(self.wait_timeout):
+                raise TimeoutError(f"{ticker}の現在値の取得が{self.wait_timeout}秒以内に終わりませんでした")
+            if flight.error is not None:
+                raise flight.error
+            result[ticker] = flight.quote
+
+        return {ticker: result[ticker] for ticker in dict.fromkeys(tickers)}
+
+    # claimedの銘柄をまとめて取得し、キャッシュに入れて待っている呼び出しに渡す
+    # 取得や期限の計算で例外が起きても、claimedの取得中の印は必ず外して待っている呼び出しを起こす
+    def _fetch(self, claimed: dict[str, _InFlight], markets: dict[str, MarketHours]) -> None:
+        quotes: dict[str, dict | None] = {}
+        error: BaseException | None = None
+        try:
+            fetched_at = dt.datetime.now()
+            bars = self.fetch(list(claimed))
+            quotes = {ticker: self.to_quote(bars.get(ticker), fetched_at) for ticker in claimed}
+            # 取得できなかった銘柄はすぐに取り直せるように持たない
+            ttls = {ticker: self.ttl(markets[ticker]) for ticker, quote in quotes.items() if quote is not None}
+            now = time.monotonic()
+            with self._lock:
+                for ticker, ttl in ttls.items():
+                    self._quotes[ticker] = (quotes[ticker], now + ttl)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            with self._lock:
+                for ticker, flight in claimed.items():
+                    flight.error = error
+                    flight.quote = quotes.get(ticker)
+                    self._in_flight.pop(ticker, None)
+                    flight.done.set()
+
+    # 当日の足の最後の行を現在値にする
+    @staticmethod
+    def to_quote(bars: pandas.DataFrame | None, fetched_at: dt.datetime) -> dict | None:
+        if bars is None or len(bars) == 0:
+            return None
+
+        last = bars.iloc[-1]
+        return dict(
+            current = float(last["Close"]),
+            open = float(last["Open"]),
+            high = float(last["High"]),
+            low = float(last["Low"]),
+            close = float(last["Close"]),
+            volume = float(last["Volume"]),
+            date = pandas.Timestamp(bars.index[-1]).date().isoformat(),
+            fetched_at = fetched_at.isoformat(timespec="seconds"),
+        )
+
+    # 現在値を持っておく秒数
+    def ttl(self, market: MarketHours, now: dt.datetime | None = None) -> float:
+        if now is None:
+            now = dt.datetime.now(market.get_zone())
+        today = now.date()
+        elapsed = dt.timedelta(hours=now.hour, minutes=now.minute, seconds=now.second, microseconds=now.microsecond)
+        close = market.close2 or market.close1
+
+        if self.calendar.is_session(today):
+            if market.is_active(elapsed) or close <= elapsed < close + dt.timedelta(seconds=self.close_grace):
+                return self.active_ttl
+            # 寄り付き前、昼休み
+            for open_time in (market.open1, market.open2):
+                if open_time is not None and elapsed < open_time:
+                    return max(self.active_ttl, (open_time - elapsed).total_seconds())
+
+        # 次の取引日の寄り付きまで
+        next_day = self.calendar.next_session(today, inclusive=False)
+        next_open = dt.datetime.combine(next_day, dt.time(), now.tzinfo) + market.open1
+        # 同じtzinfo同士の引き算は夏時間の差を無視するのでUTCで比べる
+        return max(self.active_ttl, (next_open.astimezone(dt.timezone.utc) - now.astimezone(dt.timezone.utc)).total_seconds())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._quotes.clear()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(quotes=len(self._quotes), in_flight=len(self._in_flight), hits=self.hits, misses=self.misses, coalesced=self.coalesced, fetches=self.fetches)
@@ -0,0 +1,96 @@
+import numpy
+from indicators import INDICATOR_COLUMNS
+
+# 保存済みの指標と終値・出来高（日付×銘柄の行列）に対して、条件を全銘柄まとめて判定するスクリーナー
+# 条件は (field, op, value, within) で表す
+#   field：判定する項目（SCREEN_FIELDSのいずれか）
+#   op：比較（COMPARISONSのいずれか）またはクロス（CROSSESのいずれか）
+#   value：比べる相手　数値か、別の項目名
+#   within：クロスの場合に何本前までに起きたものを対象にするか（1の場合は最新の足のみ）
+
+# 前日比（%）は終値から求める
+SCREEN_FIELDS = ["Close", "Change_pct", "Volume"] + INDICATOR_COLUMNS
+
+COMPARISONS = {
+    ">": numpy.greater,
+    ">=": numpy.greater_equal,
+    "<": numpy.less,
+    "<=": numpy.less_equal,
+    "==": numpy.equal,
+}
+
+# cross_above：fieldがvalueを下から上に抜けた（ゴールデンクロスなど）、cross_below：上から下に抜けた
+CROSSES = ("cross_above", "cross_below")
+
+# withinの上限（全銘柄分の行列を読み込むので、1年分程度までにしておく）
+MAX_WITHIN = 250
+
+# 条件の形式を確認する　問題がある場合はValueError
+def validate_condition(field: str, op: str, value: float | str, within: int) -> None:
+    if field not in SCREEN_FIELDS:
+        raise ValueError(f"未対応の項目です：{field}（{', '.join(SCREEN_FIELDS)}のいずれか）")
+    if op not in COMPARISONS and op not in CROSSES:
+        raise ValueError(f"未対応の比較です：{op}（{', '.join(list(COMPARISONS) + list(CROSSES))}のいずれか）")
+    if isinstance(value, str) and value not in SCREEN_FIELDS:
+        raise ValueError(f"比べる相手は数値か項目名を指定してください：{value}")
+    if within < 1 or within > MAX_WITHIN:
+        raise ValueError(f"withinには1以上{MAX_WITHIN}以下を指定してください")
+
+# 条件の判定に必要な足の本数（最新の足を含む）
+def required_sessions(conditions: list[tuple[str, str, float | str, int]]) -> int:
+    # 前日比とクロスの判定には1本前の足を使う
+    return max([2] + [within + 1 for _, op, _, within in conditions if op in CROSSES])
+
+# 銘柄ごとの1本前の終値（売買停止などで間が空いた場合はその前の足の終値）の行列
+def previous_close(close: numpy.ndarray) -> numpy.ndarray:
+    previous = numpy.full_like(close, numpy.nan)
+    if len(close) > 0:
+        # 前方に埋めた終値を1行ずらす
+        valid = ~numpy.isnan(close)
+        last = numpy.where(valid, numpy.arange(len(close))[:, None], 0)
+        numpy.maximum.accumulate(last, axis=0, out=last)
+        filled = numpy.take_along_axis(close, last, axis=0)
+        filled[~numpy.take_along_axis(valid, last, axis=0)] = numpy.nan
+        previous[1:] = filled[:-1]
+    return previous
+
+# Close、Volume、INDICATOR_COLUMNSの行列に、計算で求める項目（前日比）を加える
+def derive_fields(fields: dict[str, numpy.ndarray]) -> dict[str, numpy.ndarray]:
+    close = fields["Close"]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        change_pct = (close / previous_close(close) - 1) * 100
+
+    return dict(fields, Change_pct=change_pct)
+
+# 最新の足とみなす行
+# 引け後の取り込みが途中の日を最新として扱わないように、最も銘柄数が多い日の半分以上の銘柄がそろっている最後の日とする
+def latest_row(fields: dict[str, numpy.ndarray]) -> int | None:
+    counts = (~numpy.isnan(fields["Close"])).sum(axis=1)
+    if len(counts) == 0 or counts.max() == 0:
+        return None
+
+    return int(numpy.flatnonzero(counts * 2 >= counts.max())[-1])
+
+# row行目（最新の足）で全条件を満たす銘柄の真偽値の配列
+def evaluate(fields: dict[str, numpy.ndarray], conditions: list[tuple[str, str, float | str, int]], row: int) -> numpy.ndarray:
+    matched = numpy.ones(fields["Close"].shape[1], dtype=bool)
+    for field, op, value, within in conditions:
+        a = fields[field]
+        b = fields[value] if isinstance(value, str) else numpy.full_like(a, float(value))
+
+        # NaNとの比較は常にFalseになるので、値がない銘柄は条件を満たさない
+        with numpy.errstate(invalid="ignore"):
+            if op in COMPARISONS:
+                matched &= COMPARISONS[op](a[row], b[row])
+                continue
+
+            # within本前までのいずれかの足で抜けていればよい
+            crossed = numpy.zeros_like(matched)
+            for t in range(max(1, row - within + 1), row + 1):
+                if op == "cross_above":
+                    crossed |= (a[t - 1] <= b[t - 1]) & (a[t] > b[t])
+                else:
+                    crossed |= (a[t - 1] >= b[t - 1]) & (a[t] < b[t])
+            matched &= crossed
+
+    return matched
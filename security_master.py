@@ -0,0 +1,117 @@
+import threading
+import time
+from typing import NamedTuple
+from market_hours import MarketHours
+
+# securitiesテーブルの1銘柄分
+class SecurityEntry(NamedTuple):
+    security_id: int
+    market_id: int
+    name: str
+
+# 読み込んだマスタ一式（refreshのたびに丸ごと作り直し、1回の代入で差し替える）
+class MasterSnapshot(NamedTuple):
+    securities: dict[str, SecurityEntry]
+    tickers: dict[int, str]
+    markets: dict[int, MarketHours]
+    loaded_at: float | None
+
+# securities、marketsのマスタをメモリ上に持つキャッシュ
+# どちらもinit.sqlで一度読み込まれるだけの静的なデータなので、
+# 銘柄の存在確認や取引時間の判定はDBに問い合わせずに辞書の参照で済ませる
+# 初回参照時に読み込み、ttl_secondsを過ぎるかrefresh()を呼ぶと読み直す
+class SecurityMaster:
+    # fetchall：SQLを受け取って全行を返す関数（DB.fetchall）
+    # ttl_seconds：0以下の場合は期限切れによる読み直しをしない
+    def __init__(self, fetchall, ttl_seconds: float = 3600.0):
+        self.fetchall = fetchall
+        self.ttl_seconds = ttl_seconds
+
+        # ensure_loadedの中からrefreshを呼ぶのでRLockにする
+        self._lock = threading.RLock()
+        self._snapshot = MasterSnapshot({}, {}, {}, None)
+
+    # DBからマスタを読み直す
+    def refresh(self) -> None:
+        with self._lock:
+            securities = self.fetchall("""
+                SELECT code, id, market_id, name
+                FROM securities
+            """)
+            markets = self.fetchall("""
+                SELECT id, timezone, open1, close1, open2, close2
+                FROM markets
+            """)
+
+            # 参照中の辞書は書き換えず、3つの辞書をすべて作ってから1回の代入で差し替える
+            # （銘柄だけ新しく市場が古い、のような組み合わせを読む側から見えないようにする）
+            self._snapshot = MasterSnapshot(
+                securities = {code: SecurityEntry(security_id, market_id, name) for code, security_id, market_id, name in securities},
+                tickers = {security_id: code for code, security_id, _, _ in securities},
+                markets = {row[0]: MarketHours.from_row(row[1:]) for row in markets},
+                loaded_at = time.monotonic(),
+            )
+
+    def is_expired(self) -> bool:
+        loaded_at = self._snapshot.loaded_at
+        if loaded_at is None:
+            return True
+
+        if self.ttl_seconds <= 0:
+            return False
+
+        return time.monotonic() - loaded_at > self.ttl_seconds
+
+    # 未読み込みか期限切れの場合のみ読み込み、読み込み済みのマスタ一式を返す
+    def ensure_loaded(self) -> MasterSnapshot:
+        if not self.is_expired():
+            return self._snapshot
+
+        with self._lock:
+            # 待っている間に他のスレッドが読み込んでいれば何もしない
+            if self.is_expired():
+                self.refresh()
+            return self._snapshot
+
+    # 該当tickerの銘柄情報 未登録の場合はNone
+    def get(self, ticker: str) -> SecurityEntry | None:
+        if not ticker:
+            return None
+
+        return self.ensure_loaded().securities.get(ticker)
+
+    # 該当tickerのsecurity_id 未登録の場合はNone
+    def get_security_id(self, ticker: str) -> int | None:
+        entry = self.get(ticker)
+        if entry is None:
+            return None
+
+        return entry.security_id
+
+    # 該当security_idのticker 未登録の場合はNone
+    def get_ticker(self, security_id: int) -> str | None:
+        return self.ensure_loaded().tickers.get(security_id)
+
+    # 該当tickerの銘柄名 未登録の場合はNone
+    def get_name(self, ticker: str) -> str | None:
+        entry = self.get(ticker)
+        if entry is None:
+            return None
+
+        return entry.name
+
+    # 該当市場の取引時間
+    def get_market(self, market_id: int) -> MarketHours | None:
+        return self.ensure_loaded().markets.get(market_id)
+
+    # 該当tickerが上場している市場の取引時間 未登録の場合はNone
+    def get_market_hours(self, ticker: str) -> MarketHours | None:
+        entry = self.get(ticker)
+        if entry is None:
+            return None
+
+        return self.get_market(entry.market_id)
+
+    # 登録済みの全ticker
+    def tickers(self) -> list[str]:
+        return list(self.ensure_loaded().securities.keys())
@@ -0,0 +1,181 @@
+import datetime as dt
+from contextlib import contextmanager
+from database import CountingCursor
+
+# DB.poolの代わりに差し込むスタブ
+# pricesの日足（security_id -> {date: (open, high, low, close, volume)}）と空白期間をメモリ上に持ち、
+# DBクラスが発行するSQLのうち日足の読み書き（週足・月足の集計を含む）に使うものだけを文の形で見分けて答える
+# 発行したSQLはqueriesに残るので、呼び出し1回あたりのクエリ数を確かめられる（CountingCursorの件数にも加える）
+class StubDatabase:
+    def __init__(self, securities: list[tuple[str, int, int, str]], markets: list[tuple]):
+        self.securities = securities
+        self.markets = markets
+        self.prices: dict[int, dict[dt.date, tuple]] = {}
+        self.empty_spans: dict[int, dict[dt.date, tuple]] = {}
+        self.queries: list[str] = []
+
+    @contextmanager
+    def connection(self):
+        yield StubConnection(self)
+
+    def reset_queries(self) -> None:
+        self.queries.clear()
+
+    # 発行したSQLの種類（先頭の語と対象のテーブル）
+    def kinds(self) -> list[str]:
+        return [self.kind(sql) for sql in self.queries]
+
+    @staticmethod
+    def kind(sql: str) -> str:
+        sql = " ".join(sql.split())
+        if sql.startswith("START TRANSACTION"):
+            return "begin"
+        if sql.startswith("DELETE"):
+            return "delete"
+        if "MIN(date), MAX(date), COUNT(*)" in sql:
+            return "coverage"
+        if sql.startswith("INSERT INTO prices"):
+            return "insert"
+        if sql.startswith("INSERT INTO price_empty_spans"):
+            return "insert_empty_spans"
+        if "FROM price_empty_spans" in sql:
+            return "empty_spans"
+        if "FROM prices" in sql and sql.startswith("SELECT date"):
+            return "dates"
+        if "FROM prices" in sql:
+            return "select"
+        if "FROM securities" in sql or "FROM markets" in sql:
+            return "master"
+        return sql
+
+    def execute(self, sql: str, params) -> list[tuple]:
+        self.queries.append(sql)
+        CountingCursor.count_query()
+        kind = self.kind(sql)
+        if kind == "master":
+            return list(self.securities) if "FROM securities" in sql else list(self.markets)
+        # 複数銘柄（security_id IN (...)）の場合は先頭の列にsecurity_idを付け、データがない銘柄の行は返さない
+        many = "security_id IN" in sql
+        if kind == "coverage":
+            if many:
+                begin, end, *ids = params
+                return [(security_id, *self.coverage(security_id, begin, end)) for security_id in ids if self.prices.get(security_id)]
+            begin, end, security_id = params
+            return [self.coverage(security_id, begin, end)]
+        if kind == "select":
+            if many:
+                *ids, begin, end = params
+            else:
+                security_id, begin, end = params
+                ids = [security_id]
+            result = []
+            for security_id in ids:
+                rows = self.prices.get(security_id, {})
+                if "GROUP BY" in sql:
+                    values = self.aggregate(sql, rows, begin, end)
+                else:
+                    values = [((d - dt.date(1970, 1, 1)).days, *[float("nan") if v is None else float(v) for v in rows[d]]) for d in sorted(rows) if begin <= d <= end]
+                result += [(security_id, *row) for row in values] if many else values
+            return result
+        if kind == "dates":
+            security_id, begin, end = params
+            return [(d,) for d in sorted(self.prices.get(security_id, {})) if begin <= d <= end]
+        if kind == "empty_spans":
+            (security_id,) = params
+            return [span for _, span in sorted(self.empty_spans.get(security_id, {}).items())]
+        # 指標の計算状態の破棄などはpricesに関係しないので何もしない
+        if kind in ("begin", "delete"):
+            return []
+        raise NotImplementedError(sql)
+
+    def coverage(self, security_id: int, begin: dt.date | None, end: dt.date | None) -> tuple:
+        dates = sorted(self.prices.get(security_id, {}))
+        if not dates:
+            return (None, None, 0, 0)
+        in_range = sum(1 for d in dates if begin is not None and begin <= d <= end)
+        return (dates[0], dates[-1], len(dates), in_range)
+
+    # 週足・月足の集計（DB.PRICE_BUCKETSのMySQLの式をPythonで計算する）
+    # YEARWEEK(date, 3)はISO 8601の週（月曜始まり）で、年は週の属する年になる
+    @staticmethod
+    def bucket(sql: str, date: dt.date) -> int:
+        if "YEARWEEK(date, 3)" in sql:
+            year, week, _ = date.isocalendar()
+            return year * 100 + week
+        if "YEAR(date) * 100 + MONTH(date)" in sql:
+            return date.year * 100 + date.month
+        raise NotImplementedError(sql)
+
+    def aggregate(self, sql: str, rows: dict[dt.date, tuple], begin: dt.date, end: dt.date) -> list[tuple]:
+        buckets: dict[int, list[tuple]] = {}
+        for d in sorted(rows):
+            if begin <= d <= end:
+                buckets.setdefault(self.bucket(sql, d), []).append((d, *rows[d]))
+        # NULLの扱いはDB.PRICE_AGGREGATE_COLUMNSの式に合わせる（MAX・MIN・SUMはNULLを除き、SUMはCOALESCEで0にする）
+        def value(v) -> float:
+            return float("nan") if v is None else float(v)
+
+        def non_null(bucket: list[tuple], col: int) -> list[float]:
+            return [float(row[col]) for row in bucket if row[col] is not None]
+
+        result = []
+        for _, bucket in sorted(buckets.items()):
+            highs, lows = non_null(bucket, 2), non_null(bucket, 3)
+            result.append((
+                (bucket[0][0] - dt.date(1970, 1, 1)).days,
+                value(bucket[0][1]),
+                max(highs) if highs else float("nan"),
+                min(lows) if lows else float("nan"),
+                value(bucket[-1][4]),
+                float(sum(non_null(bucket, 5))),
+            ))
+        return result
+
+    def executemany(self, sql: str, rows: list[tuple]) -> None:
+        self.queries.append(sql)
+        CountingCursor.count_query()
+        kind = self.kind(sql)
+        if kind == "insert":
+            for security_id, date, _, *ohlcv in rows:
+                self.prices.setdefault(security_id, {})[date] = tuple(ohlcv)
+        elif kind == "insert_empty_spans":
+            for security_id, first, last, checked_at in rows:
+                old = self.empty_spans.setdefault(security_id, {}).get(first)
+                last = max(last, old[1]) if old is not None else last
+                self.empty_spans[security_id][first] = (first, last, checked_at)
+        else:
+            raise NotImplementedError(sql)
+
+class StubConnection:
+    def __init__(self, database: StubDatabase):
+        self.database = database
+
+    def cursor(self, cursorclass=None):
+        return StubCursor(self.database)
+
+    def commit(self) -> None:
+        pass
+
+class StubCursor:
+    def __init__(self, database: StubDatabase):
+        self.database = database
+        self.rows: list[tuple] = []
+
+    def execute(self, sql: str, params=()):
+        self.rows = self.database.execute(sql, params)
+
+    def executemany(self, sql: str, rows: list[tuple]):
+        self.database.executemany(sql, rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return tuple(self.rows)
+
+    def fetchmany(self, size: int):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self) -> None:
+        pass
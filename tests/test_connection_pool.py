@@ -0,0 +1,169 @@
+import threading
+import time
+import pytest
+from connection_pool import ConnectionPool
+
+# MySQLdbの接続の代わりに使う接続
+# alive：pingが成功するかどうか　rollback_fails：rollbackが失敗するかどうか
+class FakeConnection:
+    def __init__(self, number: int):
+        self.number = number
+        self.alive = True
+        self.rollback_fails = False
+        self.rollbacks = 0
+        self.closed = False
+
+    def ping(self):
+        if not self.alive:
+            raise OSError("MySQL server has gone away")
+
+    def rollback(self):
+        self.rollbacks += 1
+        if self.rollback_fails:
+            raise OSError("Lost connection to MySQL server")
+
+    def close(self):
+        self.closed = True
+
+# 作った接続を順に覚えておく接続の作成関数
+class FakeFactory:
+    def __init__(self):
+        self.connections: list[FakeConnection] = []
+
+    def __call__(self) -> FakeConnection:
+        conn = FakeConnection(len(self.connections))
+        self.connections.append(conn)
+        return conn
+
+def borrow(pool: ConnectionPool):
+    with pool.connection() as conn:
+        return conn
+
+# 同じスレッドの入れ子の呼び出しは外側の接続を使い回し、別のスレッドには別の接続を貸す
+def test_nested_calls_reuse_connection_per_thread():
+    factory = FakeFactory()
+    pool = ConnectionPool(factory, max_size=2)
+    other = []
+
+    with pool.connection() as outer:
+        with pool.connection() as inner:
+            assert inner is outer
+            thread = threading.Thread(target=lambda: other.append(borrow(pool)))
+            thread.start()
+            thread.join()
+        # 内側を抜けても外側の接続は返却されない
+        assert pool.metrics()["in_use"] == 1
+
+    assert other[0] is not outer
+    metrics = pool.metrics()
+    assert (metrics["size"], metrics["idle"], metrics["in_use"], metrics["checkouts"], metrics["created"], metrics["waits"]) == (2, 2, 0, 2, 2, 0)
+
+# 空きがなければcheckout_timeout秒まで待ってTimeoutErrorにする
+def test_checkout_times_out_when_pool_is_exhausted():
+    pool = ConnectionPool(FakeFactory(), max_size=1, checkout_timeout=0.05)
+    errors = []
+
+    def checkout():
+        try:
+            borrow(pool)
+        except TimeoutError as e:
+            errors.append(e)
+
+    with pool.connection():
+        thread = threading.Thread(target=checkout)
+        thread.start()
+        thread.join()
+
+    assert len(errors) == 1
+    assert pool.metrics()["checkouts"] == 1
+    assert pool.metrics()["in_use"] == 0
+
+# 待っている間に返却されれば、その接続を借りて待った時間を記録する
+def test_waiting_checkout_gets_returned_connection():
+    factory = FakeFactory()
+    pool = ConnectionPool(factory, max_size=1, checkout_timeout=5.0)
+    borrowed = []
+
+    with pool.connection() as conn:
+        thread = threading.Thread(target=lambda: borrowed.append(borrow(pool)))
+        thread.start()
+        # 借りる側が待ち始めるまで少し待つ
+        time.sleep(0.05)
+    thread.join()
+
+    assert borrowed == [conn]
+    metrics = pool.metrics()
+    assert metrics["waits"] == 1
+    assert metrics["max_wait_time"] > 0
+    assert metrics["created"] == 1
+
+# しばらく使われていなかった接続はpingで確かめ、応答しなければ閉じて作り直す
+def test_idle_connection_failing_ping_is_replaced():
+    factory = FakeFactory()
+    pool = ConnectionPool(factory, max_idle_seconds=-1)
+    first = borrow(pool)
+    first.alive = False
+
+    second = borrow(pool)
+
+    assert second is not first
+    assert first.closed
+    metrics = pool.metrics()
+    assert (metrics["pings"], metrics["discarded"], metrics["created"], metrics["size"]) == (1, 1, 2, 1)
+
+# 生存確認はmax_idle_secondsより長く使われていなかった接続だけに行う
+def test_recently_used_connection_is_not_pinged():
+    pool = ConnectionPool(FakeFactory(), max_idle_seconds=60.0)
+    first = borrow(pool)
+    first.alive = False
+
+    assert borrow(pool) is first
+    assert pool.metrics()["pings"] == 0
+
+# 例外で抜けた場合はロールバックし、成功すれば接続をプールに戻す
+def test_exception_rolls_back_and_keeps_connection():
+    pool = ConnectionPool(FakeFactory())
+
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            raise ValueError()
+
+    assert conn.rollbacks == 1
+    assert not conn.closed
+    assert borrow(pool) is conn
+    assert pool.metrics()["discarded"] == 0
+
+# ロールバックにも失敗した接続は壊れているので閉じて枠を空ける
+def test_failed_rollback_discards_connection():
+    factory = FakeFactory()
+    pool = ConnectionPool(factory, max_size=1, checkout_timeout=0.05)
+
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            conn.rollback_fails = True
+            raise ValueError()
+
+    assert conn.closed
+    metrics = pool.metrics()
+    assert (metrics["size"], metrics["idle"], metrics["in_use"], metrics["discarded"]) == (0, 0, 0, 1)
+    # 空いた枠で新しい接続を作れる
+    assert borrow(pool) is not conn
+    assert len(factory.connections) == 2
+
+# 接続を作れなかった場合も枠を空ける
+def test_factory_error_frees_slot():
+    factory = FakeFactory()
+    calls = []
+
+    def flaky():
+        calls.append(None)
+        if len(calls) == 1:
+            raise OSError("Can't connect to MySQL server")
+        return factory()
+
+    pool = ConnectionPool(flaky, max_size=1, checkout_timeout=0.05)
+    with pytest.raises(OSError):
+        borrow(pool)
+
+    assert borrow(pool) is factory.connections[0]
+    assert pool.metrics()["size"] == 1
@@ -0,0 +1,189 @@
+import datetime as dt
+import types
+import numpy
+import pandas
+import pytest
+from eod_scheduler import EodScheduler, HotList
+from fetch_planner import FetchPlanner
+from market_hours import MarketHours
+from trading_calendar import TradingCalendar
+
+calendar = TradingCalendar(2024, 2025)
+market = MarketHours.from_row(("Asia/Tokyo", dt.timedelta(hours=9), dt.timedelta(hours=11, minutes=30), dt.timedelta(hours=12, minutes=30), dt.timedelta(hours=15, minutes=30)))
+SESSION = dt.date(2024, 6, 28)
+
+@pytest.fixture(autouse=True)
+def after_close(monkeypatch):
+    monkeypatch.setattr(MarketHours, "today", lambda self: SESSION)
+    monkeypatch.setattr(MarketHours, "now", lambda self: dt.timedelta(hours=16, minutes=30))
+
+def bars(start: dt.date, end: dt.date) -> pandas.DataFrame:
+    days = calendar.sessions_between(start, end)
+    close = numpy.arange(1.0, len(days) + 1)
+    return pandas.DataFrame(dict(Open=close, High=close, Low=close, Close=close, Volume=close), index=pandas.DatetimeIndex(days))
+
+# 取得元：failuresの回数だけ失敗し、emptyの銘柄は空のDataFrameを返す
+class FakeProvider:
+    def __init__(self, failures: int = 0, empty: set[str] = set()):
+        self.failures = failures
+        self.empty = empty
+        self.calls = []
+
+    def history_many(self, tickers, start, end):
+        self.calls.append((list(tickers), start, end))
+        if self.failures > 0:
+            self.failures -= 1
+            raise RuntimeError("rate limited")
+        return {ticker: bars(start, end).iloc[0:0] if ticker in self.empty else bars(start, end) for ticker in tickers}
+
+class Cache:
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, security_id, granularity, begin, end):
+        return self.entries.get(security_id)
+
+    def version(self, security_id):
+        return 0
+
+    def put(self, security_id, granularity, begin, end, df, version=None):
+        self.entries[security_id] = df
+        return True
+
+# stored：銘柄コード -> 格納済みの最後の日（データがない場合はNone）　格納すると更新する
+# データが返ってこなかった取引日は確認済みの空白期間（empty_spans）になり、plan_price_gapsの欠けに含めない
+def make_backend(provider: FakeProvider, stored: dict[str, dt.date | None]):
+    inserted = {}
+    aggregated = []
+    stored = dict(stored)
+    empty_spans: dict[int, set] = {}
+
+    def coverage(ticker):
+        return types.SimpleNamespace(security_id=ord(ticker), end_date=stored[ticker])
+
+    db = types.SimpleNamespace(
+        fetchall = lambda sql, params=(): [(ticker,) for ticker in stored],
+        get_market_hours = lambda ticker: market,
+        is_ticker_exists = lambda ticker: True,
+        get_security_id = lambda ticker: ord(ticker),
+        get_price_coverages = lambda tickers, begin=None, end=None: {ticker: coverage(ticker) for ticker in tickers},
+        select_from_prices = lambda ticker, begin, end, granularity: bars(begin, end),
+    )
+
+    def store_fetched_prices(ticker, security_id, history, missing, last_final, granularity, stored_end=None):
+        inserted[ticker] = (missing[0].item(), missing[-1].item(), 0 if history is None else len(history))
+        if history is not None and len(history) > 0:
+            stored[ticker] = max(history.index).date()
+        else:
+            empty_spans.setdefault(security_id, set()).update(missing.tolist())
+        return 0 if history is None else len(history)
+
+    # 格納済みの最後の日より後で、確認済みの空白期間でない取引日
+    def plan_price_gaps(coverage, begin, end, last_final):
+        if coverage.end_date is not None:
+            begin = max(begin, calendar.next_session(coverage.end_date, inclusive=False))
+        sessions = calendar.sessions_between(begin, end)
+        return sessions[~numpy.isin(sessions.tolist(), list(empty_spans.get(coverage.security_id, ())))]
+
+    backend = types.SimpleNamespace(
+        db = db,
+        calendar = calendar,
+        planner = FetchPlanner(calendar),
+        provider = provider,
+        price_cache = Cache(),
+        column_store = None,
+        indicators = types.SimpleNamespace(get_state=lambda security_id: None),
+        aggregator = types.SimpleNamespace(update_all=lambda begin, end: aggregated.append((begin, end))),
+        hot_list = HotList(),
+        store_fetched_prices = store_fetched_prices,
+        plan_price_gaps = plan_price_gaps,
+    )
+    return backend, inserted, aggregated
+
+def scheduler(backend, mode: str = "universe", **kwargs) -> EodScheduler:
+    log = types.SimpleNamespace(records=[])
+    log.emit = lambda level, call, **fields: log.records.append((level, call))
+    return EodScheduler(backend, mode, workers=2, batch_size=2, rate_per_second=1000, backoff_seconds=0.001, log=log, **kwargs)
+
+# 格納済みの最後の日の翌取引日から取得し、データがない銘柄はMAX_CATCHUP_SESSIONSまでさかのぼる
+def test_catch_up_from_last_stored_session():
+    backend, inserted, aggregated = make_backend(FakeProvider(), {"A": dt.date(2024, 6, 20), "B": None, "C": SESSION})
+    s = scheduler(backend)
+
+    assert list(s.due()) == [market]
+    s.run_once()
+
+    floor = calendar.sessions_between(SESSION - dt.timedelta(days=30), SESSION)[-EodScheduler.MAX_CATCHUP_SESSIONS].item()
+    assert inserted["A"][:2] == (dt.date(2024, 6, 21), SESSION)
+    assert inserted["B"][:2] == (floor, SESSION)
+    assert "C" not in inserted
+    assert len(aggregated) == 1
+    assert s.due() == {}
+
+# 例外で失敗した場合は間隔を空けて取り直す
+def test_retry_after_errors():
+    provider = FakeProvider(failures=2)
+    backend, inserted, _ = make_backend(provider, {"A": dt.date(2024, 6, 20)})
+    s = scheduler(backend)
+
+    s.run_once()
+
+    assert s.retries == 2 and s.errors == 0
+    assert inserted["A"][2] == len(calendar.sessions_between(dt.date(2024, 6, 21), SESSION))
+    assert s.due() == {}
+
+# バッチの全銘柄が空の場合（上場廃止・売買停止中の銘柄ばかり）は失敗ではないので取り直さず、空白期間として記録して済ませる
+# 次の取引日は確認済みの空白期間を除いて欠けている日（その日の分）だけを取る
+def test_all_empty_batch_is_not_a_failure(monkeypatch):
+    provider = FakeProvider(empty={"A", "B"})
+    backend, inserted, aggregated = make_backend(provider, {"A": dt.date(2024, 6, 20), "B": dt.date(2024, 6, 20)})
+    s = scheduler(backend, max_retries=2)
+
+    s.run_once()
+
+    assert len(provider.calls) == 1
+    assert s.errors == 0 and s.retries == 0
+    assert set(inserted) == {"A", "B"}
+    assert len(aggregated) == 1
+    assert s.due() == {}
+
+    next_session = dt.date(2024, 7, 1)
+    monkeypatch.setattr(MarketHours, "today", lambda self: next_session)
+    provider.calls.clear()
+    s.run_once()
+    assert provider.calls == [(["A", "B"], next_session, next_session)]
+
+# 例外で失敗したバッチがあっても、取得できた銘柄の集計は止めない（済ませたことにはせず取り直す）
+def test_failed_batch_does_not_block_aggregates():
+    provider = FakeProvider(failures=100)
+    backend, inserted, aggregated = make_backend(provider, {"A": dt.date(2024, 6, 20)})
+    s = scheduler(backend, max_retries=1)
+
+    s.run_once()
+
+    assert s.errors == 1
+    assert inserted == {}
+    assert len(aggregated) == 1
+    assert list(s.due()) == [market]
+
+# hotの場合は格納済みだった銘柄と今回格納できた銘柄だけを温める
+def test_warm_only_stored_tickers():
+    provider = FakeProvider(empty={"B"})
+    backend, _, _ = make_backend(provider, {"A": dt.date(2024, 6, 20), "B": dt.date(2024, 6, 20), "C": SESSION})
+    backend.hot_list.touch(["A", "B", "C"])
+    s = scheduler(backend, mode="hot")
+
+    s.run_once()
+
+    assert set(backend.price_cache.entries) == {ord("A"), ord("C")}
+
+# 欠けている取引日が残っている銘柄は温めない
+def test_warm_skips_tickers_with_gaps():
+    backend, _, _ = make_backend(FakeProvider(), {"A": SESSION, "B": SESSION})
+    backend.plan_price_gaps = lambda coverage, begin, end, last_final: numpy.array([SESSION], dtype="datetime64[D]") if coverage.security_id == ord("B") else numpy.array([], dtype="datetime64[D]")
+    backend.hot_list.touch(["A", "B"])
+    s = scheduler(backend, mode="hot")
+
+    s.run_once()
+
+    assert set(backend.price_cache.entries) == {ord("A")}
@@ -0,0 +1,80 @@
+import datetime as dt
+import numpy
+from trading_calendar import TradingCalendar
+from fetch_planner import FetchPlanner
+
+calendar = TradingCalendar(2023, 2025)
+
+def sessions(first: str, last: str) -> numpy.ndarray:
+    return calendar.sessions_between(dt.date.fromisoformat(first), dt.date.fromisoformat(last))
+
+# 取得元が何も返さなかった期間も空白期間として記録する（取得の失敗は例外になるので空の結果はデータがないもの）
+def test_empty_fetch_records_spans():
+    planner = FetchPlanner(calendar)
+    missing = sessions("2024-01-04", "2024-03-29")
+    assert planner.empty_spans_after_fetch(missing, numpy.array([], dtype="datetime64[D]"), dt.date(2024, 6, 28)) == [(dt.date(2024, 1, 4), dt.date(2024, 3, 29))]
+
+# 取得できた日の間の抜けに加え、その前（上場前）と後（上場廃止・売買停止）も記録する
+def test_spans_include_edges():
+    planner = FetchPlanner(calendar)
+    missing = sessions("2024-01-04", "2024-03-29")
+    fetched = numpy.concatenate([sessions("2024-02-01", "2024-02-09"), sessions("2024-02-26", "2024-02-29")])
+
+    spans = planner.empty_spans_after_fetch(missing, fetched, dt.date(2024, 6, 28))
+
+    assert spans == [
+        (dt.date(2024, 1, 4), dt.date(2024, 1, 31)),
+        (dt.date(2024, 2, 13), dt.date(2024, 2, 22)),
+        (dt.date(2024, 3, 1), dt.date(2024, 3, 29)),
+    ]
+
+# 直近EMPTY_SPAN_GRACE_DAYS日分は、最近まで取引があった銘柄（反映の遅れ）と取引があったか分からない銘柄では記録しない
+# 最後の取引がそれより前の銘柄（上場廃止・売買停止中）は最後の確定日まで記録する
+def test_recent_sessions_depend_on_last_trade():
+    planner = FetchPlanner(calendar)
+    last_final = dt.date(2024, 6, 28)
+    missing = sessions("2024-06-03", "2024-06-28")
+    nothing = numpy.array([], dtype="datetime64[D]")
+    cutoff = last_final - dt.timedelta(days=FetchPlanner.EMPTY_SPAN_GRACE_DAYS)
+
+    recent = planner.empty_spans_after_fetch(missing, sessions("2024-06-03", "2024-06-24"), last_final)
+    assert recent == []
+    unknown = planner.empty_spans_after_fetch(missing, nothing, last_final)
+    assert unknown[-1][1] < cutoff
+
+    assert planner.empty_spans_after_fetch(missing, nothing, last_final, dt.date(2024, 5, 31)) == [(dt.date(2024, 6, 3), last_final)]
+    assert planner.empty_spans_after_fetch(missing, sessions("2024-06-03", "2024-06-07"), last_final) == [(dt.date(2024, 6, 10), last_final)]
+
+# 確認してからEMPTY_SPAN_RECHECK_DAYS日を過ぎた空白期間と、確認した日がない空白期間は取得し直す
+def test_stale_spans_are_expected_again():
+    planner = FetchPlanner(calendar)
+    today = dt.date(2024, 6, 28)
+    planner.set_empty_spans(1, [(dt.date(2024, 2, 13), dt.date(2024, 2, 22), today - dt.timedelta(days=1))])
+    planner.set_empty_spans(2, [(dt.date(2024, 2, 13), dt.date(2024, 2, 22), today - dt.timedelta(days=FetchPlanner.EMPTY_SPAN_RECHECK_DAYS + 1))])
+    planner.set_empty_spans(3, [(dt.date(2024, 2, 13), dt.date(2024, 2, 22), None)])
+
+    first, last = dt.date(2024, 2, 1), dt.date(2024, 2, 29)
+    assert len(planner.expected_sessions(1, first, last, today)) == len(sessions("2024-02-01", "2024-02-29")) - len(sessions("2024-02-13", "2024-02-22"))
+    assert len(planner.expected_sessions(2, first, last, today)) == len(sessions("2024-02-01", "2024-02-29"))
+    assert len(planner.expected_sessions(3, first, last, today)) == len(sessions("2024-02-01", "2024-02-29"))
+
+# 確認し直した空白期間は確認した日を更新する
+def test_add_empty_spans_refreshes_checked_at():
+    planner = FetchPlanner(calendar)
+    planner.set_empty_spans(1, [(dt.date(2024, 2, 13), dt.date(2024, 2, 20), None)])
+    planner.add_empty_spans(1, [(dt.date(2024, 2, 13), dt.date(2024, 2, 22), dt.date(2024, 6, 28))])
+
+    assert planner.get_empty_spans(1) == [(dt.date(2024, 2, 13), dt.date(2024, 2, 22), dt.date(2024, 6, 28))]
+
+# 間の格納済みの取引日がMAX_STORED_GAP_SESSIONS日以下のウィンドウはまとめ、それより離れたものは別々に取る
+def test_fetch_windows_split_far_apart_gaps():
+    planner = FetchPlanner(calendar)
+    gap = FetchPlanner.MAX_STORED_GAP_SESSIONS
+    days = sessions("2024-03-01", "2024-06-28")
+    # days[0]とdays[gap + 1]の間はgap日、days[gap + 1]とdays[2 * gap + 3]の間はgap + 1日
+    missing = days[[0, gap + 1, 2 * gap + 3]]
+
+    assert planner.fetch_windows(missing) == [
+        (days[0].item(), days[gap + 1].item()),
+        (days[2 * gap + 3].item(), days[2 * gap + 3].item()),
+    ]
@@ -0,0 +1,233 @@
+import datetime as dt
+import numpy
+import pandas
+import pytest
+
+pytest.importorskip("MySQLdb")
+pytest.importorskip("yfinance")
+pytest.importorskip("pandas_ta_classic")
+
+import kabu
+from database import DB
+from stub_db import StubDatabase
+from tracing import tracer
+from price_resampler import bucket_keys
+
+TICKER = "7203.T"
+SECURITY_ID = 1
+
+def bars(sessions: numpy.ndarray) -> pandas.DataFrame:
+    close = numpy.arange(1.0, len(sessions) + 1)
+    return pandas.DataFrame(dict(Open=close, High=close + 1, Low=close - 1, Close=close, Volume=(close * 100).astype(numpy.int64)), index=pandas.DatetimeIndex(sessions))
+
+# 取得元：holesの取引日は返さない
+class FakeProvider:
+    def __init__(self, holes: set[dt.date] = set()):
+        self.holes = holes
+        self.calls = []
+
+    def history(self, ticker, start, end):
+        self.calls.append((ticker, start, end))
+        sessions = kabu.Backend.calendar.sessions_between(start, end)
+        sessions = sessions[~numpy.isin(sessions, numpy.array(sorted(self.holes), dtype="datetime64[D]"))]
+        return bars(sessions)
+
+    def history_many(self, tickers, start, end):
+        return {ticker: self.history(ticker, start, end) for ticker in tickers}
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = StubDatabase(
+        securities=[(TICKER, SECURITY_ID, 1, "トヨタ自動車")],
+        markets=[(1, "Asia/Tokyo", dt.timedelta(hours=9), dt.timedelta(hours=11, minutes=30), dt.timedelta(hours=12, minutes=30), dt.timedelta(hours=15, minutes=30))],
+    )
+    monkeypatch.setattr(DB, "pool", stub)
+    monkeypatch.setattr(DB, "master", None)
+    monkeypatch.setattr(kabu.Backend, "provider", FakeProvider())
+    monkeypatch.setattr(kabu.Backend, "column_store", None)
+    kabu.Backend.price_cache.clear()
+    kabu.Backend.planner._empty_spans.clear()
+
+    DB.get_master().ensure_loaded()
+    yield stub
+    kabu.Backend.price_cache.clear()
+    kabu.Backend.planner._empty_spans.clear()
+
+def store(stub: StubDatabase, first: str, last: str) -> None:
+    sessions = kabu.Backend.calendar.sessions_between(dt.date.fromisoformat(first), dt.date.fromisoformat(last))
+    for date, row in zip(sessions.tolist(), bars(sessions).itertuples(index=False)):
+        stub.prices.setdefault(SECURITY_ID, {})[date] = tuple(row)
+
+def get_price(begin: str, end: str, granularity: str = "daily") -> pandas.DataFrame:
+    return kabu.Backend().get_price(dict(ticker=TICKER, begin_range=begin, end_range=end, chart_granularity=granularity))
+
+# 期間の日足がすべてDBにある場合は、範囲と件数の1クエリと読み出しの1クエリだけで返す
+# 2回目は結果キャッシュから切り出すのでDBには問い合わせない
+def test_fully_stored_range_uses_coverage_and_select_only(stub):
+    store(stub, "2024-01-04", "2024-12-30")
+    stub.reset_queries()
+
+    df = get_price("2024-03-01", "2024-05-31")
+
+    assert stub.kinds() == ["coverage", "select"]
+    assert len(df) == kabu.Backend.calendar.count_sessions(dt.date(2024, 3, 1), dt.date(2024, 5, 31))
+    assert kabu.Backend.provider.calls == []
+
+    stub.reset_queries()
+    again = get_price("2024-04-01", "2024-04-30")
+
+    assert stub.queries == []
+    pandas.testing.assert_frame_equal(again, df[(df["Date"] >= "2024-04-01") & (df["Date"] <= "2024-04-30")].reset_index(drop=True))
+
+# 取得しても返ってこなかった取引日は、取得できた最後の日より後（上場廃止・売買停止）でも空白期間として記録し、
+# 確認してからEMPTY_SPAN_RECHECK_DAYS日が過ぎるまでは取り直さない
+def test_trailing_empty_sessions_are_not_refetched_until_recheck(stub, tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    kabu.Backend.set_column_store(str(tmp_path))
+    store(stub, "2024-01-04", "2024-02-29")
+    monkeypatch.setattr(kabu.Backend, "provider", FakeProvider(holes={dt.date(2024, 4, 26), dt.date(2024, 4, 30)}))
+
+    get_price("2024-02-01", "2024-04-30")
+    # 4/29は祝日なので4/26と4/30は続いた取引日
+    assert [span[:2] for span in stub.empty_spans[SECURITY_ID].values()] == [(dt.date(2024, 4, 26), dt.date(2024, 4, 30))]
+    assert kabu.Backend.price_cache.get(SECURITY_ID, "daily", dt.date(2024, 2, 1), dt.date(2024, 4, 30)) is not None
+
+    # 結果キャッシュ・列指向ストアがなくても、確認済みの空白期間は取り直さない
+    kabu.Backend.price_cache.clear()
+    kabu.Backend.column_store.invalidate(SECURITY_ID)
+    get_price("2024-02-01", "2024-04-30")
+    assert len(kabu.Backend.provider.calls) == 1
+
+    # 確認してからEMPTY_SPAN_RECHECK_DAYS日が過ぎた空白期間は取り直す
+    stale = dt.date.today() - dt.timedelta(days=kabu.Backend.planner.EMPTY_SPAN_RECHECK_DAYS + 1)
+    kabu.Backend.planner.set_empty_spans(SECURITY_ID, [(first, last, stale) for first, last, _ in kabu.Backend.planner.get_empty_spans(SECURITY_ID)])
+    kabu.Backend.price_cache.clear()
+    kabu.Backend.column_store.invalidate(SECURITY_ID)
+    get_price("2024-02-01", "2024-04-30")
+    assert kabu.Backend.provider.calls[1][1:] == (dt.date(2024, 4, 26), dt.date(2024, 4, 30))
+
+# 古い歯抜けと新しい欠けは別々に取得し、間の格納済みの期間は取り直さない
+def test_distant_gaps_are_fetched_separately(stub):
+    store(stub, "2024-01-04", "2024-06-28")
+    del stub.prices[SECURITY_ID][dt.date(2024, 2, 1)]
+    for day in kabu.Backend.calendar.sessions_between(dt.date(2024, 6, 24), dt.date(2024, 6, 28)).tolist():
+        del stub.prices[SECURITY_ID][day]
+
+    get_price("2024-01-04", "2024-06-28")
+
+    assert kabu.Backend.provider.calls == [(TICKER, dt.date(2024, 2, 1), dt.date(2024, 2, 1)), (TICKER, dt.date(2024, 6, 24), dt.date(2024, 6, 28))]
+    assert len(stub.prices[SECURITY_ID]) == kabu.Backend.calendar.count_sessions(dt.date(2024, 1, 4), dt.date(2024, 6, 28))
+
+# 複数銘柄の場合も同じ
+def test_distant_gaps_are_fetched_separately_for_many(stub):
+    store(stub, "2024-01-04", "2024-06-28")
+    del stub.prices[SECURITY_ID][dt.date(2024, 2, 1)]
+    del stub.prices[SECURITY_ID][dt.date(2024, 6, 28)]
+
+    kabu.Backend().get_prices(dict(tickers=[TICKER], begin_range="2024-01-04", end_range="2024-06-28", chart_granularity="daily"))
+
+    assert kabu.Backend.provider.calls == [(TICKER, dt.date(2024, 2, 1), dt.date(2024, 2, 1)), (TICKER, dt.date(2024, 6, 28), dt.date(2024, 6, 28))]
+
+# 列指向ストアのファイルはDBに問い合わせずに読み出し、鮮度は挿入リスナーが更新するウォーターマークで判断する
+def test_column_store_is_validated_by_watermark(stub, tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    kabu.Backend.set_column_store(str(tmp_path))
+    store(stub, "2024-01-04", "2024-12-30")
+    get_price("2024-03-01", "2024-05-31")
+    kabu.Backend.price_cache.clear()
+
+    stub.reset_queries()
+    get_price("2024-03-01", "2024-05-31")
+    assert stub.queries == []
+
+    # 期間内の足の書き込みはリスナーがファイルに取り込むので、読み出しは引き続きDBを使わない
+    DB().insert_into_prices(TICKER, pandas.DataFrame(dict(Open=[9.0], High=[9.0], Low=[9.0], Close=[9.0], Volume=[900]), index=pandas.DatetimeIndex(["2024-04-01"])), "daily")
+    kabu.Backend.price_cache.clear()
+    stub.reset_queries()
+    df = get_price("2024-03-01", "2024-05-31")
+
+    assert stub.queries == []
+    assert df.loc[df["Date"] == "2024-04-01", "Close"].tolist() == [9.0]
+
+    # ウォーターマークが食い違うファイル（ウォーターマークを更新した後、書き直す前に止まった場合など）は使わずにDBから読み直す
+    kabu.Backend.column_store._bump_watermark(SECURITY_ID)
+    kabu.Backend.price_cache.clear()
+    stub.reset_queries()
+    get_price("2024-03-01", "2024-05-31")
+
+    assert stub.kinds() == ["coverage", "select"]
+    assert kabu.Backend.column_store.metrics()["stale"] == 1
+
+    # 読み直した期間は書き直されるので、次は再びDBを使わない
+    kabu.Backend.price_cache.clear()
+    stub.reset_queries()
+    get_price("2024-03-01", "2024-05-31")
+    assert stub.queries == []
+
+# 取得できた日の間で抜けていた取引日は空白期間として記録され、欠けていないものとしてキャッシュする
+def test_confirmed_empty_span_does_not_block_cache(stub, monkeypatch):
+    store(stub, "2024-01-04", "2024-02-29")
+    monkeypatch.setattr(kabu.Backend, "provider", FakeProvider(holes={dt.date(2024, 3, 28), dt.date(2024, 3, 29)}))
+
+    get_price("2024-02-01", "2024-04-30")
+
+    assert list(stub.empty_spans[SECURITY_ID]) == [dt.date(2024, 3, 28)]
+    assert kabu.Backend.price_cache.get(SECURITY_ID, "daily", dt.date(2024, 2, 1), dt.date(2024, 4, 30)) is not None
+
+# 段階ごとのクエリ数は、その段階の中で実際に発行したクエリの数
+def test_stage_queries_are_counted_from_cursor(stub):
+    store(stub, "2024-01-04", "2024-12-30")
+    tracer.reset()
+
+    get_price("2024-03-01", "2024-05-31")
+
+    summary = tracer.summary()
+    assert summary["coverage"]["queries"] == 1
+    assert summary["select"]["queries"] == 1
+    assert "queries" not in summary["decode"]
+
+# 週足・月足のバケツの区切りは、DB側の集計（StubDatabaseが再現するPRICE_BUCKETS）でも日足のキャッシュからの集計（price_resampler）でも同じになる
+# MySQLで実行するわけではないので、確かめているのは区切りとStubDatabaseの再現で、SQLの式そのものではない
+# 年をまたぐ週（2023-12-25の週、2024-01-01の週）を含む
+@pytest.mark.parametrize("granularity", ["weekly", "monthly"])
+def test_bucket_boundaries_match_resampler(stub, granularity):
+    store(stub, "2023-11-01", "2024-06-28")
+
+    from_sql = get_price("2023-11-01", "2024-06-28", granularity)
+    assert stub.kinds()[-1] == "select" and "GROUP BY" in stub.queries[-1]
+    assert len(from_sql) == len(set(bucket_keys(from_sql["Date"].to_numpy(dtype="datetime64[D]"), granularity)))
+
+    get_price("2023-11-01", "2024-06-28")
+    stub.reset_queries()
+    from_cache = get_price("2023-11-01", "2024-06-28", granularity)
+
+    assert stub.queries == []
+    pandas.testing.assert_frame_equal(from_cache, from_sql, check_dtype=False)
+
+# StubDatabaseが再現するYEARWEEK(date, 3)とYEAR*100+MONTHの区切りは、bucket_keysの区切りと一致する
+def test_emulated_bucket_boundaries_match_bucket_keys():
+    days = numpy.arange(numpy.datetime64("1990-01-01"), numpy.datetime64("2040-12-31"))
+    for granularity, bucket in DB.PRICE_BUCKETS.items():
+        sql_keys = numpy.array([StubDatabase.bucket(bucket, d) for d in days.tolist()])
+        keys = bucket_keys(days, granularity)
+        numpy.testing.assert_array_equal(numpy.diff(sql_keys) != 0, numpy.diff(keys) != 0)
+
+# NULLを含む日足も、PRICE_AGGREGATE_COLUMNSのNULLの扱い（StubDatabaseが再現する）とprice_resamplerで同じ足になる
+# 最初の日の始値がNULLの週は始値がNaN、出来高がすべてNULLの週は出来高が0
+def test_null_handling_matches_resampler(stub):
+    store(stub, "2024-01-04", "2024-02-29")
+    prices = stub.prices[SECURITY_ID]
+    prices[dt.date(2024, 1, 9)] = (None, *prices[dt.date(2024, 1, 9)][1:])
+    prices[dt.date(2024, 1, 19)] = (*prices[dt.date(2024, 1, 19)][:3], None, prices[dt.date(2024, 1, 19)][4])
+    for day in kabu.Backend.calendar.sessions_between(dt.date(2024, 2, 5), dt.date(2024, 2, 9)).tolist():
+        prices[day] = (*prices[day][:4], None)
+
+    from_sql = get_price("2024-01-04", "2024-02-29", "weekly")
+    get_price("2024-01-04", "2024-02-29")
+    from_cache = get_price("2024-01-04", "2024-02-29", "weekly")
+
+    pandas.testing.assert_frame_equal(from_cache, from_sql, check_dtype=False)
+    week = from_sql.set_index("Date")
+    assert numpy.isnan(week.loc["2024-01-09", "Open"])
+    assert numpy.isnan(week.loc["2024-01-15", "Close"])
+    assert week.loc["2024-02-05", "Volume"] == 0
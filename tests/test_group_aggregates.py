@@ -0,0 +1,173 @@
+import contextlib
+import datetime as dt
+import numpy
+import pandas
+import pytest
+
+pytest.importorskip("MySQLdb")
+
+from database import DB
+from trading_calendar import TradingCalendar
+from group_aggregates import GroupAggregator
+
+calendar = TradingCalendar(2024, 2025)
+DAYS = calendar.sessions_between(dt.date(2024, 1, 1), dt.date(2024, 12, 31))
+MEMBERS = {1: list(range(1, 31)), 2: list(range(31, 61))}
+
+# 日足（日付×銘柄の終値とSMA50）と保存済みの集計値をメモリ上に持ち、GroupAggregatorが使うDBの呼び出しに答える
+class FakeStore:
+    def __init__(self, seed: int = 7):
+        rng = numpy.random.default_rng(seed)
+        self.close = 1000 * numpy.exp(numpy.cumsum(rng.normal(0, 0.02, (len(DAYS), 60)), axis=0))
+        self.close[rng.random(self.close.shape) < 0.02] = numpy.nan
+        self.table: dict[tuple[str, int, dt.date], tuple] = {}
+
+    def sma(self) -> numpy.ndarray:
+        return pandas.DataFrame(self.close).rolling(50).mean().to_numpy()
+
+    def fetchall(self, sql, params=()):
+        if "UNION ALL" in sql:
+            ids = params[:len(params) // 2]
+            return [("sector", group_id, s) for group_id, members in MEMBERS.items() if group_id == 1 for s in members if s in ids] + \
+                [("index", group_id, s) for group_id, members in MEMBERS.items() if group_id == 2 for s in members if s in ids]
+        if "security_sectors" in sql:
+            return [(g, s, None) for g in params for s in MEMBERS[g]]
+        if "index_components" in sql:
+            return [(g, s, float(s)) for g in params for s in MEMBERS[g]]
+        if "MIN(date)" in sql:
+            kind, out = params[0], []
+            for g in params[1:-1]:
+                dates = sorted(d for (k, group_id, d) in self.table if k == kind and group_id == g)
+                if dates:
+                    row = self.table[(kind, g, dates[-1])]
+                    out.append((g, dates[0], dates[-1], row[1], row[3]))
+            return out
+        raise NotImplementedError(sql)
+
+    def fetchone(self, sql, params=()):
+        kind, g, before = params
+        dates = sorted(d for (k, group_id, d) in self.table if k == kind and group_id == g and d < before)
+        if not dates:
+            return None
+        row = self.table[(kind, g, dates[-1])]
+        return (dates[-1], row[1], row[3])
+
+    def fetch_array(self, sql, params, width, chunk_size=0):
+        if "FROM group_aggregates" in sql:
+            kind, g, begin, end = params
+            rows = [(numpy.datetime64(d, "D").astype(numpy.int64), *[numpy.nan if v is None else v for v in self.table[(k, group_id, d)]])
+                    for (k, group_id, d) in sorted(self.table) if k == kind and group_id == g and begin <= d <= end]
+            return numpy.array(rows, dtype=float).reshape(-1, width)
+
+        begin, end, ids = params[0], params[1], params[2:]
+        sma = self.sma()
+        rows = []
+        for t, day in enumerate(DAYS):
+            if not numpy.datetime64(begin) <= day <= numpy.datetime64(end):
+                continue
+            for security_id in ids:
+                if not numpy.isnan(self.close[t, security_id - 1]):
+                    rows.append((security_id, day.astype(numpy.int64), self.close[t, security_id - 1], numpy.nan, sma[t, security_id - 1], numpy.nan))
+        return numpy.array(rows, dtype=float).reshape(-1, 6)
+
+    @contextlib.contextmanager
+    def connection(self):
+        store = self
+
+        class Cursor:
+            def execute(self, sql, params=()):
+                if sql.startswith("DELETE"):
+                    kind, group_ids, after = params[0], params[1:], None
+                    if "date >" in sql:
+                        group_ids, after = params[1:2], params[2]
+                    for key in [key for key in store.table if key[0] == kind and key[1] in group_ids and (after is None or key[2] > after)]:
+                        del store.table[key]
+
+            def executemany(self, sql, rows):
+                for row in rows:
+                    store.table[row[:3]] = row[3:]
+
+            def close(self):
+                pass
+
+        class Connection:
+            def cursor(self, *args):
+                return Cursor()
+
+            def commit(self):
+                pass
+
+        yield Connection()
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeStore()
+    monkeypatch.setattr(DB, "fetchall", classmethod(lambda cls, sql, params=(): store.fetchall(sql, params)))
+    monkeypatch.setattr(DB, "fetchone", classmethod(lambda cls, sql, params=(): store.fetchone(sql, params)))
+    monkeypatch.setattr(DB, "fetch_array", classmethod(lambda cls, sql, params, width, chunk_size=0: store.fetch_array(sql, params, width)))
+    monkeypatch.setattr(DB, "connection", classmethod(lambda cls: store.connection()))
+    return store
+
+BEGIN, MIDDLE, END = DAYS[30].item(), DAYS[150].item(), DAYS[-1].item()
+
+def full(store: FakeStore, kind: str, group_id: int) -> pandas.DataFrame:
+    store.table.clear()
+    aggregator = GroupAggregator(None, calendar)
+    aggregator.update(kind, [group_id], BEGIN, END)
+    return aggregator.select(kind, group_id, BEGIN, END)
+
+# 保存済みの最後の日の続きから足していった結果は、一度に計算した結果と同じ
+@pytest.mark.parametrize("kind,group_id", [("sector", 1), ("index", 2)])
+def test_incremental_matches_full(store, kind, group_id):
+    aggregator = GroupAggregator(None, calendar)
+    aggregator.update(kind, [group_id], BEGIN, MIDDLE)
+    aggregator.update(kind, [group_id], BEGIN, END)
+    assert aggregator.update(kind, [group_id], BEGIN, END) == 0
+    incremental = aggregator.select(kind, group_id, BEGIN, END)
+
+    numpy.testing.assert_allclose(incremental.to_numpy(), full(store, kind, group_id).to_numpy(), rtol=1e-12, equal_nan=True)
+
+# 単純平均のリターンは、構成銘柄ごとの前の終値からのリターンの平均
+def test_equal_return_matches_brute_force(store):
+    result = full(store, "sector", 1)
+
+    t = 100
+    returns = []
+    for security_id in MEMBERS[1]:
+        close = store.close[:, security_id - 1]
+        if numpy.isnan(close[t]):
+            continue
+        previous = close[:t][~numpy.isnan(close[:t])]
+        returns.append(close[t] / previous[-1] - 1)
+
+    assert result.loc[pandas.Timestamp(DAYS[t]), "equal_return"] == pytest.approx(numpy.mean(returns), rel=1e-12)
+
+# 保存済みの期間内の日足が書き換えられたグループは、その日から水準も含めて計算し直す
+@pytest.mark.parametrize("kind,group_id,security_id", [("sector", 1, 5), ("index", 2, 40)])
+def test_inserted_prices_recompute_from_earliest_date(store, kind, group_id, security_id):
+    aggregator = GroupAggregator(None, calendar)
+    aggregator.update(kind, [group_id], BEGIN, END)
+
+    t = 120
+    store.close[t:t + 3, security_id - 1] *= 1.5
+    changed = pandas.DataFrame({"Close": store.close[t:t + 3, security_id - 1]}, index=pandas.DatetimeIndex(DAYS[t:t + 3]))
+    aggregator.on_prices_inserted(security_id, "daily", changed)
+    # 保存済みの最後の日以降の更新でも計算し直す
+    aggregator.update(kind, [group_id], BEGIN, MIDDLE)
+    recomputed = aggregator.select(kind, group_id, BEGIN, END)
+
+    expected = full(store, kind, group_id)
+    numpy.testing.assert_allclose(recomputed.to_numpy(), expected.to_numpy(), rtol=1e-12, equal_nan=True)
+    assert aggregator.dirty_groups() == {}
+
+# 分足や保存済みの期間より後の書き込みでは計算し直さない
+def test_later_or_intraday_inserts_do_not_recompute(store):
+    aggregator = GroupAggregator(None, calendar)
+    aggregator.update("sector", [1], BEGIN, MIDDLE)
+    before = aggregator.select("sector", 1, BEGIN, MIDDLE)
+
+    aggregator.on_prices_inserted(5, "1m", pandas.DataFrame({"Close": [1.0]}, index=pandas.DatetimeIndex([DAYS[100]])))
+    aggregator.on_prices_inserted(5, "daily", pandas.DataFrame({"Close": [1.0]}, index=pandas.DatetimeIndex([DAYS[160]])))
+
+    assert aggregator.update("sector", [1], BEGIN, MIDDLE) == 0
+    pandas.testing.assert_frame_equal(aggregator.select("sector", 1, BEGIN, MIDDLE), before)
@@ -0,0 +1,110 @@
+import datetime as dt
+from contextlib import contextmanager
+import numpy
+import pytest
+
+pytest.importorskip("MySQLdb")
+
+from database import DB
+from indicators import compute_indicators, IndicatorEngine, INDICATOR_COLUMNS
+from indicator_panel import IndicatorPanel
+from trading_calendar import TradingCalendar
+
+T, N = 400, 40
+
+# 日付×銘柄の終値（途中の欠けと、途中から上場した銘柄を含む）
+@pytest.fixture(scope="module")
+def close() -> numpy.ndarray:
+    rng = numpy.random.default_rng(3)
+    close = 1000 * numpy.exp(numpy.cumsum(rng.normal(0, 0.02, (T, N)), axis=0))
+    close[rng.random((T, N)) < 0.02] = numpy.nan
+    for j in range(0, N, 7):
+        close[:rng.integers(0, T), j] = numpy.nan
+    return close
+
+def assert_same(actual: numpy.ndarray, expected: numpy.ndarray) -> None:
+    numpy.testing.assert_allclose(actual, expected, rtol=1e-12, atol=1e-9, equal_nan=True)
+
+# 2次元の終値を渡した場合は、列ごとに1次元で計算したものと同じ値になる（先頭のNaNは上場前として扱う）
+def test_columns_are_computed_independently():
+    rng = numpy.random.default_rng(1)
+    series = 1000 * numpy.exp(numpy.cumsum(rng.normal(0, 0.02, T)))
+    panel = numpy.column_stack([series, numpy.r_[numpy.full(100, numpy.nan), series[:-100]]])
+    result = compute_indicators(panel)
+    for j in range(panel.shape[1]):
+        valid = ~numpy.isnan(panel[:, j])
+        expected = compute_indicators(panel[valid, j])
+        for col in INDICATOR_COLUMNS:
+            assert_same(result[col][valid, j], expected[col])
+
+# 欠けのある銘柄も、足がある行だけで1銘柄ずつ計算した場合（get_technical_analysis）と同じ値になる
+def test_panel_matches_per_ticker(close):
+    result, _, counts = IndicatorPanel.compute(close)
+    for j in range(N):
+        valid = ~numpy.isnan(close[:, j])
+        assert counts[j] == valid.sum()
+        expected = compute_indicators(close[valid, j])
+        for col in INDICATOR_COLUMNS:
+            assert_same(result[col][valid, j], expected[col])
+            assert numpy.isnan(result[col][~valid, j]).all()
+
+# INSERTした行を残すDB.poolの代わり
+class Recorder:
+    def __init__(self):
+        self.rows: dict[str, list[tuple]] = {}
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self, cursorclass=None):
+        return self
+
+    def execute(self, sql: str, params=()):
+        pass
+
+    def executemany(self, sql: str, rows: list[tuple]):
+        table = sql.split()[2]
+        self.rows.setdefault(table, []).extend(rows)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+# 書き込んだ値は銘柄ごとの計算と同じで、計算状態からは逐次計算で続きを求められる
+def test_run_saves_values_and_states(close, monkeypatch):
+    calendar = TradingCalendar()
+    days = calendar.sessions_between(dt.date(2022, 1, 1), dt.date(2024, 12, 31))[:T]
+    ids = numpy.arange(1, N + 1)
+    rows_at, columns_at = numpy.nonzero(~numpy.isnan(close))
+    values = numpy.column_stack([ids[columns_at], days[rows_at].astype(numpy.int64), close[rows_at, columns_at], numpy.full(len(rows_at), 100.0)])
+
+    recorder = Recorder()
+    monkeypatch.setattr(DB, "pool", recorder)
+    monkeypatch.setattr(DB, "fetch_array", classmethod(lambda cls, sql, params, width, chunk_size=0: values))
+    engine = IndicatorEngine(None, calendar)
+    begin = days[300].item()
+
+    summary = IndicatorPanel(db=object(), calendar=calendar, engine=engine).run(begin, days[-1].item())
+
+    saved = recorder.rows["indicator_values"]
+    assert summary["rows"] == len(saved) == numpy.count_nonzero(~numpy.isnan(close[300:]))
+    assert len(recorder.rows["indicator_states"]) == summary["securities"] == N
+
+    for j in (1, 7, 20):
+        valid = ~numpy.isnan(close[:, j])
+        expected = compute_indicators(close[valid, j])
+        after = days[valid] >= numpy.datetime64(begin)
+        rows = [row for row in saved if row[0] == ids[j]]
+        assert [row[1] for row in rows] == days[valid][after].tolist()
+        for k, col in enumerate(INDICATOR_COLUMNS):
+            assert_same(numpy.array([numpy.nan if row[2 + k] is None else row[2 + k] for row in rows]), expected[col][after])
+
+        state = engine._states[int(ids[j])]
+        assert state.last_date == days[valid][-1].item()
+        updated = state.update(dt.date(2030, 1, 1), 1000.0)
+        extended = compute_indicators(numpy.r_[close[valid, j], 1000.0])
+        for col in INDICATOR_COLUMNS:
+            assert updated[col] == pytest.approx(extended[col][-1], rel=1e-10, nan_ok=True)
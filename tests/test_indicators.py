@@ -0,0 +1,52 @@
+import numpy
+import pandas
+import pytest
+
+pytest.importorskip("MySQLdb")
+ta = pytest.importorskip("pandas_ta_classic")
+
+from indicators import compute_indicators, IndicatorState, INDICATOR_COLUMNS
+
+N = 600
+
+@pytest.fixture(scope="module")
+def prices() -> pandas.DataFrame:
+    rng = numpy.random.default_rng(1)
+    close = 1000 * numpy.exp(numpy.cumsum(rng.normal(0, 0.02, N)))
+    return pandas.DataFrame({"Close": close}, index=pandas.bdate_range("2020-01-01", periods=N))
+
+# pandas_ta_classic（df.ta）で計算した値
+@pytest.fixture(scope="module")
+def reference(prices) -> pandas.DataFrame:
+    df = prices.copy()
+    df.ta.sma(length=25, append=True)
+    df.ta.sma(length=50, append=True)
+    df.ta.sma(length=75, append=True)
+    df.ta.rsi(length=14, append=True)
+    df.ta.macd(append=True)
+    return df.rename(columns={"MACD_12_26_9": "MACD", "MACDh_12_26_9": "MACD_histogram", "MACDs_12_26_9": "MACD_signal"})
+
+# 一括計算はpandas_ta_classicと同じ値（NaNの位置も同じ）
+def test_batch_matches_pandas_ta(prices, reference):
+    result = compute_indicators(prices["Close"].to_numpy())
+
+    for col in INDICATOR_COLUMNS:
+        numpy.testing.assert_array_equal(result[col], reference[col].to_numpy(), err_msg=col)
+
+# 一括計算の途中の状態（JSONで保存して読み直したもの）から逐次計算を続けた値は、一括計算と1e-13以内で一致する
+@pytest.mark.parametrize("k", [5, 20, 30, 300])
+def test_incremental_matches_batch(prices, k):
+    close = prices["Close"].to_numpy()
+    dates = prices.index.date
+    batch = compute_indicators(close)
+
+    state = IndicatorState.from_batch(dates[0], dates[k - 1], compute_indicators(close[:k], intermediates=True))
+    state = IndicatorState.from_json(state.to_json())
+    for i in range(k, N):
+        values = state.update(dates[i], close[i])
+        for col in INDICATOR_COLUMNS:
+            expected = batch[col][i]
+            if numpy.isnan(expected):
+                assert numpy.isnan(values[col]), (col, i)
+            else:
+                assert abs(values[col] - expected) <= 1e-13 * max(1.0, abs(expected)), (col, i, values[col], expected)
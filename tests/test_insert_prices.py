@@ -0,0 +1,160 @@
+import datetime as dt
+import types
+from contextlib import contextmanager
+import numpy
+import pandas
+import pytest
+
+pytest.importorskip("MySQLdb")
+
+from database import DB
+from stub_db import StubDatabase
+
+TICKER = "7203.T"
+SECURITY_ID = 1
+
+# INSERTに渡した行を残すスタブ
+class RecordingDatabase(StubDatabase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.inserted: list[tuple] = []
+
+    def executemany(self, sql: str, rows: list[tuple]) -> None:
+        self.inserted.extend(rows)
+        super().executemany(sql, rows)
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = RecordingDatabase(
+        securities=[(TICKER, SECURITY_ID, 1, "トヨタ自動車")],
+        markets=[(1, "Asia/Tokyo", dt.timedelta(hours=9), dt.timedelta(hours=11, minutes=30), dt.timedelta(hours=12, minutes=30), dt.timedelta(hours=15, minutes=30))],
+    )
+    monkeypatch.setattr(DB, "pool", stub)
+    monkeypatch.setattr(DB, "master", None)
+    monkeypatch.setattr(DB, "insert_listeners", [])
+    DB.get_master().ensure_loaded()
+    stub.reset_queries()
+    return stub
+
+def bars(days: list[str]) -> pandas.DataFrame:
+    close = numpy.arange(1.0, len(days) + 1)
+    return pandas.DataFrame(dict(Open=close, High=close + 1, Low=close - 1, Close=close, Volume=(close * 100).astype(numpy.int64)), index=pandas.DatetimeIndex(days))
+
+# 日足のtimeはNULLではなく、読み出し側の条件（time = '00:00:00'）と同じ値になる
+def test_daily_rows_use_sentinel_time():
+    rows = DB.build_price_rows(SECURITY_ID, bars(["2024-01-04", "2024-01-05"]))
+
+    assert [row[:3] for row in rows] == [(SECURITY_ID, dt.date(2024, 1, 4), DB.DAILY_TIME), (SECURITY_ID, dt.date(2024, 1, 5), DB.DAILY_TIME)]
+    assert DB.DAILY_TIME.isoformat() == "00:00:00"
+    assert all(row[2] is not None for row in rows)
+
+# NaNはNULL（None）として格納し、値はPythonの型にする
+def test_missing_values_become_none():
+    prices = bars(["2024-01-04", "2024-01-05"]).astype({"Volume": numpy.float64})
+    prices.iloc[1, prices.columns.get_loc("Volume")] = numpy.nan
+
+    rows = DB.build_price_rows(SECURITY_ID, prices)
+
+    assert rows[0][3:] == (1.0, 2.0, 0.0, 1.0, 100.0)
+    assert rows[1][-1] is None
+    assert all(type(value) is float for value in rows[0][3:])
+
+# 同じ日の日足を格納し直すと、時刻を含めて同じ主キーの行になるので上書きされる
+def test_reinserted_daily_bar_has_same_key(stub):
+    DB().insert_into_prices(TICKER, bars(["2024-01-04", "2024-01-05"]), "daily")
+    DB().insert_into_prices(TICKER, bars(["2024-01-05"]) * 10, "daily")
+
+    keys = [row[:3] for row in stub.inserted]
+    assert keys[1] == keys[2] == (SECURITY_ID, dt.date(2024, 1, 5), DB.DAILY_TIME)
+    assert stub.prices[SECURITY_ID][dt.date(2024, 1, 5)][3] == 10.0
+    assert stub.kinds() == ["begin", "insert", "begin", "insert"]
+
+# pricesの読み出しはすべて日足（time = '00:00:00'）に絞り込む
+def test_price_selects_filter_on_sentinel(stub):
+    for day in ["2024-01-04", "2024-01-05"]:
+        stub.prices.setdefault(SECURITY_ID, {})[dt.date.fromisoformat(day)] = (1.0, 2.0, 0.0, 1.0, 100)
+
+    for granularity in ["daily", "weekly", "monthly"]:
+        DB().select_from_prices(TICKER, dt.date(2024, 1, 1), dt.date(2024, 1, 31), granularity)
+    DB().get_price_coverage(TICKER, dt.date(2024, 1, 1), dt.date(2024, 1, 31))
+
+    selects = [sql for sql in stub.queries if "FROM prices" in sql]
+    assert len(selects) == 4
+    assert all(f"time = '{DB.DAILY_TIME.isoformat()}'" in sql for sql in selects)
+
+# 分足をまとめた日足のSELECTに決まった行を返し、INSERTした行を残すDB.poolの代わり
+class CompactingDatabase:
+    def __init__(self, compacted: list[tuple]):
+        self.compacted = compacted
+        self.queries: list[str] = []
+        self.inserted: list[tuple] = []
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self, cursorclass=None):
+        return self
+
+    def execute(self, sql: str, params=()):
+        self.queries.append(" ".join(sql.split()))
+
+    def executemany(self, sql: str, rows: list[tuple]):
+        self.queries.append(" ".join(sql.split()))
+        self.inserted.extend(rows)
+
+    def fetchall(self):
+        return tuple(self.compacted)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+# 分足からまとめた日足は、銘柄ごとにその日付をindexにしたDataFrameとして書き込み後の処理に渡す
+# （空のDataFrameでは指標の計算状態や業種・指数の集計値が計算し直されない）
+def test_compacted_prices_are_passed_to_listeners(monkeypatch):
+    compacted = [
+        (1, dt.date(2024, 1, 4), 10.0, 12.0, 9.0, 11.0, 1000),
+        (1, dt.date(2024, 1, 5), 11.0, 13.0, 10.0, 12.0, 2000),
+        (2, dt.date(2024, 1, 5), 20.0, 21.0, 19.0, 20.5, 300),
+    ]
+    pool = CompactingDatabase(compacted)
+    calls = []
+    monkeypatch.setattr(DB, "pool", pool)
+    monkeypatch.setattr(DB, "insert_listeners", [lambda security_id, granularity, prices: calls.append((security_id, granularity, prices))])
+
+    assert DB().compact_intraday_prices(1, dt.date(2024, 1, 9)) == 3
+
+    assert pool.inserted == [(security_id, date, DB.DAILY_TIME, *ohlcv) for security_id, date, *ohlcv in compacted]
+    assert [(security_id, granularity) for security_id, granularity, _ in calls] == [(1, "daily"), (2, "daily")]
+    assert list(calls[0][2].index.date) == [dt.date(2024, 1, 4), dt.date(2024, 1, 5)]
+    assert calls[0][2]["Close"].tolist() == [11.0, 12.0]
+    assert list(calls[1][2].index.date) == [dt.date(2024, 1, 5)]
+
+# 書き込んだ日以降の指標の計算状態は破棄される
+def test_compacted_prices_reset_indicator_state(monkeypatch):
+    from indicators import IndicatorEngine
+
+    pool = CompactingDatabase([(1, dt.date(2024, 1, 5), 11.0, 13.0, 10.0, 12.0, 2000)])
+    engine = IndicatorEngine(None, None)
+    engine._states[1] = types.SimpleNamespace(last_date=dt.date(2024, 1, 10))
+    engine._states[2] = types.SimpleNamespace(last_date=dt.date(2024, 1, 10))
+    monkeypatch.setattr(DB, "pool", pool)
+    monkeypatch.setattr(DB, "insert_listeners", [engine.on_prices_inserted])
+
+    DB().compact_intraday_prices(1, dt.date(2024, 1, 9))
+
+    assert set(engine._states) == {2}
+    assert any(sql.startswith("DELETE FROM indicator_states") for sql in pool.queries)
+
+# まとめる日がなければ何も書き込まない
+def test_nothing_to_compact(monkeypatch):
+    pool = CompactingDatabase([])
+    calls = []
+    monkeypatch.setattr(DB, "pool", pool)
+    monkeypatch.setattr(DB, "insert_listeners", [lambda *args: calls.append(args)])
+
+    assert DB().compact_intraday_prices(1, dt.date(2024, 1, 9)) == 0
+    assert pool.inserted == [] and calls == []
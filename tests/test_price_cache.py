@@ -0,0 +1,40 @@
+import datetime as dt
+import numpy
+import pandas
+from trading_calendar import TradingCalendar
+from price_cache import PriceCache
+
+calendar = TradingCalendar(2024, 2025)
+
+def bars(first: str, last: str) -> pandas.DataFrame:
+    sessions = calendar.sessions_between(dt.date.fromisoformat(first), dt.date.fromisoformat(last))
+    close = numpy.arange(1.0, len(sessions) + 1)
+    return pandas.DataFrame(dict(Open=close, High=close, Low=close, Close=close, Volume=close), index=pandas.DatetimeIndex(sessions.astype("datetime64[ns]")))
+
+def test_get_slices_cached_range():
+    cache = PriceCache(calendar)
+    df = bars("2024-01-04", "2024-06-28")
+    assert cache.put(1, "daily", dt.date(2024, 1, 4), dt.date(2024, 6, 28), df)
+
+    pandas.testing.assert_frame_equal(cache.get(1, "daily", dt.date(2024, 3, 1), dt.date(2024, 3, 29)), df.loc["2024-03-01":"2024-03-29"], check_freq=False)
+    assert cache.get(1, "daily", dt.date(2024, 1, 4), dt.date(2024, 7, 1)) is None
+
+# 読み出している間に書き込まれて破棄された場合は、読み出す前の版でputしても格納しない
+def test_put_after_invalidate_is_rejected():
+    cache = PriceCache(calendar)
+    version = cache.version(1)
+    df = bars("2024-01-04", "2024-06-28")
+
+    cache.on_prices_inserted(1, "daily", df.tail(1))
+
+    assert not cache.put(1, "daily", dt.date(2024, 1, 4), dt.date(2024, 6, 28), df, version)
+    assert cache.get(1, "daily", dt.date(2024, 1, 4), dt.date(2024, 6, 28)) is None
+    assert cache.put(1, "daily", dt.date(2024, 1, 4), dt.date(2024, 6, 28), df, cache.version(1))
+
+# 分足の書き込みでは破棄しない
+def test_intraday_insert_keeps_entries():
+    cache = PriceCache(calendar)
+    version = cache.version(1)
+    cache.on_prices_inserted(1, "1m", bars("2024-06-28", "2024-06-28"))
+
+    assert cache.put(1, "daily", dt.date(2024, 1, 4), dt.date(2024, 6, 28), bars("2024-01-04", "2024-06-28"), version)
@@ -0,0 +1,19 @@
+import types
+import pytest
+
+pytest.importorskip("yfinance")
+
+import price_provider
+from price_provider import ProviderError, YFinanceProvider
+
+# yf.downloadが銘柄ごとに残したエラーのうち、データがないこと以外は取得の失敗として例外にする
+def test_download_errors(monkeypatch):
+    errors = {
+        "1111.T": "YFPricesMissingError('$1111.T: possibly delisted; no price data found  (1d 2024-01-01 -> 2024-02-01)')",
+        "2222.T": "YFRateLimitError('Too Many Requests. Rate limited. Try after a while.')",
+    }
+    monkeypatch.setattr(price_provider, "yf", types.SimpleNamespace(shared=types.SimpleNamespace(_ERRORS=errors)))
+
+    YFinanceProvider.raise_download_errors(["1111.T", "7203.T"])
+    with pytest.raises(ProviderError, match="2222.T"):
+        YFinanceProvider.raise_download_errors(["1111.T", "2222.T"])
@@ -0,0 +1,85 @@
+import numpy
+import pandas
+import pytest
+
+from price_resampler import resample_ohlcv, downsample_ohlcv, fit_to_rows, summarize_ohlcv
+
+# 休場日（週末と平日の一部）を抜いた日足
+@pytest.fixture
+def daily() -> pandas.DataFrame:
+    rng = numpy.random.default_rng(0)
+    days = pandas.bdate_range("2019-12-25", "2021-03-31")
+    days = days[rng.random(len(days)) > 0.05]
+    close = 1000 * numpy.exp(numpy.cumsum(rng.normal(0, 0.02, len(days))))
+    high = close * (1 + rng.random(len(days)) * 0.02)
+    low = close * (1 - rng.random(len(days)) * 0.02)
+    high[10] = numpy.nan
+    return pandas.DataFrame(dict(
+        Open=close * (1 + rng.normal(0, 0.005, len(days))),
+        High=high,
+        Low=low,
+        Close=close,
+        Volume=rng.integers(1_000, 100_000, len(days)),
+    ), index=days)
+
+# pandasのresampleで同じ区切りにまとめたもの（日付はバケツ内の最初の取引日）
+def pandas_resample(df: pandas.DataFrame, rule: str) -> pandas.DataFrame:
+    resampler = df.resample(rule)
+    expected = pandas.DataFrame(dict(
+        Open=resampler["Open"].first(),
+        High=resampler["High"].max(),
+        Low=resampler["Low"].min(),
+        Close=resampler["Close"].last(),
+        Volume=resampler["Volume"].sum(),
+    ))
+    first_days = pandas.Series(df.index, index=df.index).resample(rule).first()
+    expected = expected[first_days.notna()]
+    expected.index = pandas.DatetimeIndex(first_days.dropna())
+    return expected
+
+# 週足（月曜始まり）・月足はpandasのresampleと同じ値になる
+@pytest.mark.parametrize("granularity, rule", [("weekly", "W-SUN"), ("monthly", "MS")])
+def test_resample_matches_pandas(daily, granularity, rule):
+    actual = resample_ohlcv(daily, granularity)
+    pandas.testing.assert_frame_equal(actual, pandas_resample(daily, rule), check_freq=False, check_names=False, check_index_type=False)
+
+def test_daily_is_unchanged(daily):
+    assert resample_ohlcv(daily, "daily") is daily
+
+# n本ずつまとめる場合もOHLCを保つ
+def test_downsample_keeps_ohlc(daily):
+    actual = downsample_ohlcv(daily, 5)
+    groups = daily.groupby(numpy.arange(len(daily)) // 5)
+    assert len(actual) == groups.ngroups
+    numpy.testing.assert_array_equal(actual["Open"], groups["Open"].first())
+    numpy.testing.assert_array_equal(actual["High"], groups["High"].max())
+    numpy.testing.assert_array_equal(actual["Low"], groups["Low"].min())
+    numpy.testing.assert_array_equal(actual["Close"], groups["Close"].last())
+    numpy.testing.assert_array_equal(actual["Volume"], groups["Volume"].sum())
+    assert list(actual.index) == list(daily.index[::5])
+
+# 行数に収まる最も細かい粒度を選ぶ
+def test_fit_to_rows_picks_finest_granularity(daily):
+    weeks = len(resample_ohlcv(daily, "weekly"))
+    months = len(resample_ohlcv(daily, "monthly"))
+
+    assert fit_to_rows(daily, len(daily)) == (daily, "daily")
+    assert fit_to_rows(daily, 0)[1] == "daily"
+
+    df, granularity = fit_to_rows(daily, weeks)
+    assert granularity == "weekly" and len(df) == weeks
+
+    df, granularity = fit_to_rows(daily, weeks - 1)
+    assert granularity == "monthly" and len(df) == months
+
+    df, granularity = fit_to_rows(daily, 5)
+    assert granularity == f"{-(-len(daily) // 5)}sessions" and len(df) <= 5
+
+def test_summary(daily):
+    summary = summarize_ohlcv(daily)
+    assert summary["bars"] == len(daily)
+    assert summary["first_close"] == round(daily["Close"].iloc[0], 2)
+    assert summary["high"] == round(daily["High"].max(), 2)
+    assert summary["high_date"] == daily["High"].idxmax().strftime("%Y-%m-%d")
+    assert summary["low_date"] == daily["Low"].idxmin().strftime("%Y-%m-%d")
+    assert summarize_ohlcv(daily.iloc[:0]) == dict(bars=0)
@@ -0,0 +1,117 @@
+import datetime as dt
+import threading
+import time
+from zoneinfo import ZoneInfo
+import pandas
+import pytest
+
+from market_hours import MarketHours
+from quote_service import QuoteService
+from trading_calendar import TradingCalendar
+
+TOKYO = MarketHours.from_row(("Asia/Tokyo", dt.timedelta(hours=9), dt.timedelta(hours=11, minutes=30), dt.timedelta(hours=12, minutes=30), dt.timedelta(hours=15, minutes=30)))
+MARKETS = {ticker: TOKYO for ticker in ["A", "B", "X"]}
+
+def bar() -> pandas.DataFrame:
+    return pandas.DataFrame(dict(Open=[1.0], High=[2.0], Low=[0.5], Close=[1.5], Volume=[10]), index=pandas.DatetimeIndex(["2026-10-16"]))
+
+# 取得元：releaseが立つまで返さない　Xのデータは返さない
+class FakeFetch:
+    def __init__(self):
+        self.calls: list[list[str]] = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, tickers: list[str]) -> dict:
+        self.calls.append(list(tickers))
+        assert self.release.wait(5)
+        return {ticker: bar() for ticker in tickers if ticker != "X"}
+
+def wait_until(condition) -> None:
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+# 同時に求められた同じ銘柄は1回の取得にまとめ、全員が同じ結果を受け取る
+def test_concurrent_requests_share_one_fetch():
+    fetch = FakeFetch()
+    fetch.release.clear()
+    service = QuoteService(TradingCalendar(), fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.get_many(["A", "B", "X"], MARKETS))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    # 先に始まった1回の取得を、残りの7回が3銘柄ずつ待つまで取得を止めておく
+    wait_until(lambda: service.metrics()["coalesced"] == 7 * 3)
+    fetch.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert fetch.calls == [["A", "B", "X"]]
+    assert len(results) == 8 and all(result == results[0] for result in results)
+    assert results[0]["A"]["close"] == 1.5 and results[0]["X"] is None
+    metrics = service.metrics()
+    assert metrics["fetches"] == 1 and metrics["in_flight"] == 0
+
+    # 取得できた銘柄はキャッシュから返し、取得できなかった銘柄だけを取り直す
+    service.get_many(["A", "X"], MARKETS)
+    assert fetch.calls[1:] == [["X"]]
+
+# 市場の状態ごとの現在値を持っておく秒数（2026-10-16は金曜日）
+@pytest.mark.parametrize("now, ttl", [
+    ("2026-10-16 08:00", 60 * 60),            # 寄り付き前：寄り付きまで
+    ("2026-10-16 10:00", 5.0),                # 取引時間中
+    ("2026-10-16 12:00", 30 * 60),            # 昼休み：後場の寄り付きまで
+    ("2026-10-16 15:40", 5.0),                # 引け直後：値が確定するまで
+    ("2026-10-16 16:00", 65 * 60 * 60),       # 引け後：月曜の寄り付きまで
+    ("2026-10-17 10:00", 47 * 60 * 60),       # 休場日
+])
+def test_ttl(now, ttl):
+    service = QuoteService(TradingCalendar(), FakeFetch())
+    assert service.ttl(TOKYO, dt.datetime.fromisoformat(now).replace(tzinfo=ZoneInfo("Asia/Tokyo"))) == ttl
+
+# 期限の計算で例外が起きても取得中の印を外すので、待っていた呼び出しにも同じ例外が届き、次の呼び出しは取り直す
+def test_failure_releases_in_flight():
+    fetch = FakeFetch()
+    fetch.release.clear()
+    service = QuoteService(TradingCalendar(), fetch)
+    errors = []
+
+    def request(tickers: list[str], markets: dict) -> None:
+        try:
+            service.get_many(tickers, markets)
+        except KeyError as e:
+            errors.append(e)
+
+    # 市場の情報がない銘柄（B）は期限を計算できない
+    first = threading.Thread(target=request, args=(["A", "B"], {"A": TOKYO}))
+    first.start()
+    wait_until(lambda: service.metrics()["in_flight"] == 2)
+    second = threading.Thread(target=request, args=(["A"], MARKETS))
+    second.start()
+    wait_until(lambda: service.metrics()["coalesced"] == 1)
+    fetch.release.set()
+    first.join()
+    second.join()
+
+    assert len(errors) == 2
+    assert service.metrics()["in_flight"] == 0
+    assert service.get_many(["A"], MARKETS)["A"]["close"] == 1.5
+    assert len(fetch.calls) == 2
+
+# 他の呼び出しが始めた取得が終わらない場合は、wait_timeout秒で諦める
+def test_wait_timeout():
+    fetch = FakeFetch()
+    fetch.release.clear()
+    service = QuoteService(TradingCalendar(), fetch, wait_timeout=0.05)
+    first = threading.Thread(target=service.get_many, args=(["A"], MARKETS))
+    first.start()
+    wait_until(lambda: service.metrics()["in_flight"] == 1)
+
+    with pytest.raises(TimeoutError):
+        service.get_many(["A"], MARKETS)
+
+    fetch.release.set()
+    first.join()
+    assert service.metrics()["in_flight"] == 0
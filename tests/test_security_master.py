@@ -0,0 +1,34 @@
+import datetime as dt
+from security_master import SecurityMaster
+
+def market_row(market_id: int, timezone: str) -> tuple:
+    return (market_id, timezone, dt.timedelta(hours=9), dt.timedelta(hours=15), None, None)
+
+# 読み直している間も読む側からは前のマスタ一式がそのまま見え、読み直した後は銘柄と市場が揃って入れ替わる
+def test_refresh_publishes_securities_and_markets_together():
+    tables = dict(
+        securities=[("7203.T", 1, 1, "トヨタ自動車")],
+        markets=[market_row(1, "Asia/Tokyo")],
+    )
+    seen = []
+    probing = []
+
+    def fetchall(sql, params=()):
+        if "FROM securities" in sql:
+            return tables["securities"]
+        # 読み直しの途中（銘柄を読んだ後）に参照する
+        if probing:
+            seen.append((master.get_market_hours("7203.T"), master.get_market_hours("AAPL")))
+        return tables["markets"]
+
+    master = SecurityMaster(fetchall, ttl_seconds=0)
+    assert master.get_market_hours("7203.T").timezone == "Asia/Tokyo"
+
+    probing.append(True)
+    tables["securities"] = [("7203.T", 1, 1, "トヨタ自動車"), ("AAPL", 2, 2, "Apple")]
+    tables["markets"] = [market_row(1, "Asia/Tokyo"), market_row(2, "America/New_York")]
+    master.refresh()
+
+    assert seen[0][0].timezone == "Asia/Tokyo" and seen[0][1] is None
+    assert master.get_market_hours("AAPL").timezone == "America/New_York"
+    assert master.get_ticker(2) == "AAPL"
@@ -0,0 +1,81 @@
+import datetime as dt
+import math
+import numpy
+import pandas
+import pytest
+
+pytest.importorskip("MySQLdb")
+pytest.importorskip("yfinance")
+pytest.importorskip("pandas_ta_classic")
+
+from tools import data_frame_to_dict
+
+# 値ごとに変換していた旧実装（欠損値を持てる整数の欠損値はNone）
+def serialize_legacy(df: pandas.DataFrame) -> list[dict]:
+    def convert(x):
+        return None if x is pandas.NA else x.isoformat() if hasattr(x, "isoformat") else x.item() if hasattr(x, "item") else x
+
+    columns = {name: [convert(x) for x in df[name].astype(object)] for name in df.columns}
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+def same_value(a, b) -> bool:
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return type(a) is type(b) and a == b
+
+def assert_same_records(actual: list[dict], expected: list[dict]) -> None:
+    assert len(actual) == len(expected)
+    for a, b in zip(actual, expected):
+        assert list(a) == list(b)
+        for name in a:
+            assert same_value(a[name], b[name]), (name, a[name], b[name])
+
+@pytest.fixture
+def frame() -> pandas.DataFrame:
+    rng = numpy.random.default_rng(0)
+    n = 200
+    close = 1000 + numpy.cumsum(rng.normal(0, 10, n))
+    volume = pandas.array(rng.integers(10_000, 5_000_000, n), dtype="Int64")
+    volume[[3, 50]] = pandas.NA
+    date = pandas.Series(pandas.date_range("1990-01-01", periods=n, freq="D"))
+    date[7] = pandas.NaT
+    return pandas.DataFrame({
+        "Date": date,
+        "Open": close.round(1),
+        "Close": close,
+        "Volume": volume,
+        "Shares": rng.integers(0, 100, n),
+        "Listed": rng.integers(0, 2, n).astype(bool),
+        "SMA_25": pandas.Series(close).rolling(25).mean().to_numpy(),
+        "Ticker": ["7203.T"] * n,
+    })
+
+# 列単位の変換は値ごとの変換と同じ値・同じ型になる（NaN、NaT、Int64の欠損値を含む）
+def test_records_match_per_value_conversion(frame):
+    assert_same_records(data_frame_to_dict(frame), serialize_legacy(frame))
+
+# 秒未満を含む日時とタイムゾーン付きの日時もisoformatと同じ文字列になる
+def test_datetimes_match_isoformat():
+    df = pandas.DataFrame({
+        "Fraction": pandas.to_datetime(["2024-01-04 09:00:00.5", "2024-01-05 15:30:00.0"]),
+        "Zoned": pandas.date_range("2024-01-04 09:00", periods=2, freq="D", tz="Asia/Tokyo"),
+    })
+    assert_same_records(data_frame_to_dict(df), serialize_legacy(df))
+
+# columns形式はrecords形式を列ごとに並べ直したもの
+def test_columns_orient(frame):
+    records = data_frame_to_dict(frame)
+    columns = data_frame_to_dict(frame, orient="columns")
+    assert list(columns) == list(frame.columns)
+    for name, values in columns.items():
+        assert all(same_value(a, record[name]) for a, record in zip(values, records))
+
+# precisionは小数の列だけを丸める
+def test_precision_rounds_float_columns_only(frame):
+    columns = data_frame_to_dict(frame, orient="columns", precision=2)
+    assert columns["Close"] == frame["Close"].round(2).tolist()
+    assert columns["Shares"] == frame["Shares"].tolist()
+
+def test_unknown_orient():
+    with pytest.raises(ValueError):
+        data_frame_to_dict(pandas.DataFrame({"a": [1]}), orient="index")
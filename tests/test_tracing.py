@@ -0,0 +1,37 @@
+from tracing import Tracer
+
+class Counter:
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self) -> int:
+        return self.queries
+
+# query_counterがある場合は、段階の中で増えたクエリ数を記録する（入れ子の段階のクエリは外側にも入る）
+def test_stage_records_query_difference():
+    tracer = Tracer()
+    counter = tracer.query_counter = Counter()
+
+    with tracer.stage("coverage"):
+        counter.queries += 1
+        with tracer.stage("select", rows=10):
+            counter.queries += 2
+    with tracer.stage("decode"):
+        pass
+
+    summary = tracer.summary()
+    assert summary["coverage"]["queries"] == 3
+    assert summary["select"]["queries"] == 2 and summary["select"]["rows"] == 10
+    assert "queries" not in summary["decode"]
+
+# 呼び出し1回分の内訳に段階の所要時間が入る
+def test_call_breakdown():
+    tracer = Tracer()
+    with tracer.call("get_price") as breakdown:
+        with tracer.stage("validation"):
+            pass
+        tracer.add("fetch", 0.5)
+
+    assert set(breakdown) == {"validation", "fetch", "total"}
+    assert breakdown["fetch"] == 500.0
+    assert tracer.summary()["get_price"]["count"] == 1
@@ -1,30 +1,96 @@
 import datetime as dt
 import enum
+import functools
+import json
 import pydantic
+import numpy
 import pandas
 import kabu
 from my_model import MyModel
 from my_logging import Logging
+from price_resampler import fit_to_rows, summarize_ohlcv
+from tracing import tracer, profile_call
 
-def data_frame_to_dict(df: pandas.DataFrame) -> dict:
-	# まず Python の基本型に変換
-	df = df.astype(object)
-	# numpy 型や datetime64 を Python の型に変換
-		# pandas 2.1以降はapplymapが非推奨になったらしいので置き換え
-		# df = df.applymap(lambda x: x.isoformat() if hasattr(x, "isoformat") else x)
-	df = df.map(lambda x:
-        x.isoformat() if hasattr(x, "isoformat") else
-        x.item() if hasattr(x, "item") else
-        x
-    )
+# DataFrameの1列をJSONにできるPythonの値のリストに変換する
+# 値ごとの判定はせず、列の型ごとにまとめて変換する
+def column_to_list(col: pandas.Series, precision: int | None = None) -> list:
+	dtype = col.dtype
 
-	return df.to_dict(orient="records")
+	# 日時は列ごとに一度だけ文字列にする（Timestamp.isoformat()と同じ形）
+	if pandas.api.types.is_datetime64_dtype(dtype):
+		values = col.to_numpy(dtype="datetime64[ns]")
+		# 秒未満の値を含む場合はisoformatと桁が変わるので個別に変換する
+		if (values[~numpy.isnat(values)].astype(numpy.int64) % 1_000_000_000 != 0).any():
+			return [x.isoformat() for x in col]
+		return numpy.datetime_as_string(values, unit="s").tolist()
 
+	# Int64などの欠損値を持てる整数の列は、欠損値（pandas.NA）をNoneにする
+	if pandas.api.types.is_extension_array_dtype(dtype) and pandas.api.types.is_integer_dtype(dtype):
+		return col.astype(object).where(col.notna(), None).tolist()
+
+	if pandas.api.types.is_numeric_dtype(dtype) or pandas.api.types.is_bool_dtype(dtype):
+		values = col.to_numpy()
+		if precision is not None and pandas.api.types.is_float_dtype(dtype):
+			values = numpy.round(values, precision)
+		return values.tolist()
+
+	# タイムゾーン付きの日時やobject型などはこれまで通り値ごとに変換する
+	return [
+		x.isoformat() if hasattr(x, "isoformat") else
+		x.item() if hasattr(x, "item") else
+		x
+		for x in col.astype(object)
+	]
+
+# DataFrameをLLMに返せる形に変換する
+# orient="records"：[{"Date": ..., "Open": ...}, ...]
+# orient="columns"：{"Date": [...], "Open": [...]}（キーの繰り返しがない分小さい）
+# precisionを指定した場合は小数の列をその桁数に丸める
+def data_frame_to_dict(df: pandas.DataFrame, orient: str = "records", precision: int | None = None) -> list[dict] | dict[str, list]:
+	with tracer.stage("serialize", rows=len(df)):
+		columns = {name: column_to_list(df[name], precision) for name in df.columns}
+
+	if orient == "columns":
+		return columns
+
+	if orient == "records":
+		names = list(columns.keys())
+		return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+	raise ValueError(f"orient must be 'records' or 'columns': {orient}")
+
+# トークン数の上限をrecords形式の行数に換算する
+# 先頭の行をJSONにした文字数から1行あたりのトークン数を見積もる（概ね4文字で1トークン）
+def rows_for_token_budget(df: pandas.DataFrame, max_tokens: int) -> int:
+	if max_tokens <= 0 or len(df) == 0:
+		return 0
+
+	row = data_frame_to_dict(df.iloc[:1])[0]
+	tokens_per_row = max(1, len(json.dumps(row, ensure_ascii=False)) // 4)
+	return max(1, max_tokens // tokens_per_row)
+
+# ツールの呼び出し1回分の段階ごと（validation、fetch、select、serializeなど）の所要時間をログに出す
+# Valvesのprofileを指定した場合は、その呼び出しのプロファイルもログに出す
+def traced(method):
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		with tracer.call(method.__name__) as breakdown:
+			if self.valves.profile:
+				result, profile = profile_call(self.valves.profile, method, self, *args, **kwargs)
+				self.log.emit("INFO", method.__name__, profile=profile)
+			else:
+				result = method(self, *args, **kwargs)
+
+		self.log.emit("INFO", method.__name__, stages_ms={name: round(ms, 3) for name, ms in breakdown.items()})
+		if self.valves.trace_file:
+			tracer.dump(self.valves.trace_file)
+		return result
+	return wrapper
 
 class GetCurrentPriceInput(kabu.GetCurrentPriceInput, MyModel):
-	ticker: str = pydantic.Field( ..., description="""
-		必ず証券コード＋市場サフィックスを指定してください。日本株は .T を付けます
-		例：トヨタの場合は7203.T、NTTの場合は9432.T、IHIの場合は7013.T
+	tickers: list[str] = pydantic.Field( ..., description="""
+		必ず証券コード＋市場サフィックスのリストを指定してください。日本株は .T を付けます
+		例：トヨタの場合は7203.T、NTTの場合は9432.T、IHIの場合は7013.T（複数銘柄は ["7203.T", "9432.T"]）
 		会社名ではなく証券コードを入力してください。""",
 	)
 
@@ -32,12 +98,54 @@ class GetPriceInput(kabu.GetPriceInput, MyModel):
 	ticker: str = pydantic.Field(..., description="証券コード+市場サフィックス（トヨタの場合は7203.Tなど）")
 	begin_range: dt.datetime = pydantic.Field(..., description="分析期間の開始日（yyyy-mm-dd）")
 	end_range: dt.datetime = pydantic.Field(..., description="分析期間の終了日（yyyy-mm-dd）")
-	chart_granularity: str = pydantic.Field(..., description="チャートの粒度（日足：daily）")
+	chart_granularity: str = pydantic.Field(..., description="チャートの粒度（日足：daily、週足：weekly、月足：monthly、1分足：minute、5分足：5minute　分足は記録対象の銘柄のみ）")
+
+class GetPricesInput(kabu.GetPricesInput, MyModel):
+	tickers: list[str] = pydantic.Field(..., description="比較する銘柄の証券コード+市場サフィックスのリスト（例：[\"7203.T\", \"7267.T\", \"7201.T\"]）")
+	begin_range: dt.datetime = pydantic.Field(..., description="分析期間の開始日（yyyy-mm-dd）")
+	end_range: dt.datetime = pydantic.Field(..., description="分析期間の終了日（yyyy-mm-dd）")
+	chart_granularity: str = pydantic.Field(..., description="チャートの粒度（日足：daily、週足：weekly、月足：monthly、1分足：minute、5分足：5minute　分足は記録対象の銘柄のみ）")
+
+class GetTechnicalAnalysisInput(kabu.GetPriceInput, MyModel):
+	ticker: str = pydantic.Field(..., description="証券コード+市場サフィックス（トヨタの場合は7203.Tなど）")
+	begin_range: dt.datetime = pydantic.Field(..., description="分析期間の開始日（yyyy-mm-dd）")
+	end_range: dt.datetime = pydantic.Field(..., description="分析期間の終了日（yyyy-mm-dd）")
+	chart_granularity: str = pydantic.Field(default="daily", description="指標は日足で計算するためdailyのみ")
+
+class ScreenCondition(kabu.ScreenCondition, MyModel):
+	field: str = pydantic.Field(..., description="判定する項目（Close、Change_pct（前日比%）、Volume、SMA_25、SMA_50、SMA_75、RSI_14、MACD、MACD_histogram、MACD_signal）")
+	op: str = pydantic.Field(..., description="比較（>、>=、<、<=、==）またはクロス（cross_above：下から上に抜けた、cross_below：上から下に抜けた）")
+	value: float | str = pydantic.Field(..., description="比べる相手（数値または項目名　例：RSI_14 < 30 の場合は30、ゴールデンクロスの場合はSMA_50）")
+	within: int = pydantic.Field(default=1, description="クロスの場合に何営業日前までを対象にするか（今週なら5）")
+
+class ScreenInput(kabu.ScreenInput, MyModel):
+	conditions: list[ScreenCondition] = pydantic.Field(..., description="すべてを満たす銘柄を探す条件のリスト")
+	sectors: list[str] = pydantic.Field(default=[], description="対象の業種名（東証33業種または17業種の名前　例：[\"化学\"]　空の場合は全業種）")
+	index_code: str | None = pydantic.Field(default=None, description="対象の指数コード（指定しない場合は全銘柄）")
+	sort_by: str | None = pydantic.Field(default=None, description="並び替える項目（conditionsのfieldと同じ項目）")
+	ascending: bool = pydantic.Field(default=False, description="昇順に並べるかどうか（既定は降順）")
+	limit: int = pydantic.Field(default=20, description="返す銘柄数の上限")
+
+class GetGroupAggregateInput(kabu.GetGroupAggregateInput, MyModel):
+	kind: str = pydantic.Field(..., description="集計の種類（業種：sector、指数：index）")
+	name: str = pydantic.Field(..., description="業種名（例：銀行業、化学）または指数コード")
+	classification: str = pydantic.Field(default="TSE33", description="業種の分類（東証33業種：TSE33、17業種：TOPIX17）")
+	begin_range: dt.datetime = pydantic.Field(..., description="分析期間の開始日（yyyy-mm-dd）")
+	end_range: dt.datetime = pydantic.Field(..., description="分析期間の終了日（yyyy-mm-dd）")
+	weighting: str = pydantic.Field(default="equal", description="リターンの平均の取り方（単純平均：equal、指数の構成比率による加重平均：weighted）")
 
 class Tools:
 	class Valves(pydantic.BaseModel):
 		is_logging: bool = pydantic.Field(default=False, description="ログファイルを生成するかどうか")
 		log_file_name: str = pydantic.Field(default="kabu-log.txt", description="ログファイル名")
+		log_level: str = pydantic.Field(default="INFO", description="ログの詳しさ（DEBUG：DataFrameの先頭・末尾の行も出す、INFO：行数と期間のみ、ERROR：エラーのみ）")
+		log_max_bytes: int = pydantic.Field(default=10 * 1024 * 1024, description="ログファイルを切り替える大きさ（バイト　古いファイルは.1～.3として残す）")
+		price_max_rows: int = pydantic.Field(default=0, description="get_priceが返す行数の上限（超える場合は週足・月足などにまとめ、要約を付ける　0は無制限）")
+		price_max_tokens: int = pydantic.Field(default=0, description="get_priceが返すデータのトークン数の目安（0は無制限　price_max_rowsと両方指定した場合は少ない方）")
+		price_store_directory: str = pydantic.Field(default="", description="確定済みの日足を置くローカルの列指向ストアのディレクトリ（pyarrowが必要　空の場合は使わない　別プロセスのeod_scheduler・intraday_captureには同じディレクトリを--column-storeで指定する）")
+		eod_scheduler: str = pydantic.Field(default="", description="引け後に当日の日足を先回りして取得し、キャッシュと指標を温める（hot：最近求められた銘柄、universe：全銘柄と業種・指数の集計値　空の場合は動かさない）")
+		profile: str = pydantic.Field(default="", description="呼び出しごとのプロファイルをログに出す（cprofile：関数ごとの累積時間、sample：一定間隔のスタックの集計　空の場合は出さない）")
+		trace_file: str = pydantic.Field(default="", description="段階ごとの所要時間の集計（p50/p95/p99）を呼び出しごとに書き出すファイル（.promの場合はPrometheusのテキスト形式、それ以外はJSON　空の場合は書き出さない）")
 	
 	b = kabu.Backend()
 	log: Logging = None
@@ -45,15 +153,69 @@ class Tools:
 	def __init__(self):
 		self.valves = self.Valves()
 
-		self.log = Logging(self.valves.log_file_name, self.valves.is_logging)
+		self.log = Logging(self.valves.log_file_name, self.valves.is_logging, self.valves.log_level, self.valves.log_max_bytes)
 
-	#def get_current_price(self, input: GetCurrentPriceInput) -> str:
-		#return self.b.get_current_price(input, self.log)
+	# 現在の株価（当日の始値・高値・安値・出来高を含む）を返す　銘柄コードをキーにした辞書
+	# 複数銘柄の現在値はget_current_priceを繰り返さずにtickersにまとめて指定する
+	@traced
+	def get_current_price(self, input: GetCurrentPriceInput) -> str:
+		return self.b.get_current_price(input, self.log)
     
 	# 指定範囲の株価情報をDBから読みだす　DBになければyfから取得する
+	# 行数・トークン数の上限を指定している場合は、上限に収まる粒度にまとめて期間の要約と使った粒度を付ける
+	@traced
 	def get_price(self, input: GetPriceInput) -> dict:
-		return data_frame_to_dict(self.b.get_price(input, self.log))
-    
-	#def do_technical_analysis(self, input: GetPriceInput) -> str:
-	#	df: pandas.DataFrame = self.b.get_price(input)
-	#	return self.b.do_technical_analysis(df).to_json(orient="records", date_format="iso")
\ No newline at end of file
+		self.b.set_column_store(self.valves.price_store_directory)
+		self.b.set_eod_scheduler(self.valves.eod_scheduler, self.log)
+		df = self.b.get_price(input, self.log)
+
+		max_rows = self.valves.price_max_rows
+		max_tokens_rows = rows_for_token_budget(df, self.valves.price_max_tokens)
+		if max_tokens_rows > 0:
+			max_rows = min(max_rows, max_tokens_rows) if max_rows > 0 else max_tokens_rows
+
+		if max_rows <= 0:
+			return data_frame_to_dict(df)
+
+		chart_granularity = input["chart_granularity"] if isinstance(input, dict) else input.chart_granularity
+		bars = df.set_index("Date")
+		resampled, granularity = fit_to_rows(bars, max_rows, self.b.normalize_granularity(chart_granularity))
+		return dict(
+			granularity = granularity,
+			summary = summarize_ohlcv(bars),
+			prices = data_frame_to_dict(resampled.rename_axis("Date").reset_index()),
+		)
+
+	# 複数銘柄の株価情報をまとめて取得する　銘柄の比較にはget_priceを繰り返さずにこちらを使う
+	@traced
+	def get_prices(self, input: GetPricesInput) -> dict:
+		return {ticker: data_frame_to_dict(df) for ticker, df in self.b.get_prices(input, self.log, by_ticker=True).items()}
+
+	# 指定範囲の日足にテクニカル指標（SMA25/50/75、RSI14、MACD）を付けて返す
+	# 指標の計算に必要な開始日より前の日足はこちらで読み込むので、分析したい期間だけを指定すればよい
+	@traced
+	def get_technical_analysis(self, input: GetTechnicalAnalysisInput) -> list:
+		self.b.set_column_store(self.valves.price_store_directory)
+		self.b.set_eod_scheduler(self.valves.eod_scheduler, self.log)
+		return data_frame_to_dict(self.b.get_technical_analysis(input, self.log))
+
+	# 条件（RSI、移動平均のクロスなど）に合う銘柄を全銘柄（業種・指数で絞り込み可）から探す
+	# 銘柄ごとにget_priceを繰り返さずにこちらを使う
+	@traced
+	def screen(self, input: ScreenInput) -> dict:
+		df = self.b.screen(input, self.log)
+		return dict(
+			matched = df.attrs["matched"],
+			results = data_frame_to_dict(df),
+		)
+
+	# 業種・指数の期間中のリターンと日ごとの推移（騰落銘柄数、SMAを上回る銘柄の割合）を返す
+	# 業種・指数の動きを調べる場合は構成銘柄ごとにget_priceを繰り返さずにこちらを使う
+	@traced
+	def get_group_aggregate(self, input: GetGroupAggregateInput) -> dict:
+		df = self.b.get_group_aggregate(input, self.log)
+		returns = df["Return_pct"].dropna().to_numpy() / 100
+		return dict(
+			change_pct = round(float((numpy.prod(1 + returns) - 1) * 100), 2) if len(returns) > 0 else None,
+			series = data_frame_to_dict(df),
+		)
\ No newline at end of file
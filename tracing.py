@@ -0,0 +1,176 @@
+import collections
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import numpy
+
+# 処理の段階ごとの所要時間と件数の記録
+# 段階：validation（入力チェック）、coverage（格納済み範囲の確認）、fetch（取得元からの取得）、insert（DBへの書き込み）、
+#       select（DBからの読み出し）、decode（読み出した配列からDataFrameへの変換）、indicators（指標の計算）、serialize（JSONにできる形への変換）
+# 段階ごとに直近WINDOW回の所要時間を持ち、p50/p95/p99を出す　件数（行数、クエリ数、取得したバイト数など）は合計を持つ
+# クエリ数はquery_counter（呼び出したスレッドで発行したクエリ数を返す関数　DBの層が設定する）の段階の前後の差で数える
+# with tracer.call("get_price") の中で記録した段階は、その呼び出し1回分の内訳としても集計する
+class Tracer:
+    STAGES = ["validation", "coverage", "fetch", "insert", "select", "decode", "indicators", "serialize"]
+
+    # 段階ごとに残す所要時間の件数
+    WINDOW = 2048
+
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._durations: dict[str, collections.deque] = {}
+        self._counts: dict[str, int] = collections.Counter()
+        self._totals: dict[str, float] = collections.Counter()
+        self._counters: dict[str, collections.Counter] = {}
+        self._local = threading.local()
+        # 呼び出したスレッドで発行したクエリ数を返す関数（Noneの場合はクエリ数を数えない）
+        self.query_counter = None
+
+    # 段階の所要時間を記録する　spanに入れた値は件数として合計する
+    # query_counterがある場合は、段階の中で発行したクエリ数をqueriesとして記録する（入れ子の段階のクエリも含む）
+    # ex) with tracer.stage("select") as span: ... span["rows"] = len(values)
+    @contextmanager
+    def stage(self, name: str, **counters):
+        span = dict(counters)
+        counter = self.query_counter
+        queries = counter() if counter is not None else 0
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            if counter is not None:
+                span["queries"] = counter() - queries
+            self.add(name, time.perf_counter() - started, **span)
+
+    def add(self, name: str, seconds: float, **counters) -> None:
+        with self._lock:
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = self._durations[name] = collections.deque(maxlen=self.window)
+                self._counters[name] = collections.Counter()
+            durations.append(seconds)
+            self._counts[name] += 1
+            self._totals[name] += seconds
+            self._counters[name].update({key: value for key, value in counters.items() if value})
+
+        # 呼び出し中であればその内訳にも加える
+        breakdown = getattr(self._local, "breakdown", None)
+        if breakdown is not None:
+            breakdown[name] = breakdown.get(name, 0.0) + seconds * 1000
+
+    # 呼び出し1回分の段階ごとの所要時間（ミリ秒）を集める
+    # 終わった時点で呼び出し全体もnameの段階として記録する
+    @contextmanager
+    def call(self, name: str):
+        outer = getattr(self._local, "breakdown", None)
+        breakdown = {}
+        self._local.breakdown = breakdown
+        started = time.perf_counter()
+        try:
+            yield breakdown
+        finally:
+            elapsed = time.perf_counter() - started
+            self._local.breakdown = outer
+            breakdown["total"] = elapsed * 1000
+            self.add(name, elapsed)
+
+    # 段階ごとの回数、合計、p50/p95/p99/最大（ミリ秒）と件数の合計
+    def summary(self) -> dict:
+        with self._lock:
+            snapshot = {name: (numpy.array(durations), self._counts[name], self._totals[name], dict(self._counters[name]))
+                        for name, durations in self._durations.items()}
+
+        result = {}
+        for name, (durations, count, total, counters) in snapshot.items():
+            p50, p95, p99 = numpy.percentile(durations * 1000, [50, 95, 99])
+            result[name] = dict(
+                count = count,
+                total_ms = round(total * 1000, 3),
+                p50_ms = round(float(p50), 3),
+                p95_ms = round(float(p95), 3),
+                p99_ms = round(float(p99), 3),
+                max_ms = round(float(durations.max() * 1000), 3),
+                **counters,
+            )
+        return result
+
+    # summaryをファイルに書き出す（拡張子が.promの場合はPrometheusのテキスト形式、それ以外はJSON）
+    # 収集側が書きかけのファイルを読まないように、別名で書いてから置き換える
+    def dump(self, path: str) -> None:
+        text = self.prometheus() if path.endswith(".prom") else json.dumps(self.summary(), ensure_ascii=False, indent=2)
+        temp = f"{path}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp, path)
+
+    # Prometheusのテキスト形式（収集用）
+    def prometheus(self) -> str:
+        lines = []
+        for name, stats in self.summary().items():
+            for q in ("p50", "p95", "p99"):
+                lines.append(f'kabu_stage_seconds{{stage="{name}",quantile="0.{q[1:]}"}} {stats[f"{q}_ms"] / 1000}')
+            lines.append(f'kabu_stage_seconds_sum{{stage="{name}"}} {stats["total_ms"] / 1000}')
+            lines.append(f'kabu_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+            for key, value in stats.items():
+                if key not in ("count", "total_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"):
+                    lines.append(f'kabu_stage_{key}_total{{stage="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+            self._totals.clear()
+            self._counters.clear()
+
+# プロセス全体で1つ
+tracer = Tracer()
+
+# funcを1回実行してプロファイルを取る
+# mode：cprofile（関数ごとの累積時間　上位limit件）、sample（interval秒ごとに呼び出し中のスタックを数える）
+# return：(funcの戻り値, プロファイルの文字列)
+def profile_call(mode: str, func, *args, limit: int = 30, interval: float = 0.005, **kwargs):
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        result = profiler.runcall(func, *args, **kwargs)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        return result, out.getvalue()
+
+    if mode == "sample":
+        # 別スレッドから呼び出し元のスレッドのスタックを定期的に覗く（呼び出し元の処理は止めない）
+        target = threading.get_ident()
+        samples = collections.Counter()
+        stop = threading.Event()
+
+        def sampler():
+            while not stop.wait(interval):
+                frame = sys._current_frames().get(target)
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_filename.rsplit('/', 1)[-1]}:{frame.f_code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                if stack:
+                    samples[" <- ".join(stack[:8])] += 1
+
+        thread = threading.Thread(target=sampler, name="profile_call", daemon=True)
+        thread.start()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            stop.set()
+            thread.join()
+
+        total = sum(samples.values())
+        lines = [f"{total} samples ({interval * 1000:.1f} ms interval)"]
+        lines += [f"{count:6d} {count / total * 100:5.1f}%  {stack}" for stack, count in samples.most_common(limit)]
+        return result, "\n".join(lines)
+
+    raise ValueError(f"未対応のプロファイルの種類です：{mode}（cprofile、sampleのいずれか）")
@@ -0,0 +1,124 @@
+import datetime as dt
+import threading
+import numpy
+import jpholiday
+
+# JPXの取引日カレンダー
+# 土日、祝日（jpholiday）、年末年始の休場日（12/31～1/3）を除いた日付を
+# ソート済みのdatetime64[D]配列として一度だけ作り、二分探索で引く
+# jpholidayは祝日を計算で求めるのでネットワークは不要
+class TradingCalendar:
+    # 祝日以外の休場日（月, 日）
+    MARKET_HOLIDAYS = [(12, 31), (1, 1), (1, 2), (1, 3)]
+
+    # first_year、last_year：カレンダーを作る年の範囲（last_yearを省略した場合は翌年まで）
+    # 範囲外の日付を引いた場合はその年まで広げて作り直す
+    def __init__(self, first_year: int = 2000, last_year: int | None = None):
+        if last_year is None:
+            last_year = dt.date.today().year + 1
+
+        if first_year > last_year:
+            raise ValueError("first_year must be less than or equal to last_year")
+
+        self._lock = threading.Lock()
+        self.build(first_year, last_year)
+
+    # first_year～last_yearの取引日の配列を作る
+    def build(self, first_year: int, last_year: int) -> None:
+        days = numpy.arange(f"{first_year}-01-01", f"{last_year + 1}-01-01", dtype="datetime64[D]")
+
+        holidays = []
+        for year in range(first_year, last_year + 1):
+            holidays += [d for d, _ in jpholiday.year_holidays(year)]
+            holidays += [dt.date(year, month, day) for month, day in self.MARKET_HOLIDAYS]
+
+        is_session = numpy.is_busday(days, holidays=numpy.array(holidays, dtype="datetime64[D]"))
+
+        self.first_year = first_year
+        self.last_year = last_year
+        # 参照中の配列は書き換えず、丸ごと差し替える
+        self.sessions = days[is_session]
+
+    # dがカレンダーの範囲に入るようにする
+    def _ensure_covers(self, d: dt.date) -> None:
+        if self.first_year <= d.year <= self.last_year:
+            return
+
+        with self._lock:
+            if d.year < self.first_year or self.last_year < d.year:
+                self.build(min(d.year, self.first_year), max(d.year, self.last_year))
+
+    # date、datetimeをdatetime64[D]に変換する
+    def _to_day(self, d: dt.date) -> numpy.datetime64:
+        if isinstance(d, dt.datetime):
+            d = d.date()
+        self._ensure_covers(d)
+        return numpy.datetime64(d, "D")
+
+    @staticmethod
+    def _to_date(d: numpy.datetime64) -> dt.date:
+        return d.astype("datetime64[D]").item()
+
+    # 取引日であるか
+    def is_session(self, d: dt.date) -> bool:
+        day = self._to_day(d)
+        i = numpy.searchsorted(self.sessions, day)
+        return i < len(self.sessions) and self.sessions[i] == day
+
+    # d以降（inclusive=Falseの場合はdより後）で最初の取引日
+    def next_session(self, d: dt.date, inclusive: bool = True) -> dt.date:
+        day = self._to_day(d)
+        i = numpy.searchsorted(self.sessions, day, side="left" if inclusive else "right")
+        if i >= len(self.sessions):
+            # 最終年の末尾を越えた場合は翌年まで広げる
+            self._ensure_covers(dt.date(self.last_year + 1, 1, 1))
+            return self.next_session(d, inclusive)
+
+        return self._to_date(self.sessions[i])
+
+    # d以前（inclusive=Falseの場合はdより前）で最後の取引日
+    def previous_session(self, d: dt.date, inclusive: bool = True) -> dt.date:
+        day = self._to_day(d)
+        i = numpy.searchsorted(self.sessions, day, side="right" if inclusive else "left")
+        if i <= 0:
+            # 最初の年より前に遡る場合は前年まで広げる
+            self._ensure_covers(dt.date(self.first_year - 1, 12, 31))
+            return self.previous_session(d, inclusive)
+
+        return self._to_date(self.sessions[i - 1])
+
+    # begin～end（両端を含む）の取引日の配列
+    def sessions_between(self, begin: dt.date, end: dt.date) -> numpy.ndarray:
+        first = self._to_day(begin)
+        last = self._to_day(end)
+        if first > last:
+            return self.sessions[:0]
+
+        i = numpy.searchsorted(self.sessions, first, side="left")
+        j = numpy.searchsorted(self.sessions, last, side="right")
+        return self.sessions[i:j]
+
+    # begin～end（両端を含む）の取引日の数
+    def count_sessions(self, begin: dt.date, end: dt.date) -> int:
+        return len(self.sessions_between(begin, end))
+
+    # begin～end（両端を含む）の取引日のリスト
+    def list_sessions(self, begin: dt.date, end: dt.date) -> list[dt.date]:
+        return self.sessions_between(begin, end).tolist()
+
+    # 取引日の配列を、カレンダー上で連続する取引日ごとの(最初の取引日, 最後の取引日)に分ける
+    # sessionsはソート済みで、すべて取引日であること
+    def split_runs(self, sessions: numpy.ndarray) -> list[tuple[dt.date, dt.date]]:
+        if len(sessions) == 0:
+            return []
+
+        sessions = numpy.asarray(sessions, dtype="datetime64[D]")
+        for d in (sessions[0], sessions[-1]):
+            self._ensure_covers(self._to_date(d))
+
+        positions = numpy.searchsorted(self.sessions, sessions)
+        # 位置が1つ以上飛んでいる所で区切る
+        breaks = numpy.flatnonzero(numpy.diff(positions) != 1) + 1
+        firsts = numpy.concatenate(([0], breaks))
+        lasts = numpy.concatenate((breaks - 1, [len(sessions) - 1]))
+        return [(self._to_date(sessions[i]), self._to_date(sessions[j])) for i, j in zip(firsts, lasts)]